@@ -16,6 +16,8 @@ import sys
 import subprocess
 import re
 import shlex
+import json
+from time import time, sleep
 from socket import gethostname
 from select import (poll, POLLPRI, POLLIN)
 from collections import namedtuple, Sequence
@@ -57,6 +59,26 @@ SAFE_ENV_VARS = ('HOME', 'EDITOR', 'TERM', 'PATH', 'PYTHONPATH',
                  'VIRTUAL_ENV', 'TZ', 'USER', 'SHELL')
 # ref: https://github.com/ansible/ansible/blob/devel/lib/ansible/constants.py
 
+# Workspace-relative file, kept updated while command/playbook items execute.
+# Allows external watchdogs to detect stalled / wedged items.
+PROGRESS_FILENAME = '.adept_progress'
+
+# Workspace-relative file, one JSON line appended per completed action item.
+# Consumed by adept_analyze.py to find slow and regressed items across runs.
+TIMING_FILENAME = '.adept_timing'
+
+# Shared by this and all nested adept.py processes, groups their timing records
+RUN_ID = os.environ.get('ADEPT_RUN_ID',
+                        '%s-%d-%d' % (MYHOSTNAME, os.getpid(), int(time())))
+
+
+def item_id(index):
+    """
+    Return string uniquely identifying action item index of this process
+    """
+    return '%s:%d:%s' % (MYHOSTNAME, os.getpid(), index)
+
+
 def highlight_normal(color_code=32):  # Green
     """
     If TERM env. var is not dumb or serial, return two color codes
@@ -302,6 +324,117 @@ class Parameters(Sequence):
         return self.showusage(msgfmt % (name, one_word))
 
 
+class Progress(object):
+
+    """
+    Rate-limited, atomic recorder of a running action item's progress
+
+    :param str filepath: Path to the progress file to (re)write
+    :param int index: Transition item number being executed
+    :param str xnpath: Path to transition file containing the item
+    :param str context: Name of context being transitioned
+    :param int pid: Process ID of child executing the item (optional)
+    """
+
+    # Minimum seconds between progress file updates
+    interval = 1.0
+
+    def __init__(self, filepath, index, xnpath, context, pid=None):
+        self.filepath = filepath
+        # Static identifying details, included in every update
+        self.item = {XTN: xnpath, 'context': context,
+                     'index': index, 'pid': pid}
+        self.start = self.last_line = time()
+        self.output_bytes = 0
+        self.returncode = None
+        # Output is unobservable when inherited, then only heartbeats are useful
+        self.observable = False
+        # Files written directly by the child, mapped to their last known size
+        self.files = {}
+        # Time of last successful write, zero means never written
+        self._written = 0
+
+    def watch(self, output_file=None):
+        """
+        Mark output as observable, optionally by the growth of output_file
+
+        :param file output_file: File the child writes to directly (optional)
+        """
+        self.observable = True
+        if output_file is not None:
+            self.files.setdefault(output_file.fileno(), 0)
+
+    def output(self, data):
+        """
+        Account for data having been relayed from the child
+
+        :param str data: Output just read from child process
+        """
+        self.observable = True
+        self.output_bytes += len(data)
+        if '\n' in data:
+            self.last_line = time()
+
+    def _stat_files(self):
+        # Only the size of files written by the child is visible
+        for fileno, size in self.files.items():
+            try:
+                new_size = os.fstat(fileno).st_size
+            except OSError:
+                continue
+            if new_size > size:
+                self.output_bytes += new_size - size
+                self.files[fileno] = new_size
+                self.last_line = time()
+
+    def asdict(self):
+        """
+        Return dictionary of current progress values
+        """
+        self._stat_files()
+        now = time()
+        result = dict(self.item)
+        if self.observable:
+            idle = round(now - self.last_line, 3)
+        else:
+            idle = None
+        result.update({'elapsed': round(now - self.start, 3),
+                       'output_bytes': self.output_bytes,
+                       'idle': idle,
+                       'updated': round(now, 3),
+                       'exit': self.returncode})
+        return result
+
+    def beat(self, force=False):
+        """
+        Atomically rewrite progress file, if interval has passed or force
+
+        :param bool force: When True, ignore interval
+        :returns: True if file was written, False otherwise
+        :rtype: bool
+        """
+        now = time()
+        if not force and now - self._written < self.interval:
+            return False
+        # Readers must never observe a partially written file
+        tmppath = '%s.%d' % (self.filepath, os.getpid())
+        try:
+            with open(tmppath, 'wb') as tmpfile:
+                json.dump(self.asdict(), tmpfile, sort_keys=True)
+            os.rename(tmppath, self.filepath)
+        except (IOError, OSError):
+            return False  # Never let progress reporting break execution
+        self._written = now
+        return True
+
+    def finish(self, returncode):
+        """
+        Record returncode and force final update of progress file
+        """
+        self.returncode = returncode
+        return self.beat(force=True)
+
+
 class ActionBase(object):
 
     """
@@ -368,7 +501,10 @@ class ActionBase(object):
                     'ADEPT_PATH': os.path.dirname(MYPATH),
                     'HOSTNAME': MYHOSTNAME,
                     'ADEPT_CONTEXT': self.parameters.context.strip(),
-                    'ADEPT_OPTIONAL': self.parameters.optional.strip()})
+                    'ADEPT_OPTIONAL': self.parameters.optional.strip(),
+                    # Allows nested adept.py timing to be related to this item
+                    'ADEPT_RUN_ID': RUN_ID,
+                    'ADEPT_PARENT_ITEM': item_id(self.index)})
         return env
 
     @staticmethod
@@ -421,6 +557,10 @@ class Command(ActionBase):
     :param str stdoutfile: Filename to send data, None for stdout.
     :param str stderrfile: Filename to send data, None for stderr.
     :param str exitfile: Filename to write exit code, None to return it.
+    :param bool capture: Relay stdout through a pipe when it would be inherited,
+                         so progress can count output bytes (default False).
+    :param list creates: Path(s) produced, skip item when newer than sources.
+    :param list sources: Path(s) consumed, used to determine if creates is stale.
     """
 
     # Input file path
@@ -432,6 +572,14 @@ class Command(ActionBase):
     stdoutfile = None
     stderrfile = None
     exitfile = None
+    # When True, pipe inherited stdout through swirly()
+    capture = False
+
+    # Absolute paths (after substitution) used to decide if action is needed
+    creates = None
+    sources = None
+    # True when every path in creates is newer than every path in sources
+    up_to_date = False
 
     def __str__(self, additional=None):
         mine = {'cmd': " ".join(self.popen_dargs['args'])}
@@ -446,6 +594,9 @@ class Command(ActionBase):
             thing = getattr(self, fname)
             if self._notspecial(thing):
                 mine[fname] = thing
+        for name in ('creates', 'sources'):
+            if getattr(self, name):
+                mine[name] = " ".join(getattr(self, name))
         return super(Command, self).__str__(mine)
 
     @staticmethod
@@ -473,15 +624,56 @@ class Command(ActionBase):
             return open(fileitem, "wb")
         return fileitem
 
+    def _norm_paths(self, new_env, paths):
+        if not paths:
+            return []
+        if isinstance(paths, basestring):
+            paths = [paths]
+        if not isinstance(paths, (list, tuple)):
+            self.yamlerr('parsing %s node' % self.__class__.__name__,
+                         'creates/sources must be a string or list, not %s'
+                         % str(paths))
+        # Global variables are also available, as they will be at action()
+        env = dict(new_env)
+        for key, val in (self.global_vars or {}).items():
+            env[key] = self.sub_env(env, val)
+        return [os.path.join(self.parameters.workspace,
+                             os.path.normpath(self.sub_env(env, path)))
+                for path in paths]
+
+    @staticmethod
+    def is_up_to_date(creates, sources):
+        """
+        Return True if all creates exist and none are older than any sources
+
+        :param list creates: Output file paths, if empty always returns False
+        :param list sources: Input file paths, missing ones mean out-of-date
+        """
+        if not creates:
+            return False
+        try:
+            oldest = min(os.stat(path).st_mtime for path in creates)
+            newest = max([os.stat(path).st_mtime for path in sources] or [0])
+        except OSError:
+            return False  # Missing input or output
+        return oldest >= newest
+
     def init_stdfiles(self, new_env, **dargs):
         """
         Opens files for stdoutfile, stderrfile, & exitfile
 
+        N/B: When item is up-to-date (see is_up_to_date()), stdoutfile and
+        stderrfile are not opened, so their contents are preserved.
+
         :param dict new_env: Possibly modified environment variables
         :param dict **dargs: Leftover/unparsed from init() call
         :raises ValueError: by yamlerr() on any additional darg keys
         """
         self.popen_dargs['cwd'] = self.parameters.workspace
+        self.creates = self._norm_paths(new_env, dargs.pop('creates', None))
+        self.sources = self._norm_paths(new_env, dargs.pop('sources', None))
+        self.up_to_date = self.is_up_to_date(self.creates, self.sources)
+        self.capture = bool(dargs.pop('capture', False))
         # Also used to translate meaning of '-' values
         defaults = {'stdout': None,
                     'stderr': subprocess.STDOUT,
@@ -489,10 +681,11 @@ class Command(ActionBase):
         # All but 'exit' have the same things done to them
         for name in ('stdout', 'stderr', 'exit'):
             namefile = '%sfile' % name
+            fileitem = dargs.pop(namefile, defaults[name])
+            if self.up_to_date and name != 'exit':
+                fileitem = defaults[name]  # Don't truncate prior output
             # Only attempt env. var sub on filename strings
-            setattr(self, namefile,
-                    self._norm_open(new_env,
-                                    dargs.pop(namefile, defaults[name])))
+            setattr(self, namefile, self._norm_open(new_env, fileitem))
         for name in ('stdout', 'stderr'):
             namefile = '%sfile' % name
             thing = getattr(self, namefile)
@@ -500,6 +693,9 @@ class Command(ActionBase):
                 self.popen_dargs[name] = thing
             elif thing == '-':
                 self.popen_dargs[name] = defaults[name]
+        # Child loses its TTY, so only when asked for
+        if self.capture and self.popen_dargs.get('stdout') is None:
+            self.popen_dargs['stdout'] = subprocess.PIPE
 
         # Any leftovers are unsupported
         extras = dargs.keys()
@@ -514,7 +710,8 @@ class Command(ActionBase):
 
         :param str filepath: Relative/Absolute path to file for this action
         :param str arguments: Additional items to pass when executing filepath
-        :param dict dargs: May contain paths stdoutfile, stderrfile, & exitfile
+        :param dict dargs: May contain paths stdoutfile, stderrfile, exitfile,
+                           and lists of paths creates & sources
         """
         self.popen_dargs = {'bufsize': 1,   # line buffered for swirly
                             'close_fds': False,  # Allow stdio passthrough
@@ -544,9 +741,12 @@ class Command(ActionBase):
         # Playbook class does the same thing
         self.init_stdfiles(new_env, **dargs)
 
-    def swirly(self, child_proc):
+    def swirly(self, child_proc, progress=None):
         """
         If stdout/stderr of child are pipes or files, buffers need flushing
+
+        :param child_proc: subprocess.Popen instance to relay output from
+        :param progress: Optional Progress instance to update while waiting
         """
         rod = poll()  # har har
         read_write_flush = {}
@@ -564,15 +764,31 @@ class Command(ActionBase):
                              'encountered unknown file %s'
                              % _file)
             # This makes operating on the poll events easier
-            read_write_flush[_file.fileno()] = (_file.read, writer, flusher)
+            read_write_flush[_file.fileno()] = (_file.fileno(), writer, flusher)
         # Until the child process is done
         while child_proc.poll() is None:
-            for _fd, event in rod.poll(100):  # miliseconds
-                # Only care if reading won't block
+            if read_write_flush:
+                events = rod.poll(100)  # miliseconds
+            else:  # Nothing (left) to relay, only heartbeats
+                events = []
+                sleep(0.1)
+            for _fd, event in events:
+                readfd, writer, flusher = read_write_flush[_fd]
+                data = ''
+                # Only read if it won't block
                 if event & (POLLIN | POLLPRI):
-                    reader, writer, flusher = read_write_flush[_fd]
-                    writer(reader(1))  # minimum required for event
-                    flusher()
+                    # Bypass file-object buffering, never blocks after POLLIN
+                    data = os.read(readfd, 4096)
+                if not data:  # End of file, hangup or error, stop polling it
+                    rod.unregister(_fd)
+                    del read_write_flush[_fd]
+                    continue
+                writer(data)
+                flusher()
+                if progress is not None:
+                    progress.output(data)
+            if progress is not None:
+                progress.beat()  # rate-limited
         return child_proc.returncode
 
     def process_global_vars(self):
@@ -589,6 +805,11 @@ class Command(ActionBase):
 
         N/B: Uses subprocess.Popen()
         """
+        if self.up_to_date:
+            sys.stderr.write('    up-to-date, skipping\n')
+            if self.exitfile is not None:
+                self.exitfile.write('0')
+            return 0
         cwd_default = self.popen_dargs.get('cwd', self.parameters.workspace)
         self.popen_dargs['cwd'] = cwd_default
         self.process_global_vars()
@@ -599,13 +820,29 @@ class Command(ActionBase):
                 raise
             raise OSError("[Errno 2] No such file or directory: %s"
                           % self.popen_dargs['executable'])
+        progress = Progress(os.path.join(self.parameters.workspace,
+                                         PROGRESS_FILENAME),
+                            self.index, getattr(self.parameters, XTN),
+                            self.parameters.context, child_proc.pid)
+        for output_file in (child_proc.stdout, child_proc.stderr):
+            if output_file:  # Relayed by swirly()
+                progress.watch()
+        for output_file in (self.stdoutfile, self.stderrfile):
+            if isinstance(output_file, file):
+                progress.watch(output_file)
+        progress.beat(force=True)
         # No need to display them if they're headed to a file
         if child_proc.stderr or child_proc.stdout:
             sys.stderr.write('stdout/stderr =\n')
-            self.swirly(child_proc)
+        # Relays output (if any) and updates progress until exit
+        self.swirly(child_proc, progress)
         # Process won't exit unless output pipes are clear
         (out, err) = child_proc.communicate()
         returncode = child_proc.returncode
+        for leftover in (out, err):
+            if leftover:
+                progress.output(leftover)
+        progress.finish(returncode)
         if err and child_proc.stderr:  # must be a pipe if non-None
             sys.stderr.write(err)
             sys.stderr.flush()
@@ -834,6 +1071,47 @@ ACTIONMAP = {'command': Command,
              'variable': Variable}
 
 
+def record_timing(parameters, action_item, start, end, exit_code):
+    """
+    Append JSON line describing completed action_item to workspace timing file
+
+    :param parameters: Parameters instance for this run
+    :param ActionBase action_item: Instance which was executed
+    :param float start: Time execution began
+    :param float end: Time execution completed
+    :param int exit_code: Value returned from executing action_item
+    :returns: True if record was written, False otherwise
+    :rtype: bool
+    """
+    xnpath = getattr(parameters, XTN)
+    # Workspaces are temporary, keep keys comparable between runs
+    prefix = os.path.join(parameters.workspace, '')
+    if xnpath.startswith(prefix):
+        xnpath = os.path.join('$WORKSPACE', xnpath[len(prefix):])
+    node_names = [node_name for node_name, klass in ACTIONMAP.iteritems()
+                  if klass is action_item.__class__]
+    record = {XTN: xnpath,
+              'index': action_item.index,
+              'node': node_names[0] if node_names
+                      else action_item.__class__.__name__.lower(),
+              'context': parameters.context,
+              'run': RUN_ID,
+              'item': item_id(action_item.index),
+              'parent': os.environ.get('ADEPT_PARENT_ITEM'),
+              'start': round(start, 3),
+              'end': round(end, 3),
+              'elapsed': round(end - start, 3),
+              'exit': exit_code}
+    try:
+        # Single small write to an O_APPEND file, won't interleave
+        with open(os.path.join(parameters.workspace,
+                               TIMING_FILENAME), 'ab') as timing_file:
+            timing_file.write(json.dumps(record, sort_keys=True) + '\n')
+    except (IOError, OSError):
+        return False  # Never let timing reporting break execution
+    return True
+
+
 def action_class(index, node_name, parameters_source=None):
 
     """
@@ -922,7 +1200,9 @@ def main(parameters_source=None, stdin=sys.stdin,
         yaml_document = load_all(yamlfile, Loader=Loader)
     exit_code = 0
     for action_item in action_items(yaml_document, parameters_source):
+        start = time()
         exit_code = action_item()  # executes it!
+        record_timing(parameters, action_item, start, time(), exit_code)
         if exit_code:
             stderr.write("    exit = %d\n" % exit_code)
             break
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+"""
+Summarizes action item timing records, written by adept.py, from many workspaces.
+
+Reports per-item latency percentiles, keyed by transition file, item index,
+and node type.  Items whose recent latency has grown beyond a threshold,
+compared to an earlier baseline window, are flagged as regressions.  The
+critical path through the most recent run (including items from nested
+adept.py processes) is also shown.
+
+Records are streamed, memory use depends on the number of distinct items,
+not the amount of history examined.  Exits non-zero if any regression found.
+
+Depends on: python-2.7
+"""
+
+import sys
+import os
+import os.path
+import json
+import math
+import argparse
+from bisect import bisect_right
+from time import time
+
+from adept import TIMING_FILENAME, XTN
+
+# Seconds per day, for window calculations
+DAY = 24 * 60 * 60
+
+
+class Histogram(object):
+
+    """
+    Fixed-size, log-scale histogram of durations in seconds
+
+    Percentiles are accurate to within one bucket (``ratio`` relative error).
+    """
+
+    # Lower bound of the first bucket, anything smaller is counted there
+    floor = 0.001
+    # Multiplier between bucket upper bounds
+    ratio = 1.1
+
+    def __init__(self):
+        # Sparse, bucket-number to count
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def bucket(self, value):
+        """Return bucket number for value"""
+        if value <= self.floor:
+            return 0
+        return int(math.ceil(math.log(value / self.floor, self.ratio)))
+
+    def upper(self, bucket):
+        """Return upper-bound value of bucket number"""
+        return self.floor * (self.ratio ** bucket)
+
+    def add(self, value):
+        """Account for one more value"""
+        bucket = self.bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def percentile(self, pct):
+        """
+        Return approximate value below which pct percent of values fall
+
+        :param float pct: Percentile from 0 to 100
+        :returns: Upper-bound of bucket containing percentile or None if empty
+        """
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(self.count * pct / 100.0)), 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # Never report more than was actually observed
+                return min(self.upper(bucket), self.maximum)
+        return self.maximum
+
+
+def timing_files(paths):
+    """
+    Yield timing file paths, directories are searched recursively
+
+    :param list paths: Workspace directories and/or timing file paths
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, _, filenames in os.walk(path):
+            if TIMING_FILENAME in filenames:
+                yield os.path.join(dirpath, TIMING_FILENAME)
+
+
+class Skipped(object):
+
+    """
+    Count of skipped files and malformed records, with the first few of each
+
+    :param int limit: Maximum number of descriptions to retain, of each kind
+    """
+
+    def __init__(self, limit=10):
+        self.limit = limit
+        self.files = []
+        self.records = []
+        self.record_count = 0
+
+    def file(self, filepath, xcept):
+        """Account for unreadable filepath, due to IOError xcept"""
+        if len(self.files) < self.limit:
+            self.files.append('%s: %s' % (filepath, xcept.strerror or xcept))
+
+    def record(self, filepath, lineno):
+        """Account for malformed record on line number lineno of filepath"""
+        self.record_count += 1
+        if len(self.records) < self.limit:
+            self.records.append('%s:%d' % (filepath, lineno))
+
+    def write(self, stream):
+        """Write description of everything skipped to stream"""
+        for description in self.files:
+            stream.write("Skipped unreadable file %s\n" % description)
+        for location in self.records:
+            stream.write("Skipped malformed record at %s\n" % location)
+        if self.record_count > len(self.records):
+            stream.write("Skipped %d more malformed records\n"
+                         % (self.record_count - len(self.records)))
+
+
+def records(paths, skipped=None):
+    """
+    Yield timing record dictionaries from all timing_files(paths)
+
+    Unreadable files and malformed records are skipped.
+
+    :param list paths: Workspace directories and/or timing file paths
+    :param Skipped skipped: Optional, accounts for everything skipped
+    """
+    for filepath in timing_files(paths):
+        try:
+            timing_file = open(filepath, 'rb')
+        except IOError, xcept:
+            if skipped is not None:
+                skipped.file(filepath, xcept)
+            continue
+        with timing_file:
+            for lineno, line in enumerate(timing_file):
+                try:
+                    record = json.loads(line)
+                    # Validate essential keys, everything else is optional
+                    record['start'] = float(record['start'])
+                    record['end'] = float(record['end'])
+                    record['elapsed'] = float(record['elapsed'])
+                except (ValueError, KeyError, TypeError):
+                    if skipped is not None:
+                        skipped.record(filepath, lineno + 1)
+                    continue
+                yield record
+
+
+def record_key(record):
+    """Return (xn file, item index, node type) tuple for record"""
+    return (record.get(XTN), record.get('index'), record.get('node'))
+
+
+def critical_path(run_records):
+    """
+    Return list of records forming the longest chain of sequential items
+
+    Items which have nested items (i.e. another item's parent) are replaced
+    by those nested items.  Remaining items are considered dependent when
+    one ended before the other started.
+
+    :param list run_records: Timing records belonging to a single run
+    """
+    parents = set(record.get('parent') for record in run_records)
+    leaves = sorted([record for record in run_records
+                     if record.get('item') not in parents],
+                    key=lambda record: record['end'])
+    ends = [record['end'] for record in leaves]
+    # Longest path ending at each leaf, and the leaf before it
+    best = []
+    previous = []
+    # Index of leaf with longest best[] among the first N leaves
+    leader = []
+    for record in leaves:
+        # Zero-length items may end where they start, never precede themselves
+        before = min(bisect_right(ends, record['start']), len(best))
+        if before:
+            prior = leader[before - 1]
+            best.append(best[prior] + record['elapsed'])
+            previous.append(prior)
+        else:
+            best.append(record['elapsed'])
+            previous.append(None)
+        current = len(best) - 1
+        if leader and best[leader[-1]] > best[current]:
+            leader.append(leader[-1])
+        else:
+            leader.append(current)
+    if not leaves:
+        return []
+    path = []
+    current = leader[-1]
+    while current is not None:
+        path.append(leaves[current])
+        current = previous[current]
+    path.reverse()
+    return path
+
+
+class Analysis(object):
+
+    """
+    Accumulates per-item statistics from a stream of timing records
+
+    :param float now: Time from which the recent window is measured
+    :param float recent_days: Width of window holding recent records
+    :param float baseline_days: Width of window preceding the recent window
+    """
+
+    def __init__(self, now, recent_days, baseline_days):
+        self.recent_start = now - recent_days * DAY
+        self.baseline_start = self.recent_start - baseline_days * DAY
+        # Maps record_key() to dictionary of histograms
+        self.items = {}
+        # Run of the most recently started item
+        self.latest_run = None
+        self.latest_start = None
+
+    def add(self, record):
+        """Account for a single timing record"""
+        stats = self.items.setdefault(record_key(record),
+                                      {'all': Histogram(),
+                                       'recent': Histogram(),
+                                       'baseline': Histogram()})
+        stats['all'].add(record['elapsed'])
+        if record['start'] >= self.recent_start:
+            stats['recent'].add(record['elapsed'])
+        elif record['start'] >= self.baseline_start:
+            stats['baseline'].add(record['elapsed'])
+        if self.latest_start is None or record['start'] > self.latest_start:
+            self.latest_start = record['start']
+            self.latest_run = record.get('run')
+
+    def slowest(self, top):
+        """Return up to top (key, histogram) items, highest total time first"""
+        ordered = sorted(self.items.iteritems(),
+                         key=lambda item: item[1]['all'].total, reverse=True)
+        return [(key, stats['all']) for key, stats in ordered[:top]]
+
+    def regressions(self, pct, threshold, min_samples):
+        """
+        Return list of (key, baseline, recent) percentile values which regressed
+
+        :param float pct: Percentile to compare
+        :param float threshold: Ratio of recent/baseline considered a regression
+        :param int min_samples: Minimum count required in both windows
+        """
+        result = []
+        for key, stats in sorted(self.items.iteritems()):
+            if min(stats['recent'].count,
+                   stats['baseline'].count) < min_samples:
+                continue
+            before = stats['baseline'].percentile(pct)
+            after = stats['recent'].percentile(pct)
+            if after > max(before, Histogram.floor) * threshold:
+                result.append((key, before, after))
+        return result
+
+
+def format_key(key):
+    """Return human-readable string for record_key() tuple"""
+    return '%s #%s (%s)' % key
+
+
+def report(analysis, run_records, args, stream):
+    """
+    Write human-readable summary to stream, return number of regressions
+
+    :param Analysis analysis: Populated from all records
+    :param list run_records: All records from the most recent run
+    :param args: Parsed command-line arguments
+    :param file stream: Where to write the report
+    """
+    stream.write("Slowest items by total time:\n")
+    for key, hist in analysis.slowest(args.top):
+        stream.write("    %s: n=%d total=%0.1fs p50=%0.3fs p90=%0.3fs"
+                     " p99=%0.3fs max=%0.3fs\n"
+                     % (format_key(key), hist.count, hist.total,
+                        hist.percentile(50), hist.percentile(90),
+                        hist.percentile(99), hist.maximum))
+    regressions = analysis.regressions(args.percentile, args.threshold,
+                                       args.min_samples)
+    stream.write("\nRegressions (p%g, recent %g days vs. previous %g days):\n"
+                 % (args.percentile, args.recent_days, args.baseline_days))
+    for key, before, after in regressions:
+        stream.write("    REGRESSION %s: %0.3fs -> %0.3fs\n"
+                     % (format_key(key), before, after))
+    if not regressions:
+        stream.write("    None\n")
+    if run_records:
+        path = critical_path(run_records)
+        stream.write("\nCritical path of run %s (%0.1fs):\n"
+                     % (analysis.latest_run,
+                        sum(record['elapsed'] for record in path)))
+        for record in path:
+            stream.write("    %0.3fs %s %s\n"
+                         % (record['elapsed'], format_key(record_key(record)),
+                            record.get('context')))
+    return len(regressions)
+
+
+def parse_args(argv):
+    """Return parsed command-line arguments"""
+    parser = argparse.ArgumentParser(prog=argv[0], description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='Workspace directory (searched recursively)'
+                             ' or timing file')
+    parser.add_argument('--top', default=20, type=int,
+                        help='Number of slowest items to show (default 20)')
+    parser.add_argument('--percentile', default=90.0, type=float,
+                        help='Percentile compared for regressions (default 90)')
+    parser.add_argument('--threshold', default=1.25, type=float,
+                        help='Ratio of recent/baseline percentile considered'
+                             ' a regression (default 1.25)')
+    parser.add_argument('--recent-days', default=7.0, type=float,
+                        help='Width of recent window in days (default 7)')
+    parser.add_argument('--baseline-days', default=28.0, type=float,
+                        help='Width of baseline window, preceding the recent'
+                             ' window, in days (default 28)')
+    parser.add_argument('--min-samples', default=5, type=int,
+                        help='Minimum records in both windows required to'
+                             ' flag a regression (default 5)')
+    parser.add_argument('--now', default=None, type=float,
+                        help='End of the recent window, as seconds since'
+                             ' the epoch (default: current time)')
+    parser.add_argument('--no-critical-path', default=False, action='store_true',
+                        help='Skip second pass over records for critical path')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=None, stdout=sys.stdout, stderr=sys.stderr):
+    """Analyze timing records from paths in argv, return exit code"""
+    if argv is None:
+        argv = sys.argv
+    args = parse_args(argv)
+    now = args.now
+    if now is None:
+        now = time()
+    analysis = Analysis(now, args.recent_days, args.baseline_days)
+    skipped = Skipped()
+    for record in records(args.paths, skipped):
+        analysis.add(record)
+    skipped.write(stderr)
+    run_records = []
+    if analysis.latest_run is not None and not args.no_critical_path:
+        # Second pass, only retains records of one run
+        run_records = [record for record in records(args.paths)
+                       if record.get('run') == analysis.latest_run]
+    return int(bool(report(analysis, run_records, args, stdout)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
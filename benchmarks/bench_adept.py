@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for adept.py, using synthetic transition files.
+
+Results are written as JSON, so they may be kept and compared between
+revisions to catch performance regressions.  For example::
+
+    $ ./benchmarks/bench_adept.py --output /tmp/before.json
+    ...make changes...
+    $ ./benchmarks/bench_adept.py --output /tmp/after.json \\
+                                  --compare /tmp/before.json
+
+Depends on: python-2.7 and PyYAML-3.10
+"""
+
+import sys
+import os
+import os.path
+import json
+import shutil
+import argparse
+import subprocess
+from tempfile import mkdtemp
+from timeit import default_timer
+from datetime import datetime
+
+# Benchmarks live one directory below the unit under test
+ADEPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ADEPT_DIR)
+import adept
+
+# Multiplied by --scale to determine size of synthetic inputs
+VARIABLES = 2000
+CHAIN_DEPTH = 200
+COMMANDS = 50
+OUTPUT_BYTES = 8 * 1024 * 1024
+
+
+def variables_xn(count):
+    """Return transition file contents setting count independent variables"""
+    items = ['---']
+    for index in xrange(count):
+        items.append('- variable: {name: "VAR_%d", value: "value_%d"}'
+                     % (index, index))
+    return '\n'.join(items) + '\n'
+
+
+def chain_xn(depth):
+    """Return transition file contents w/ each variable referencing the prior"""
+    items = ['---', '- variable: {name: "LINK_0", value: "base"}']
+    for index in xrange(1, depth):
+        items.append('- variable: {name: "LINK_%d", value: "${LINK_%d}/%d"}'
+                     % (index, index - 1, index))
+    # Substitutions happen again for every command
+    items.append('- command: {filepath: "/bin/true", arguments: "$LINK_%d"}'
+                 % (depth - 1))
+    return '\n'.join(items) + '\n'
+
+
+def commands_xn(count):
+    """Return transition file contents executing count trivial commands"""
+    items = ['---']
+    for _ in xrange(count):
+        items.append('- command: {filepath: "/bin/true", capture: true}')
+    return '\n'.join(items) + '\n'
+
+
+def output_xn(nbytes):
+    """Return transition file contents for command producing nbytes output"""
+    return ('---\n'
+            '- command:\n'
+            '    filepath: "/bin/bash"\n'
+            '    arguments: -c \'head -c %d /dev/zero | tr "\\\\0" "x" | fold\'\n'
+            '    capture: true\n'  # Relayed through swirly(), as measured
+            % nbytes)
+
+
+# re: to-few-public-methods: This is a context-manager - dunder methods
+class Workspace(object):  # pylint: disable=R0903
+    """
+    Context manager for a temporary workspace and (reset) adept module state
+
+    :param str name: Base-name for the transition file (without extension)
+    :param str contents: Contents of the transition file
+    """
+
+    def __init__(self, name, contents):
+        self.name = name
+        self.contents = contents
+        self.workspace = None
+        self.argv = None
+        self._stdout = None
+        self._stderr = None
+        self._fds = None
+
+    @staticmethod
+    def reset():
+        """Clear all singleton/global state maintained by adept module"""
+        adept.Parameters._singleton = None
+        adept.Parameters._initialized = False
+        adept.ActionBase.global_vars = None
+        adept.ActionBase.parameters_source = None
+
+    def __enter__(self):
+        self.reset()
+        self.workspace = mkdtemp(suffix='.adept.benchmark')
+        xnpath = os.path.join(self.workspace, '%s.%s' % (self.name, adept.XTN))
+        with open(xnpath, 'wb') as xnfile:
+            xnfile.write(self.contents)
+        self.argv = [adept.MYPATH, 'benchmark', self.workspace, xnpath]
+        # Display output would dominate measurements
+        self._stdout = sys.stdout
+        self._stderr = sys.stderr
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.stdout = sys.stderr = open(os.devnull, 'wb')
+        # Children not capturing output inherit the real file descriptors
+        self._fds = (os.dup(1), os.dup(2))
+        os.dup2(sys.stdout.fileno(), 1)
+        os.dup2(sys.stdout.fileno(), 2)
+        return self
+
+    def __exit__(self, *args, **dargs):
+        del args
+        del dargs
+        for fileno, saved in zip((1, 2), self._fds):
+            os.dup2(saved, fileno)
+            os.close(saved)
+        sys.stdout.close()
+        sys.stdout = self._stdout
+        sys.stderr = self._stderr
+        shutil.rmtree(self.workspace, ignore_errors=True)
+        self.reset()
+        return False
+
+
+def measure(func, repeat):
+    """
+    Call func() repeat times, return dictionary of timing statistics
+
+    :param callable func: Called with no arguments
+    :param int repeat: Number of times to call func
+    """
+    times = []
+    for _ in xrange(repeat):
+        start = default_timer()
+        func()
+        times.append(default_timer() - start)
+    times.sort()
+    return {'repeat': repeat,
+            'min': times[0],
+            'median': times[len(times) / 2],
+            'max': times[-1]}
+
+
+def bench_main(name, contents, repeat):
+    """Time main() end-to-end on a synthetic transition file"""
+    def _main():  # pylint: disable=C0111
+        with Workspace(name, contents) as wspc:
+            exit_code = adept.main(wspc.argv, stderr=sys.stderr)
+        if exit_code:
+            raise RuntimeError("main() exited %s for %s" % (exit_code, name))
+    return measure(_main, repeat)
+
+
+def bench_sub_env(count, repeat):
+    """Time sub_env() from count variables, over a string referencing some"""
+    env = dict([('VAR_%d' % idx, 'value_%d' % idx) for idx in xrange(count)])
+    in_string = ' '.join(['$VAR_%d ${VAR_%d}' % (idx, idx)
+                          for idx in xrange(0, count, 10)])
+    return measure(lambda: adept.ActionBase.sub_env(env, in_string), repeat)
+
+
+def bench_action_items(count, repeat):
+    """Time instantiating count variable items with action_items()"""
+    contents = variables_xn(count)
+    documents = list(adept.load_all(contents, Loader=adept.Loader))
+
+    def _action_items():  # pylint: disable=C0111
+        # action_items() pops keys from items
+        fresh = json.loads(json.dumps(documents))
+        with Workspace('action_items', contents) as wspc:
+            adept.Parameters(wspc.argv)
+            for _ in adept.action_items(fresh, wspc.argv):
+                pass
+    return measure(_action_items, repeat)
+
+
+def bench_swirly(nbytes, repeat):
+    """Time relaying nbytes of child output through Command.swirly()"""
+    command = ['/bin/bash', '-c', 'head -c %d /dev/zero' % nbytes]
+
+    def _swirly():  # pylint: disable=C0111
+        with Workspace('swirly', '---\n') as wspc:
+            adept.ActionBase.parameters_source = wspc.argv
+            relay = adept.Command(1, filepath='/bin/bash')
+            child = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=1)
+            relay.swirly(child)
+            child.communicate()
+    return measure(_swirly, repeat)
+
+
+def run_all(scale, repeat):
+    """Run all benchmarks, return dictionary of name to measurements"""
+    variables = max(int(VARIABLES * scale), 1)
+    depth = max(int(CHAIN_DEPTH * scale), 2)
+    commands = max(int(COMMANDS * scale), 1)
+    nbytes = max(int(OUTPUT_BYTES * scale), 1)
+    benchmarks = (
+        ('main_variables', lambda: bench_main('variables', variables_xn(variables),
+                                              repeat), {'items': variables}),
+        ('main_chain', lambda: bench_main('chain', chain_xn(depth), repeat),
+         {'depth': depth}),
+        ('main_commands', lambda: bench_main('commands', commands_xn(commands),
+                                             repeat), {'items': commands}),
+        ('main_output', lambda: bench_main('output', output_xn(nbytes), repeat),
+         {'bytes': nbytes}),
+        ('sub_env', lambda: bench_sub_env(variables, repeat), {'variables': variables}),
+        ('action_items', lambda: bench_action_items(variables, repeat),
+         {'items': variables}),
+        ('swirly', lambda: bench_swirly(nbytes, repeat), {'bytes': nbytes}))
+    results = {}
+    for name, bench, params in benchmarks:
+        sys.stderr.write("Running %s %s\n" % (name, params))
+        results[name] = bench()
+        results[name]['params'] = params
+    return results
+
+
+def revision():
+    """Return git revision of ADEPT_DIR or None"""
+    try:
+        with open(os.devnull, 'wb') as devnull:
+            return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                           cwd=ADEPT_DIR, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """
+    Return list of messages for each benchmark slower than baseline by threshold
+
+    :param dict baseline: Previously recorded results
+    :param dict current: Just measured results
+    :param float threshold: Ratio of current/baseline median considered a regression
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if not before or before.get('params') != result.get('params'):
+            continue  # not comparable
+        ratio = result['median'] / max(before['median'], 1e-9)
+        if ratio > threshold:
+            regressions.append("%s: median %0.4fs -> %0.4fs (x%0.2f)"
+                               % (name, before['median'], result['median'], ratio))
+    return regressions
+
+
+def parse_args(argv):
+    """Return parsed command-line arguments"""
+    parser = argparse.ArgumentParser(prog=argv[0], description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default=1.0, type=float,
+                        help='Multiplier for size of all synthetic inputs (default 1.0)')
+    parser.add_argument('--repeat', default=3, type=int,
+                        help='Number of times to repeat each benchmark (default 3)')
+    parser.add_argument('--output', default=None,
+                        help='Write results JSON to this file instead of stdout')
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help='Results JSON file to compare against, exit non-zero'
+                             ' if any benchmark regressed')
+    parser.add_argument('--threshold', default=1.25, type=float,
+                        help='Ratio of median times considered a regression'
+                             ' (default 1.25)')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    """Run benchmarks, record and optionally compare results"""
+    args = parse_args(argv)
+    current = {'revision': revision(),
+               'python': sys.version.split()[0],
+               'timestamp': datetime.utcnow().isoformat(),
+               'scale': args.scale,
+               'results': run_all(args.scale, args.repeat)}
+    if args.output:
+        with open(args.output, 'wb') as output:
+            json.dump(current, output, indent=2, sort_keys=True)
+    else:
+        json.dump(current, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare, 'rb') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, current, args.threshold)
+        for regression in regressions:
+            sys.stderr.write("REGRESSION %s\n" % regression)
+        return int(bool(regressions))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
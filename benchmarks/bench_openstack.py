@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for adept_openstack.py reaping, against a simulated tenant.
+
+Servers are copied from the recorded unittest fixture JSON, and served by a
+fake compute session adding --latency seconds to every request.  Results are
+written as JSON, in the same format as bench_adept.py, so they may be kept
+and compared between revisions.  For example::
+
+    $ ./benchmarks/bench_openstack.py --servers 1000 --output /tmp/reap.json
+
+Depends on: python-2.7 and virtualenv
+"""
+
+import sys
+import os
+import os.path
+import json
+import copy
+import time
+import logging
+import argparse
+from urlparse import urlparse, parse_qs
+from datetime import datetime
+from bench_adept import ADEPT_DIR, measure, revision, compare
+
+sys.path.insert(0, os.path.join(ADEPT_DIR, 'kommandir', 'bin'))
+import adept_openstack
+
+# Recorded server details used as a template for every simulated server
+FIXTURE = os.path.join(ADEPT_DIR, '.test_openstack_TestReap.test_death.json')
+
+
+class FakeCompute(object):
+    """
+    Standin for compute session, serving listings and details of servers
+
+    :param servers: List of server details dictionaries
+    :param latency: Seconds to sleep for every request
+    """
+
+    def __init__(self, servers, latency):
+        self.servers = servers
+        self.by_id = dict((server['id'], server) for server in servers)
+        self.latency = latency
+        self.requests = 0
+
+    def response(self, json_obj):
+        """Return object resembling a requests response of json_obj"""
+        self.requests += 1
+        time.sleep(self.latency)
+        return type('FakeResponse', (object,), dict(status_code=200,
+                                                    json=lambda _: json_obj))()
+
+    def get(self, uri):
+        """Respond to listing, detailed listing page, or single server request"""
+        parsed = urlparse(uri)
+        if parsed.path == '/servers':
+            return self.response(dict(servers=[dict(id=server['id'], name=server['name'])
+                                               for server in self.servers]))
+        if parsed.path == '/servers/detail':
+            query = parse_qs(parsed.query)
+            start = 0
+            if 'marker' in query:
+                start = self.servers.index(self.by_id[query['marker'][0]]) + 1
+            end = start + int(query['limit'][0])
+            page = dict(servers=self.servers[start:end])
+            if end < len(self.servers):
+                page['servers_links'] = [dict(rel='next', href=uri)]
+            return self.response(page)
+        return self.response(dict(server=self.by_id[parsed.path.split('/')[-1]]))
+
+
+def synthetic_servers(count):
+    """Return list of count server details, copied from the recorded fixture"""
+    with open(FIXTURE, 'rb') as fixture:
+        template = json.load(fixture)[0]['response']['servers'][0]
+    servers = []
+    for index in xrange(count):
+        server = copy.deepcopy(template)
+        server['id'] = 'server-%06d' % index
+        server['name'] = 'peon-%06d' % index
+        # Mix of expired, preserved, indefinite, and bad values
+        server['metadata'] = dict(preserve=('1', '100000', '-1', 'bad')[index % 4])
+        servers.append(server)
+    return servers
+
+
+def bench_reap(reaper, servers, latency, repeat):
+    """Time reaper() against a FakeCompute of servers, include request count"""
+    compute = FakeCompute(servers, latency)
+    adept_openstack.OpenstackREST.__clobber__()
+    adept_openstack.OpenstackREST.service_sessions = None
+    adept_openstack.OpenstackREST(dict(compute=compute))
+    result = measure(reaper, repeat)
+    result['requests'] = compute.requests / repeat
+    return result
+
+
+def per_server_reap():
+    """Evaluate expiration the way reap() did, one request per server"""
+    os_rest = adept_openstack.OpenstackREST()
+    for server_id in os_rest.server_list(key='id'):
+        os_rest.server_expires_at(server_id)
+
+
+def run_all(count, latency, repeat):
+    """Run all benchmarks, return dictionary of name to measurements"""
+    servers = synthetic_servers(count)
+    params = {'servers': count, 'latency': latency}
+    benchmarks = (
+        ('reap_per_server', per_server_reap),
+        ('reap_detail_sweep', lambda: adept_openstack.reap(dry_run=True)))
+    results = {}
+    for name, reaper in benchmarks:
+        sys.stderr.write("Running %s %s\n" % (name, params))
+        results[name] = bench_reap(reaper, servers, latency, repeat)
+        results[name]['params'] = params
+    return results
+
+
+def parse_args(argv):
+    """Return parsed command-line arguments"""
+    parser = argparse.ArgumentParser(prog=argv[0], description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', default=500, type=int,
+                        help='Number of servers in the simulated tenant (default 500)')
+    parser.add_argument('--latency', default=0.002, type=float,
+                        help='Seconds added to every simulated request (default 0.002)')
+    parser.add_argument('--repeat', default=3, type=int,
+                        help='Number of times to repeat each benchmark (default 3)')
+    parser.add_argument('--output', default=None,
+                        help='Write results JSON to this file instead of stdout')
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help='Results JSON file to compare against, exit non-zero'
+                             ' if any benchmark regressed')
+    parser.add_argument('--threshold', default=1.25, type=float,
+                        help='Ratio of median times considered a regression'
+                             ' (default 1.25)')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    """Run benchmarks, record and optionally compare results"""
+    args = parse_args(argv)
+    # Per-server messages would dominate measurements
+    logging.getLogger().setLevel(logging.ERROR)
+    current = {'revision': revision(),
+               'python': sys.version.split()[0],
+               'timestamp': datetime.utcnow().isoformat(),
+               'servers': args.servers,
+               'results': run_all(args.servers, args.latency, args.repeat)}
+    if args.output:
+        with open(args.output, 'wb') as output:
+            json.dump(current, output, indent=2, sort_keys=True)
+    else:
+        json.dump(current, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare, 'rb') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, current, args.threshold)
+        for regression in regressions:
+            sys.stderr.write("REGRESSION %s\n" % regression)
+        return int(bool(regressions))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
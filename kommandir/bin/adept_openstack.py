@@ -23,20 +23,33 @@ import os.path
 import logging
 import random
 import re
+import json
+import socket
+import traceback
+import threading
+from multiprocessing.pool import ThreadPool
+from heapq import heappush, heappop
+from collections import deque, OrderedDict
 from importlib import import_module
 from imp import find_module
 import time
 import datetime
 import argparse
 import subprocess
+import hashlib
 from base64 import b64encode
+from urllib import urlencode
+from errno import EDEADLK, ENOENT, ECONNREFUSED
+from contextlib import contextmanager
 import shutil
 import virtualenv
-from flock import Flock
+from flock import Flock, FairFlock, FlockSemaphore, FlockStore
+from lock_service import RemoteFlock
 
 # Operation is discovered by symlink name used to execute script,
 # e.g. 'openstack_exclusive_create'
-OPERATIONS = ('exclusive_create', 'discover_create', 'destroy', 'reap')
+OPERATIONS = ('exclusive_create', 'discover_create', 'destroy', 'reap', 'broker',
+              'batch_create')
 
 # Stringified form: list of the valid names for invoking this script.
 ALLOWED_NAMES = ', '.join(['"openstack_{}"'.format(_) for _ in OPERATIONS])
@@ -125,6 +138,15 @@ DEFAULT_TIMEOUT = 300
 
 DEFAULT_PRESERVE = 3
 
+# Seconds a global lock holder may go without renewing, before it may be broken.
+# Disabled by default, a broken lease unlinks the lockfile, even though its
+# previous holder may still be running.
+DEFAULT_LOCK_LEASE = 0
+
+# Most recent API responses, and their total content bytes, kept for diagnostics
+DEFAULT_HISTORY_COUNT = 100
+DEFAULT_HISTORY_BYTES = 4 * 1024 * 1024
+
 # Must use format dictionary w/ keys: name, ip_addr, and uuid
 OUTPUT_FORMAT = """---
 ansible_host: {ip_addr}
@@ -138,6 +160,28 @@ ansible_connection: ssh
 
 WORKSPACE_LOCKFILE_PREFIX = '.adept_job_workspace'
 GLOBAL_LOCKFILE_PREFIX = '.adept_global_floatingip'
+CREATE_LOCKFILE_PREFIX = '.adept_global_create'
+POLL_HISTORY_LOCKFILE_PREFIX = '.adept_poll_history'
+LOOKUP_CACHE_LOCKFILE_PREFIX = '.adept_lookup_cache'
+IP_POOL_LOCKFILE_PREFIX = '.adept_global_ip_pool'
+
+# Seconds flavor, image, and router lookups may be re-used, zero disables caching
+DEFAULT_LOOKUP_TTL = 0
+
+# Identifies the cloud in lookup cache keys, set from environment before it's cleared
+CLOUD_NAMESPACE = None
+
+# Names of TimeoutAction polling strategies, the first is the default
+POLL_STRATEGIES = ('fixed', 'exponential', 'predictive')
+
+# Unix socket, in the workspace, where a running broker accepts operations
+BROKER_SOCKET = '.adept_openstack_broker.sock'
+
+# Seconds without any operation, before the broker exits
+DEFAULT_BROKER_IDLE = 3600
+
+# Seconds between broker checks of authentication token expiration
+BROKER_REFRESH = 60
 
 
 class VerboseFilter(logging.Filter):
@@ -203,18 +247,178 @@ class Singleton(object):
         cls._singleton = None
 
 
-class OpenstackLock(Singleton, Flock):
+class OpenstackLock(Singleton, FairFlock):
     """
     Singleton security around critical (otherwise) non-atomic Openstack operations
+
+    Lock requests are served in order, so the (writing) floating-IP assignment
+    can't be starved by many (reading) processes polling for completion.  With
+    a lease, a hung or killed holder is broken by waiters once it expires.
     """
 
     # Only initialize singleton once
     # pylint: disable=W0231
-    def __init__(self, lockfilepath=None):
+    def __init__(self, lockfilepath=None, lease=None):
         del lockfilepath
+        del lease
+
+    def __new__init__(self, lockfilepath=None, lease=None):
+        super(OpenstackLock, self).__init__(lockfilepath, lease)
+
+
+class ResponseState(threading.local):
+    """
+    Most recent response instance, status code, and json() return, per thread
+    """
+
+    response_json = None
+    response_obj = None
+    response_code = None
+    # True when response_obj came from OpenstackREST.response_cache
+    response_cached = False
+    # Tuple of shared responses and owner, inside OpenstackREST.coalesced()
+    coalescing = None
+
+
+class ResponseHistory(deque):
+    """
+    Most recent response instances, oldest discarded beyond a count or content bytes
+
+    The newest response is always kept, even if it alone exceeds max_bytes.
+
+    :param max_count: Maximum number of responses to keep
+    :param max_bytes: Maximum total bytes of response content to keep
+    """
+
+    def __init__(self, max_count=DEFAULT_HISTORY_COUNT, max_bytes=DEFAULT_HISTORY_BYTES):
+        super(ResponseHistory, self).__init__()
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._lock = threading.Lock()  # Reaper threads share history
+
+    @staticmethod
+    def size(response):
+        """Return number of bytes of response content, zero if unknown"""
+        try:
+            return len(response.content)
+        except (AttributeError, TypeError):
+            return 0
 
-    def __new__init__(self, lockfilepath=None):
-        super(OpenstackLock, self).__init__(lockfilepath)
+    def append(self, response):
+        """Add response, discarding the oldest until within limits"""
+        with self._lock:
+            super(ResponseHistory, self).append(response)
+            self.nbytes += self.size(response)
+            while len(self) > max(self.max_count, 1) or (self.nbytes > self.max_bytes and
+                                                         len(self) > 1):
+                self.nbytes -= self.size(self.popleft())
+
+
+class ResponseRecorder(object):
+    """
+    Streams every API request and response to a JSON-lines file, as they happen
+
+    Each line is formatted as an entry of ``api_debug_dump()`` output.
+
+    :param path: File to (over)write lines to
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sequence_number = 0
+        self._lock = threading.Lock()  # Reaper threads share recorder
+        self._file = open(path, 'wb')
+
+    @staticmethod
+    def entry(response):
+        """Return dictionary of request method, URL, response JSON and status code"""
+        entry = {}
+        try:
+            entry[response.request.method] = response.request.url
+            entry['response'] = response.json()
+            entry['status_code'] = response.status_code
+        except (ValueError, AttributeError):
+            pass
+        return entry
+
+    def record(self, response):
+        """Write a line for response, with the next sequence number"""
+        entry = self.entry(response)
+        if not entry:
+            return
+        with self._lock:
+            # These are useful for creating unittest data + debugging unittests
+            entry['sequence_number'] = self.sequence_number
+            self.sequence_number += 10
+            self._file.write(json.dumps(entry, sort_keys=True) + '\n')
+            self._file.flush()  # Nothing held in memory
+
+    def close(self):
+        """Close the file, may call more than once"""
+        self._file.close()
+
+
+class LookupCache(object):
+    """
+    Name to ID lookups shared by processes, each re-used for ttl seconds
+
+    Kept in a ``FlockStore`` beside lockfilepath, where slot checksums
+    discard records torn by a crashed writer, and malformed or future-dated
+    records are ignored.  Missing values are looked up while holding the
+    write lock, so concurrent processes make one lookup between them.
+
+    :param lockfilepath: Path to lock file guarding the store
+    :param ttl: Seconds a looked up value may be re-used
+    :param namespace: Prefix for keys, distinguishing clouds sharing the store
+    """
+
+    def __init__(self, lockfilepath, ttl, namespace='default'):
+        self.store = FlockStore(Flock(lockfilepath), slot_size=1024)
+        self.ttl = ttl
+        self.namespace = namespace
+
+    def _fresh(self, key):
+        # Return cached record of key if valid and not expired, None otherwise
+        record = self.store.get(key)
+        try:
+            age = time.time() - float(record['time'])
+            if 0 <= age <= self.ttl and 'value' in record:
+                return record
+        except (TypeError, KeyError, ValueError):
+            if record is not None:
+                logging.warning("Ignoring malformed %s record %r", key, record)
+        return None
+
+    def get(self, key, lookup):
+        """Return cached value of key, or the cached return of calling lookup()"""
+        key = '%s:%s' % (self.namespace, key)
+        with self.store.lock.acquire_read():
+            record = self._fresh(key)
+        if record is None:
+            with self.store.lock.acquire_write():
+                record = self._fresh(key)  # Maybe another process just looked it up
+                if record is None:
+                    record = dict(time=time.time(), value=lookup())
+                    try:
+                        self.store.set(key, record)
+                    except ValueError, xcept:  # Full, still usable uncached
+                        logging.warning("Not caching %s: %s", key, xcept)
+                    return record['value']
+        logging.debug("Using cached %s: %s", key, record['value'])
+        return record['value']
+
+    def forget(self, *keys):
+        """Remove keys from the cache, e.g. when their values are found stale"""
+        with self.store.lock.acquire_write():
+            for key in keys:
+                self.store.delete('%s:%s' % (self.namespace, key))
+
+
+def _thread_state(name):
+    # Property reading/writing name on an instance's ResponseState
+    return property(lambda self: getattr(self.thread_state, name),
+                    lambda self, value: setattr(self.thread_state, name, value))
 
 
 class OpenstackREST(Singleton):
@@ -226,12 +430,33 @@ class OpenstackREST(Singleton):
                              (from os-client-config cloud instance)
     """
 
-    # Cache of current and previous response instances and json() return.
-    response_json = None
-    response_obj = None
-    response_code = None
-    # Useful for debugging purposes
+    # Cache of current response instance and json() return, separate for
+    # every thread, so workers don't clobber each other's results.
+    thread_state = None
+    response_json = _thread_state('response_json')
+    response_obj = _thread_state('response_obj')
+    response_code = _thread_state('response_code')
+    response_cached = _thread_state('response_cached')  # Already in history
+    coalescing = _thread_state('coalescing')
+    # Useful for debugging purposes, bounded to this many responses and content bytes
     previous_responses = None
+    history_count = DEFAULT_HISTORY_COUNT
+    history_bytes = DEFAULT_HISTORY_BYTES
+    # Optional ResponseRecorder, passed every response received
+    recorder = None
+    # Optional LookupCache, for flavor, image, and router lookups
+    lookup_cache = None
+    # Map of (service, uri) to (time.time(), response instance) of successful GETs
+    # made with max_age, at most cache_entries of the most recent
+    response_cache = None
+    cache_entries = 16
+    # Status codes meaning too many requests, retried at most this many times
+    rate_limited = (413, 429)
+    rate_limit_retries = 5
+    # Seconds polling loops may re-use a cached listing, instead of re-fetching
+    cache_ttl = 30
+    # Number of servers requested per page of detailed listing
+    page_size = 100
 
     float_ip_selector = staticmethod(random.choice)
 
@@ -242,11 +467,15 @@ class OpenstackREST(Singleton):
         if service_sessions is None and self.service_sessions is None:
             raise ValueError("service_sessions must be passed on first instantiation")
         self.service_sessions = service_sessions
+        self.thread_state = ResponseState()
+        self._cache_lock = threading.Lock()  # Reaper threads share response_cache
 
     def __init__(self, service_sessions=None):
         del service_sessions
         if self.previous_responses is None:
-            self.previous_responses = []
+            self.previous_responses = ResponseHistory(self.history_count, self.history_bytes)
+        if self.response_cache is None:
+            self.response_cache = OrderedDict()
 
     def raise_if(self, true_condition, xception, msg):
         """
@@ -256,7 +485,7 @@ class OpenstackREST(Singleton):
             return None
 
         if self.previous_responses:
-            responses = self.previous_responses + [self.response_obj]
+            responses = list(self.previous_responses) + [self.response_obj]
         elif self.response_obj:
             responses = [self.response_obj]
         else:
@@ -279,28 +508,49 @@ class OpenstackREST(Singleton):
         else:  # Exception previously raised, re-raise it.
             raise
 
-    def service_request(self, service, uri, unwrap=None, method='get', post_json=None):
+    def service_request(self, service, uri, unwrap=None, method='get', post_json=None,
+                        max_age=None):
         """
         Make a REST API call to uri, return optionally unwrapped json instance.
 
+        Successful GET responses made with max_age are cached, and any POST
+        or DELETE empties the cache.  Only GETs with max_age are answered from
+        the cache, or inside ``coalesced()``, by another owner's response.
+
         :param service: Name of service to request uri from
         :param uri: service URI for get, post, delete operation
         :param unwrap: Optional, unwrap object name from response
         :param method: Optional, http method to use, 'get', 'post', 'delete'.
         :param post_json: Optional, json instance to send with post method
+        :param max_age: Optional, seconds old a cached GET response may be
         :raise ValueError: If request was unsuccessful
         :raise KeyError: If unwrap key does not exist in response_json
         :returns: json instance
         """
         session = self.service_sessions[service]
-        if self.response_obj is not None:
+        if self.response_obj is not None and not self.response_cached:
             self.previous_responses.append(self.response_obj)
-        if method == 'get':
-            self.response_obj = session.get(uri)
-        elif method == 'post':
-            self.response_obj = session.post(uri, json=post_json)
-        elif method == 'delete':
-            self.response_obj = session.delete(uri)
+        self.response_cached = False
+        with self._cache_lock:
+            cached = self.response_cache.get((service, uri))
+        if method == 'get' and max_age is not None and cached is not None:
+            self.response_cached = time.time() - cached[0] <= max_age
+        shared, owner = self.coalescing or ({}, None)
+        if (method == 'get' and not self.response_cached and
+                shared.get((service, uri), (owner,))[0] is not owner):
+            self.response_cached = True
+            cached = shared[(service, uri)]
+        if self.response_cached:
+            logging.debug("Using cached %s response for %s", service, uri)
+            self.response_obj = cached[1]
+        elif method in ('get', 'post', 'delete'):
+            if method != 'get':
+                with self._cache_lock:
+                    self.response_cache.clear()  # Anything could have changed
+                shared.clear()
+            self.response_obj = self._send(session, uri, method, post_json)
+            if self.recorder is not None:
+                self.recorder.record(self.response_obj)
         else:
             self.raise_if(True,
                           ValueError,
@@ -310,6 +560,10 @@ class OpenstackREST(Singleton):
         self.raise_if(self.response_code not in [200, 201, 202, 204],
                       ValueError, "Failed: %s request to %s: %s" % (method, uri,
                                                                     self.response_code))
+        if method == 'get' and not self.response_cached:
+            if max_age is not None:  # Nobody else could use it
+                self._cache_response(service, uri)
+            shared[(service, uri)] = (owner, self.response_obj)
 
         try:
             self.response_json = self.response_obj.json()
@@ -325,11 +579,68 @@ class OpenstackREST(Singleton):
             return self.response_json
         return self.response_json
 
-    def compute_request(self, uri, unwrap=None, method='get', post_json=None):
+    @contextmanager
+    def coalesced(self, shared, owner):
+        """
+        Context manager answering GETs from responses to the same request by other owners
+
+        :param shared: Dictionary of (service, uri) to (owner, response), filled
+                       by successful GETs and emptied by any POST or DELETE.
+        :param owner: Any object identifying the current requester
+        """
+        previous = self.coalescing
+        self.coalescing = (shared, owner)
+        try:
+            yield
+        finally:
+            self.coalescing = previous
+
+    def _send(self, session, uri, method, post_json):
+        # Return response of request, backing off and retrying while rate limited
+        for attempt in xrange(self.rate_limit_retries + 1):
+            if method == 'get':
+                response = session.get(uri)
+            elif method == 'post':
+                response = session.post(uri, json=post_json)
+            else:
+                response = session.delete(uri)
+            if (int(response.status_code) not in self.rate_limited or
+                    attempt == self.rate_limit_retries):
+                break
+            try:
+                delay = float(response.headers.get('Retry-After'))
+            except (AttributeError, TypeError, ValueError):
+                delay = 2 ** attempt
+            delay *= random.uniform(1.0, 1.5)  # Don't all retry at once
+            logging.warning("Rate limited making %s request to %s, retrying in %0.1fs",
+                            method, uri, delay)
+            time.sleep(delay)
+        return response
+
+    def cached_lookup(self, key, lookup):
+        """Return value of calling lookup(), from lookup_cache under key when enabled"""
+        if self.lookup_cache is None:
+            return lookup()
+        return self.lookup_cache.get(key, lookup)
+
+    def forget_lookups(self, *keys):
+        """Remove keys from lookup_cache when enabled, e.g. when a value was stale"""
+        if self.lookup_cache is not None:
+            self.lookup_cache.forget(*keys)
+
+    def _cache_response(self, service, uri):
+        # Add response_obj to response_cache, discarding the oldest beyond cache_entries
+        with self._cache_lock:
+            self.response_cache.pop((service, uri), None)  # Newest last
+            self.response_cache[(service, uri)] = (time.time(), self.response_obj)
+            while len(self.response_cache) > self.cache_entries:
+                self.response_cache.popitem(last=False)
+
+    def compute_request(self, uri, unwrap=None, method='get', post_json=None, max_age=None):
         """
-        Short-hand for ``service_request('compute', uri, unwrap, method, post_json)``
+        Short-hand for ``service_request('compute', uri, unwrap, method, post_json, max_age)``
         """
-        return self.service_request('compute', uri, unwrap, method, post_json)
+        return self.service_request('compute', uri, unwrap, method, post_json, max_age)
 
     def volume_request(self, uri, unwrap=None, method='get', post_json=None):
         """
@@ -368,18 +679,81 @@ class OpenstackREST(Singleton):
                  if key in child]
         return found
 
-    def server_list(self, key='name'):
+    def listing(self, service, uri, collection, max_age=None, **filters):
+        """
+        Generate every item of a collection, requesting a page at a time
+
+        :param service: Name of service to request uri from
+        :param uri: service URI of the collection, without any query
+        :param collection: Name of item list in each page (e.g. 'servers')
+        :param max_age: Optional, seconds old a cached page may be
+        :param filters: Optional, query parameters the service filters items by
+        :N/B: Each page replaces response_json, and deleting the last item
+              on a page before the next is requested breaks the sequence.
+        """
+        query = [('limit', self.page_size)] + sorted(filters.items())
+        page_uri = '%s?%s' % (uri, urlencode(query))
+        while True:
+            page = self.service_request(service, page_uri, max_age=max_age)
+            items = page.get(collection, [])
+            for item in items:
+                yield item
+            if not items or not [link for link in page.get('%s_links' % collection, [])
+                                 if link.get('rel') == 'next']:
+                return
+            page_uri = '%s?%s' % (uri, urlencode(query + [('marker', items[-1]['id'])]))
+
+    def servers(self, name=None, max_age=None, names=None):
+        """
+        Generate brief dictionary of every server, or only those named name(s)
+
+        :param name: Optional, exact name of servers to list
+        :param max_age: Optional, seconds old a cached page may be
+        :param names: Optional, list of exact names of servers to list
+        """
+        if name is not None:
+            names = [name]
+        if names is None:
+            filters = {}
+        else:
+            names = sorted(set(names))
+            filters = dict(name=self.name_filter(*names))
+        for server in self.listing('compute', '/servers', 'servers', max_age, **filters):
+            if names is None or server.get('name') in names:
+                yield server
+
+    @staticmethod
+    def name_filter(*names):
+        """
+        Return server name filter, a regular expression matching only names
+
+        :N/B: Service matches the expression, which is not always anchored
+        """
+        escaped = [re.sub(r'([\\.^$*+?{}\[\]|()])', r'\\\1', name) for name in names]
+        if len(escaped) == 1:
+            return '^%s$' % escaped[0]
+        return '^(%s)$' % '|'.join(escaped)
+
+    def server_list(self, key='name', max_age=None, name=None):
         """
         Cache list of servers and return list of values for key
 
         :param key: key to list values for (e.g. 'id')
+        :param max_age: Optional, seconds old a cached listing may be
+        :param name: Optional, only list servers with this exact name
         :returns: List of values for key
         """
-        self.compute_request('/servers', 'servers')
-        try:
-            return self.child_search(key)
-        except IndexError:
-            return []
+        return [server[key] for server in self.servers(name, max_age)
+                if key in server]
+
+    def server_details(self):
+        """
+        Generate details dictionary of every server, requesting a page at a time
+
+        :N/B: Each page replaces response_json, and deleting the last server
+              on a page before the next is requested breaks the sequence.
+        """
+        return self.listing('compute', '/servers/detail', 'servers')
 
     def server(self, name=None, uuid=None):
         """
@@ -393,9 +767,9 @@ class OpenstackREST(Singleton):
                       ValueError,
                       "Must provide either name or uuid")
         if name:
-            self.compute_request('/servers', 'servers')
-            server_details = self.child_search(key='name', value=name)
-            uri = '/servers/%s' % server_details['id']
+            found = list(self.servers(name))
+            self.raise_if(not found, IndexError, 'Could not find server %s' % name)
+            uri = '/servers/%s' % found[0]['id']
         elif uuid:
             uri = '/servers/%s' % uuid
         return self.compute_request(uri, unwrap='server')
@@ -433,6 +807,17 @@ class OpenstackREST(Singleton):
             logging.debug("Retrieving details about server %s failed. Returning"
                           " infinite lifetime.", uuid)
             return None  # server disappeared, this is okay in a reaper-context
+        return self.expiration(server_details)
+
+    @staticmethod
+    def expiration(server_details):
+        """
+        Return UTC datetime when server should be reaped, -1 for never, None if unknown
+
+        :param server_details: Dictionary of server details, from any listing
+                               or request which includes metadata and launch time.
+        """
+        uuid = server_details.get('id')
         metadata = server_details.get('metadata', dict(preserve=DEFAULT_PRESERVE))
 
         try:
@@ -463,35 +848,44 @@ class OpenstackREST(Singleton):
 
     def server_delete(self, uuid):
         """
-        Cache list of servers, try to delete server by uuid.
+        Try to delete server by uuid, caller must check if it's gone.
 
         :param uuid: Unique ID of server to delete
-        :returns: Listing of server IDs (may include uuid)
         """
         try:
             self.compute_request('/servers/%s' % uuid, method='delete')
         # This can fail for any number of reasons, let caller deal with them
         except Exception, xcept:
             logging.warning("server_delete(%s) raised %s", uuid, xcept)
-        return self.server_list(key='id')
 
-    def floating_ip(self):
+    def floating_ips(self, net_id=None, status=None):
         """
-        Cache list of floating IPs, return random un-assigned or None
+        Generate details dictionary of floating IPs, optionally filtered
 
+        :param net_id: Optional, only list IPs routed to this external network ID
+        :param status: Optional, only list IPs with this status (e.g. 'DOWN')
+        """
+        filters = {}
+        if net_id is not None:
+            filters['floating_network_id'] = net_id
+        if status is not None:
+            filters['status'] = status
+        for floating in self.listing('network', '/v2.0/floatingips', 'floatingips', **filters):
+            if all(floating.get(key) == value for key, value in filters.items()):
+                yield floating
+
+    def floating_ip(self, net_id=None):
+        """
+        Cache list of un-assigned floating IPs, return random one or None
+
+        :param net_id: Optional, only select IPs routed to this external network ID
         :returns: IP address string or None
         """
-        self.service_request('network', '/v2.0/floatingips', 'floatingips')
-        try:
-            # child_search() always/only returns first, match.  Use float_ip_selector() instead.
-            search_list = self.response_json
-            self.raise_if(search_list is None,
-                          TypeError, "No requests have been made/cached")
-            found = [child for child in search_list if child.get('status') == 'DOWN']
-            self.raise_if(not found, IndexError, 'Could not find available floating IP')
-            return self.float_ip_selector(found).get('floating_ip_address')
-        except (KeyError, IndexError):
+        found = list(self.floating_ips(net_id, 'DOWN'))
+        if not found:
             return None
+        # child_search() always/only returns first, match.  Use float_ip_selector() instead.
+        return self.float_ip_selector(found).get('floating_ip_address')
 
     def create_floating_ip(self, net_id):
         """
@@ -513,12 +907,18 @@ class OpenstackREST(Singleton):
         long_key = 'os-extended-volumes:volumes_attached'
         return self.child_search('id', alt_list=self.server(name, uuid)[long_key])
 
-    def volume_list(self):
+    def volume_list(self, name=None):
         """
         Cache list of volumes, return list of volume ID's
+
+        :param name: Optional, only list volumes with this exact name
         """
-        self.volume_request('/volumes', 'volumes')
-        return self.child_search('id')
+        filters = {}
+        if name is not None:
+            filters['name'] = name
+        return [volume['id']
+                for volume in self.listing('volume', '/volumes', 'volumes', **filters)
+                if 'id' in volume and (name is None or volume.get('name') == name)]
 
     def volume(self, uuid):
         """
@@ -529,12 +929,110 @@ class OpenstackREST(Singleton):
         return self.volume_request('/volumes/%s' % uuid, 'volume')
 
 
+class PollFixed(object):
+    """Polling strategy sleeping the action's fixed ``sleep`` seconds between polls"""
+
+    def delays(self, action):
+        """Generate seconds to sleep before each ``am_done()`` call of action"""
+        while True:
+            yield action.sleep
+
+    def record(self, action, start, delay):
+        """
+        Learn from action completing successfully
+
+        :param action: The TimeoutAction instance which completed
+        :param start: Time action was called
+        :param delay: Seconds slept before the successful poll
+        """
+        del action, start, delay  # Fixed strategy doesn't learn
+
+
+class PollExponential(PollFixed):
+    """
+    Polling strategy sleeping initial seconds, multiplied by factor every poll, up to cap
+
+    :param initial: Seconds to sleep before the first poll
+    :param factor: Multiplier applied to the sleep after every poll
+    :param cap: Maximum seconds to sleep between polls
+    """
+
+    def __init__(self, initial=0.5, factor=2.0, cap=10.0):
+        self.initial = initial
+        self.factor = factor
+        self.cap = cap
+
+    def delays(self, action):
+        delay = self.initial
+        while True:
+            yield min(delay, self.cap)
+            delay *= self.factor
+
+
+class PollPredictive(PollExponential):
+    """
+    Polling strategy sleeping until an action is likely done, then polling exponentially
+
+    Recent completion times of every action class are recorded, in a
+    ``FlockStore`` beside lockfilepath when given, so separate processes learn
+    from each other.  Until enough are recorded, behaves as ``PollExponential``.
+
+    :param lockfilepath: Optional, path to lock file guarding the history store
+    :param dargs: Passed through to ``PollExponential``
+    """
+
+    samples = 20  # Completion times kept per action class
+    minimum = 3  # Completion times required before predicting
+    quantile = 0.25  # Fraction of recent completions done before the first poll
+
+    def __init__(self, lockfilepath=None, **dargs):
+        super(PollPredictive, self).__init__(**dargs)
+        self.history = {}
+        self.store = None
+        if lockfilepath:
+            self.store = FlockStore(Flock(lockfilepath), slot_size=1024)
+
+    def completions(self, action):
+        """Return list of recent completion times recorded for action's class"""
+        key = action.__class__.__name__
+        if self.store is None:
+            return list(self.history.get(key, []))
+        with self.store.lock.acquire_read():
+            return self.store.get(key, [])
+
+    def predicted(self, action):
+        """Return seconds by which action is likely done, None without enough history"""
+        completions = sorted(self.completions(action))
+        if len(completions) < self.minimum:
+            return None
+        return completions[int(self.quantile * (len(completions) - 1))]
+
+    def delays(self, action):
+        predicted = self.predicted(action)
+        if predicted:
+            logging.debug("Predicting %s done in %0.2fs", action.__class__.__name__, predicted)
+            yield predicted
+        for delay in super(PollPredictive, self).delays(action):
+            yield delay
+
+    def record(self, action, start, delay):
+        key = action.__class__.__name__
+        # Completion happened sometime after the previous poll, assume halfway
+        elapsed = round(max(time.time() - start - delay / 2.0, 0), 3)
+        if self.store is None:
+            self.history[key] = (self.history.get(key, []) + [elapsed])[-self.samples:]
+            return
+        with self.store.lock.acquire_write():
+            self.store.set(key, (self.store.get(key, []) + [elapsed])[-self.samples:])
+
+
 class TimeoutAction(object):
     """
     ABC callable, raises an exception on timeout, or returns non-None value of done()
     """
 
     sleep = 1  # Sleep time per iteration, avoids busy-waiting.
+    poll = PollFixed()  # Strategy deciding sleep time per iteration
     # N/B: timeout value referenced outside of class (I know I'm lazy)
     timeout = DEFAULT_TIMEOUT  # (seconds)
     time_out_at = None  # absolute
@@ -562,13 +1060,21 @@ class TimeoutAction(object):
         start = time.time()
         if self.time_out_at is None:
             self.time_out_at = start + self.timeout
+        delays = self.poll.delays(self)
         while result is None:
-            if time.time() >= self.time_out_at:
+            now = time.time()
+            if now >= self.time_out_at:
                 raise self.timeout_exception(str(self))
-            time.sleep(self.sleep)
-            result = self.am_done(*self._args, **self._dargs)
+            delay = min(next(delays), self.time_out_at - now)
+            time.sleep(delay)
+            result = self.check()
+        self.poll.record(self, start, delay)
         return result
 
+    def check(self):
+        """Return result of calling ``am_done()`` once, with the initialized arguments"""
+        return self.am_done(*self._args, **self._dargs)
+
     def timeout_remaining(self):
         """Return the amount of time in seconds remaining before timeout"""
         if self.time_out_at is None:
@@ -598,13 +1104,16 @@ class TimeoutDelete(TimeoutAction):
         super(TimeoutDelete, self).__init__(server_id)
 
     def am_done(self, server_id):
-        """Return remaining ids when server_id not found, None if still present."""
-        server_ids = self.os_rest.server_list(key='id')
-        if server_id in server_ids:
-            logging.info(">    Deleting %s", server_id)
-            return None
-        logging.info("Confirmed VM %s does not exist", server_id)
-        return server_ids
+        """Return server_id when it's not found, None if still present."""
+        try:
+            self.os_rest.server(uuid=server_id)
+        except ValueError:
+            if self.os_rest.response_code != 404:
+                raise
+            logging.info("Confirmed VM %s does not exist", server_id)
+            return server_id
+        logging.info(">    Deleting %s", server_id)
+        return None
 
 
 class TimeoutCreate(TimeoutAction):
@@ -638,20 +1147,52 @@ class TimeoutCreate(TimeoutAction):
                          deletion.  Only makes sense when a periodic 'reaper' run is configured.
         """
         self.os_rest = OpenstackREST()
+        flavor_ref, image_ref = self.flavor_image_refs(self.os_rest, flavor, image)
+        server_json = self.server_json(name, flavor_ref, image_ref,
+                                       self.userdata(auth_key_lines, userdata_filepath),
+                                       preserve)
 
-        self.os_rest.compute_request('/flavors', 'flavors')
-        flavor_details = self.os_rest.child_search('name', flavor)
-        logging.debug("Flavor %s is id %s", flavor, flavor_details['id'])
+        # Immediatly bail out if somehow another server exists with name
+        if self.os_rest.server_list(name=name).count(name) > 1:
+            raise RuntimeError("More than one server %s found during creation", name)
 
-        # Faster for the server to search for this
-        image_details = self.os_rest.service_request('image',
-                                                     '/v2/images?name=%s&status=active'
-                                                     % image, 'images')
-        if len(image_details) > 1:
-            logging.warning("Found more than one image named %s", image)
-        image_details = image_details[0]
-        logging.debug("Image %s is id %s", image, image_details['id'])
+        logging.info(">Submitting creation request for %s", name)
+        try:
+            self.os_rest.compute_request('/servers', 'server',
+                                         'post', post_json=dict(server=server_json))
+        except ValueError:
+            self.os_rest.forget_lookups('flavor:%s' % flavor, 'image:%s' % image)
+            raise
+        server_id = self.os_rest.response_json['id']
+        super(TimeoutCreate, self).__init__(name, server_id)
 
+    @staticmethod
+    def flavor_image_refs(os_rest, flavor, image):
+        """Return tuple of flavor and image IDs, looked up by name"""
+        def flavor_ref():
+            """Return ID of flavor"""
+            os_rest.compute_request('/flavors', 'flavors')
+            return os_rest.child_search('name', flavor)['id']
+
+        def image_ref():
+            """Return ID of image"""
+            # Faster for the server to search for this
+            image_details = os_rest.service_request('image',
+                                                    '/v2/images?name=%s&status=active'
+                                                    % image, 'images')
+            if len(image_details) > 1:
+                logging.warning("Found more than one image named %s", image)
+            return image_details[0]['id']
+
+        flavor_id = os_rest.cached_lookup('flavor:%s' % flavor, flavor_ref)
+        logging.debug("Flavor %s is id %s", flavor, flavor_id)
+        image_id = os_rest.cached_lookup('image:%s' % image, image_ref)
+        logging.debug("Image %s is id %s", image, image_id)
+        return flavor_id, image_id
+
+    @staticmethod
+    def userdata(auth_key_lines, userdata_filepath=None):
+        """Return cloud-config userdata, from userdata_filepath if not None"""
         if userdata_filepath:
             with open(userdata_filepath, "rb") as userdata_file:
                 # Will throw exception if token is not found
@@ -678,11 +1219,15 @@ class TimeoutCreate(TimeoutAction):
                         "     homedir: /root\n"
                         "     system: true\n" % str(auth_key_lines))
         logging.debug("\nUserdata: %s", userdata)
+        return userdata
 
+    @staticmethod
+    def server_json(name, flavor_ref, image_ref, userdata, preserve=None):
+        """Return server creation request JSON"""
         server_json = dict(
             name=name,
-            flavorRef=flavor_details['id'],
-            imageRef=image_details['id'],
+            flavorRef=flavor_ref,
+            imageRef=image_ref,
             user_data=b64encode(userdata),
         )
 
@@ -690,21 +1235,14 @@ class TimeoutCreate(TimeoutAction):
             server_json['metadata'] = dict(preserve=str(preserve))  # hours - 1
         else:
             server_json['metadata'] = dict(preserve="-1")  # forever
-
-        # Immediatly bail out if somehow another server exists with name
-        if self.os_rest.server_list().count(name) > 1:
-            raise RuntimeError("More than one server %s found during creation", name)
-
-        logging.info(">Submitting creation request for %s", name)
-        self.os_rest.compute_request('/servers', 'server',
-                                     'post', post_json=dict(server=server_json))
-        server_id = self.os_rest.response_json['id']
-        super(TimeoutCreate, self).__init__(name, server_id)
+        return server_json
 
     def am_done(self, name, server_id):
         """Return server_id if active and powered up, None otherwise"""
-        # Immediatly bail out if somehow another server exists with name
-        if self.os_rest.server_list().count(name) > 1:
+        # Immediatly bail out if somehow another server exists with name,
+        # a recent listing will do, only this server's state must be current.
+        if self.os_rest.server_list(max_age=self.os_rest.cache_ttl,
+                                    name=name).count(name) > 1:
             raise RuntimeError("More than one server %s found during creation", name)
         try:
             server_details = self.os_rest.server(uuid=server_id)
@@ -723,23 +1261,107 @@ class TimeoutCreate(TimeoutAction):
         return None
 
 
+class TimeoutBatchCreate(TimeoutAction):
+    """
+    Helper class to create many servers, polling all of them with one listing per interval
+
+    Servers which fail to submit, end up in an error state, or are not active
+    by the timeout, are recorded in ``failed`` instead of raising an exception.
+    """
+
+    sleep = TimeoutCreate.sleep
+
+    # pylint: disable=E1121
+    def __init__(self, names, auth_key_lines, image, flavor,
+                 userdata_filepath=None, preserve=None):
+        """
+        Callable instance to create VMs, returning mapping of active names to IDs
+
+        :param names: List of VM names to create (must not already exist - not checked)
+        :param auth_key_lines: public key file contents for authorized_keys
+        :param image: Name of te image to use for every VM
+        :param flavor: Name of the flavor to use for every VM
+        :param userdata_filepath: Optional, as for ``TimeoutCreate``
+        :param preserve: Optional, as for ``TimeoutCreate``
+        """
+        self.os_rest = OpenstackREST()
+        self.pending = {}  # server id to name
+        self.active = {}  # name to server id
+        self.failed = {}  # name to tuple of server id (or None) and reason
+        flavor_ref, image_ref = TimeoutCreate.flavor_image_refs(self.os_rest, flavor, image)
+        userdata = TimeoutCreate.userdata(auth_key_lines, userdata_filepath)
+        for name in names:
+            server_json = TimeoutCreate.server_json(name, flavor_ref, image_ref,
+                                                    userdata, preserve)
+            logging.info(">Submitting creation request for %s", name)
+            try:
+                self.os_rest.compute_request('/servers', 'server',
+                                             'post', post_json=dict(server=server_json))
+            except (ValueError, KeyError), xcept:
+                self.os_rest.forget_lookups('flavor:%s' % flavor, 'image:%s' % image)
+                self.failed[name] = (None, str(xcept))
+                continue
+            self.pending[self.os_rest.response_json['id']] = name
+        super(TimeoutBatchCreate, self).__init__()
+
+    def __call__(self):
+        try:
+            return super(TimeoutBatchCreate, self).__call__()
+        except self.timeout_exception, xcept:
+            for server_id, name in self.pending.items():
+                self.failed[name] = (server_id, str(xcept))
+            self.pending.clear()
+            return self.active
+
+    def am_done(self):
+        """Return mapping of active names to IDs once none are pending, None otherwise"""
+        name_filter = self.os_rest.name_filter(*sorted(self.pending.values()))
+        for server_details in self.os_rest.listing('compute', '/servers/detail', 'servers',
+                                                   name=name_filter):
+            server_id = server_details['id']
+            name = self.pending.get(server_id)
+            if name is None:  # Somebody else's, or already finished
+                continue
+            vm_state = server_details.get('OS-EXT-STS:vm_state')
+            power_state = TimeoutCreate.POWERSTATES.get(
+                server_details.get('OS-EXT-STS:power_state'), 'UNKNOWN')
+            logging.info(">     %s id: %s: %s, power %s", name, server_id, vm_state, power_state)
+            if vm_state == 'error' or power_state == 'UNKNOWN':
+                self.failed[name] = (server_id, "Got VM state %s, power-state %s"
+                                     % (vm_state, power_state))
+            elif power_state == 'RUNNING' and vm_state == 'active':
+                self.active[name] = server_id
+            else:
+                continue
+            del self.pending[server_id]
+        if self.pending:
+            return None
+        return self.active
+
+
 class TimeoutAssignFloatingIP(TimeoutAction):
     """Helper class to ensure floating IP assigned to server within timeout window"""
 
     timeout = 120  # Allow provisioning MANY VMs at the same time
+    pool = None  # Optional FloatingIPPool, used instead of the global lock
+    reserved = None  # Address reserved from pool, not yet seen assigned
 
     def __init__(self, server_id, router_name=None):
         self.os_rest = OpenstackREST()
+        net_name, net_id = self.os_rest.cached_lookup('router:%s' % (router_name or ''),
+                                                      lambda: self.router_net(router_name))
+        logging.info(">Router %s maps to network id %s", net_name, net_id)
+        super(TimeoutAssignFloatingIP, self).__init__(server_id, net_name, net_id)
+
+    def router_net(self, router_name=None):
+        """Return list of router name and external network ID, of router_name or first-found"""
         self.os_rest.service_request('network', '/v2.0/routers', "routers")
         if router_name:
             router_details = self.os_rest.child_search('name', router_name)
         else:
             router_details = self.os_rest.response_json[0]
-        net_name = router_details['name']
         gw_info = router_details['external_gateway_info']
-        net_id = gw_info['network_id']
-        logging.info(">Router %s maps to network id %s", net_name, net_id)
-        super(TimeoutAssignFloatingIP, self).__init__(server_id, net_name, net_id)
+        return [router_details['name'], gw_info['network_id']]
 
     def _am_done(self, server_id, net_name, net_id):
         # Assigned IPs can be stolen if two processes issue the assign-action
@@ -748,38 +1370,154 @@ class TimeoutAssignFloatingIP(TimeoutAction):
         # For complete protection, all provisioners, across all jobs should use
         # a global file-lock, provided for here by --lockdir.  If unspecified
         # only a job-local lock is used.
-        try:
-            with OpenstackLock().timeout_acquire_read(self.timeout_remaining()) as osl:
+        oslock = OpenstackLock()
+        with oslock.timeout_acquire_read(self.timeout_remaining()) as osl:
+            if osl is None:
+                raise self.timeout_exception("Timeout acquiring lock")
+            try:
                 ip_addr = self.os_rest.server_ip(uuid=server_id, net_name=net_name)
                 logging.info(">    IP %s assigned", ip_addr)
                 return ip_addr
+            except (ValueError, IndexError, KeyError):
+                pass
+            # No other writer can intervene, so IP remains unassigned
+            try:
+                upgraded = oslock.upgrade(self.timeout_remaining())
+            except IOError, xcept:
+                if xcept.errno != EDEADLK:
+                    raise
+                logging.info(">    Another process is assigning, checking again later")
+                return None
+            if upgraded is None:
+                raise self.timeout_exception("Timeout acquiring lock")
+            floating_ip = self.os_rest.floating_ip(net_id)  # Get dis-used IP
+            if not floating_ip:  # Didn't get one, must create new
+                logging.info(">    creating new floating IP to %s", net_name)
+                floating_ip = self.os_rest.create_floating_ip(net_id)
+            self._assign(server_id, floating_ip)
+            return None  # Check if ip successfully assigned
+
+    def _assign(self, server_id, floating_ip):
+        # Request floating_ip be assigned to server_id, return False if refused
+        logging.info(">    Assigning %s to server id %s",
+                     floating_ip, server_id)
+        addfloatingip = dict(address=floating_ip)
+        try:
+            self.os_rest.compute_request('/servers/%s/action' % server_id,
+                                         unwrap=None, method='post',
+                                         post_json=dict(addFloatingIp=addfloatingip))
+        except ValueError:
+            logging.info(">    Assignment failed")
+            return False
+        return True
+
+    def _pool_am_done(self, server_id, net_name, net_id):
+        # Addresses from the pool are never handed to anyone else, no locking needed
+        try:
+            ip_addr = self.os_rest.server_ip(uuid=server_id, net_name=net_name)
         except (ValueError, IndexError, KeyError):
-            with OpenstackLock().timeout_acquire_write(self.timeout_remaining()) as osl:
-                if osl is None:
-                    raise self.timeout_exception("Timeout acquiring lock")
-                floating_ip = self.os_rest.floating_ip()  # Get dis-used IP
-                if not floating_ip:  # Didn't get one, must create new
-                    logging.info(">    creating new floating IP to %s", net_name)
-                    floating_ip = self.os_rest.create_floating_ip(net_id)
-                logging.info(">    Assigning %s to server id %s",
-                             floating_ip, server_id)
-                addfloatingip = dict(address=floating_ip)
-                try:
-                    self.os_rest.compute_request('/servers/%s/action' % server_id,
-                                                 unwrap=None, method='post',
-                                                 post_json=dict(addFloatingIp=addfloatingip))
-                except ValueError:
-                    logging.info(">    Assignment failed")
-                return None  # Check if ip successfully assigned
+            ip_addr = None
+        if ip_addr:
+            logging.info(">    IP %s assigned", ip_addr)
+            if self.reserved is not None:
+                self.pool.release(net_id, self.reserved)
+                self.reserved = None
+            return ip_addr
+        if self.reserved is None:  # Otherwise, wait for requested assignment
+            self.reserved = self.pool.reserve(net_id, self.timeout_remaining())
+            if not self._assign(server_id, self.reserved):
+                self.pool.release(net_id, self.reserved)
+                self.reserved = None  # Try another next time
+        return None
 
     def am_done(self, server_id, net_name, net_id):
         """Return assigned floating IP for server or None if unassigned"""
+        if self.pool is not None:
+            return self._pool_am_done(server_id, net_name, net_id)
         # Do this twice to try and catch race where multiple POSTs to
         # '/servers/blah/action' happen at the same time (person or machine)
         if self._am_done(server_id, net_name, net_id):
             return self._am_done(server_id, net_name, net_id)
         # else return None amd try again
 
+class FloatingIPPool(object):
+    """
+    Hands out un-assigned floating IPs, each to only one creator at a time
+
+    Every process sharing the lock file shares one pool per external network,
+    kept in a ``FlockStore``.  When a pool is empty, or listed more than
+    ``max_age`` seconds ago, one listing refills it with up to ``size`` DOWN
+    addresses not already reserved, creating a new one only when there are
+    none.  Handing out an address reserves it, until released or ``lease``
+    seconds pass.
+
+    :param lockfilepath: Path to lock file guarding the pools
+    :param size: Maximum addresses to keep in each pool
+    """
+
+    max_age = 60  # Seconds before pooled addresses must be listed again
+    lease = 300  # Seconds before an unreleased reservation expires
+
+    def __init__(self, lockfilepath, size):
+        self.store = FlockStore(Flock(lockfilepath), slots=16, slot_size=16384)
+        self.size = size
+
+    def _pool(self, net_id, now):
+        # Return valid pool record of net_id, without expired reservations
+        pool = self.store.get(net_id)
+        if (not isinstance(pool, dict) or not isinstance(pool.get('free'), list) or
+                not isinstance(pool.get('reserved'), dict)):
+            pool = dict(free=[], reserved={}, listed=0)
+        pool['reserved'] = dict((address, stamp)
+                                for address, stamp in pool['reserved'].items()
+                                if now - stamp <= self.lease)
+        return pool
+
+    def _refill(self, net_id, reserved):
+        # Return list of up to size DOWN addresses of net_id not reserved
+        os_rest = OpenstackREST()
+        free = [floating['floating_ip_address']
+                for floating in os_rest.floating_ips(net_id, 'DOWN')
+                if floating.get('floating_ip_address') not in reserved]
+        random.shuffle(free)  # Other pools may be listing the same
+        if not free:
+            logging.info(">    creating new floating IP to %s", net_id)
+            free = [os_rest.create_floating_ip(net_id)]
+        logging.info(">    Pooled %d floating IPs", min(len(free), self.size))
+        return free[:self.size]
+
+    def reserve(self, net_id, timeout):
+        """
+        Return an address routed to net_id, reserved until released
+
+        :param net_id: ID of external network
+        :param timeout: Seconds to wait for the pool lock
+        :raises RuntimeError: On timeout
+        """
+        with self.store.lock.timeout_acquire_write(timeout) as locked:
+            if locked is None:
+                raise RuntimeError("Timeout acquiring floating IP pool lock")
+            now = time.time()
+            pool = self._pool(net_id, now)
+            pool['free'] = [address for address in pool['free']
+                            if address not in pool['reserved']]
+            if not pool['free'] or now - pool.get('listed', 0) > self.max_age:
+                pool['free'] = self._refill(net_id, pool['reserved'])
+                pool['listed'] = now
+            address = pool['free'].pop(0)
+            pool['reserved'][address] = now
+            self.store.set(net_id, pool)
+        logging.info(">    Reserved floating IP %s", address)
+        return address
+
+    def release(self, net_id, address):
+        """End reservation of address on net_id, once assigned or refused"""
+        with self.store.lock.acquire_write():
+            pool = self._pool(net_id, time.time())
+            if pool['reserved'].pop(address, None) is not None:
+                self.store.set(net_id, pool)
+
+
 class TimeoutAttachVolume(TimeoutAction):
     """
     Helper class to create and attach a volume to a server
@@ -884,6 +1622,96 @@ class TimeoutDeleteVolume(TimeoutAction):
         return None  # try again
 
 
+class TimeoutScheduler(object):
+    """
+    Drive many TimeoutActions from one loop, interleaving their ``am_done()`` calls
+
+    Every action is polled when its poll strategy dictates.  Those due close
+    together are polled in one round, where identical GET requests made by
+    different actions are answered by a single API request.  An action which
+    fails or times out ends only itself, and anything its ``then`` would add.
+
+    :param coalesce: Seconds after the earliest due action, others are polled
+                     in the same round
+    """
+
+    def __init__(self, coalesce=0.5):
+        self.coalesce = coalesce
+        self.actions = []  # In the order added
+        self.results = {}  # Action to result, or exception
+        self._exc_info = {}  # Action to sys.exc_info() of exception
+        self._due = []  # heap of (due, sequence, action, delays, start, delay, then)
+        self._sequence = 0  # Orders actions due at the same time
+
+    def add(self, action, then=None):
+        """
+        Schedule polling action, return it
+
+        :param action: TimeoutAction instance, not yet called
+        :param then: Optional, callable passed the action's result when done,
+                     which may add more actions.  Any exception it raises
+                     replaces the action's result.
+        """
+        start = time.time()
+        if action.time_out_at is None:
+            action.time_out_at = start + action.timeout
+        self.actions.append(action)
+        self._schedule(start, action, action.poll.delays(action), start, then)
+        return action
+
+    def _schedule(self, now, action, delays, start, then):
+        delay = min(next(delays), max(action.time_out_at - now, 0))
+        self._sequence += 1
+        heappush(self._due, (now + delay, self._sequence, action, delays, start, delay, then))
+
+    def _poll(self, os_rest, shared, entry):
+        # Poll action of heap entry once, then reschedule it or record the result
+        _, _, action, delays, start, delay, then = entry
+        try:
+            with os_rest.coalesced(shared, action):
+                result = action.check()
+            if result is None:
+                now = time.time()
+                if now >= action.time_out_at:
+                    raise action.timeout_exception(str(action))
+                self._schedule(now, action, delays, start, then)
+                return
+            action.poll.record(action, start, delay)
+            self.results[action] = result
+            if then is not None:
+                then(result)
+        except Exception, xcept:
+            self.results[action] = xcept
+            self._exc_info[action] = sys.exc_info()
+
+    def run(self):
+        """
+        Poll all actions until every one is done, failed, or timed out
+
+        :returns: Dictionary of every action to its result, or exception
+        """
+        os_rest = OpenstackREST()
+        while self._due:
+            due = self._due[0][0]
+            now = time.time()
+            if due > now:
+                time.sleep(due - now)
+            ready = []
+            while self._due and self._due[0][0] <= due + self.coalesce:
+                ready.append(heappop(self._due))
+            shared = {}  # Responses re-used by actions polled this round
+            for entry in ready:
+                self._poll(os_rest, shared, entry)
+        return self.results
+
+    def raise_first(self):
+        """Re-raise the exception of the earliest added action which failed, if any"""
+        for action in self.actions:
+            if action in self._exc_info:
+                xcept_class, xcept_value, xcept_traceback = self._exc_info[action]
+                raise xcept_class, xcept_value, xcept_traceback
+
+
 def discover(name=None, uuid=None, router_name=None, private=False, **dargs):
     """
     Write ansible host_vars to stdout if a VM name exists with a floating IP.
@@ -908,7 +1736,7 @@ def discover(name=None, uuid=None, router_name=None, private=False, **dargs):
 
     logging.info(">Trying to discover server %s", thing)
 
-    nr_found = os_rest.server_list().count(name)
+    nr_found = os_rest.server_list(name=name).count(name)
     if nr_found == 1:
         if private:
             net_type = 'fixed'
@@ -932,17 +1760,10 @@ def _destroy_volumes(volume_ids, server_id):
     os_rest = OpenstackREST()
     # It's possible volume wasn't attached yet
     try:
-        volumes = os_rest.volume_list()
         logging.info(">Searching for orphan volumes.")
-        for volume in volumes:
-            if volume in volume_ids:
-                continue
-            try:
-                details = os_rest.volume(volume)
-                if details["name"] == server_id:
-                    volume_ids.append(volume)
-            except (ValueError, IndexError):
-                continue
+        for volume in os_rest.volume_list(name=server_id):
+            if volume not in volume_ids:
+                volume_ids.append(volume)
     except (ValueError, IndexError):
         pass  # Volume named with server_id doesn't exist
     if volume_ids:
@@ -963,7 +1784,7 @@ def destroy(name=None, uuid=None, **dargs):
 
     # Prefer to operate on ID's because they can never race/clash
     if name:
-        if os_rest.server_list().count(name) > 1:
+        if os_rest.server_list(name=name).count(name) > 1:
             raise RuntimeError("More than one server %s found", name)
     elif uuid is None:
         raise ValueError("Must pass name and/or uuid to destroy()")
@@ -983,30 +1804,111 @@ def destroy(name=None, uuid=None, **dargs):
     _destroy_volumes(volume_ids, server_id)
 
 
+def _reap_one(server):
+    # Returns server name and None, or exception from destroying it
+    server_id, server_name = server
+    logging.info("Destroying %s", server_name)
+    try:
+        destroy(uuid=server_id)
+    except Exception, xcept:
+        logging.warning("Failed to destroy %s: %s", server_name, xcept)
+        return server_name, xcept
+    return server_name, None
+
+
+def _reap_all(expired, parallel):
+    # Destroy list of (id, name) expired servers, parallel at a time, return summary
+    summary = dict(expired=len(expired), destroyed=[], failed={})
+    parallel = min(max(parallel or 1, 1), len(expired))
+    if parallel > 1:
+        pool = ThreadPool(parallel)
+        try:
+            results = pool.map(_reap_one, expired)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_reap_one(server) for server in expired]
+    for server_name, xcept in results:
+        if xcept is None:
+            summary['destroyed'].append(server_name)
+        else:
+            summary['failed'][server_name] = str(xcept)
+    if expired:
+        logging.info("Reaper destroyed %d of %d expired servers",
+                     len(summary['destroyed']), len(expired))
+    for server_name, error in sorted(summary['failed'].items()):
+        logging.warning("    Failed %s: %s", server_name, error)
+    return summary
+
+
 def reap(**dargs):
     """
     Destroy running VMs older than their preserve value plus one (hours)
+
+    :param dargs: Optionally, ``dry_run`` and ``parallel`` number of servers
+                  to destroy concurrently.
+    :returns: Dictionary of expired server count, lists of names destroyed,
+              and mapping of name to error for those which failed.
     """
     dry_run = False
     if dargs.get('dry_run', False):  # argparse converts dry-run -> dry_run
         logging.info("Reaper operating in dry-run mode, no actions will be taken")
         dry_run = True
     os_rest = OpenstackREST()
-    for server_id in os_rest.server_list(key='id'):
-        expires_at = os_rest.server_expires_at(server_id)
-        server_name = os_rest.response_json["name"]
-        now = datetime.datetime.utcnow()
-        try:
-            if expires_at > now:
-                logging.info(">Server %s has %s remaining", server_name, expires_at - now)
-                continue
-            if dry_run:
-                logging.info("Would have destroyed %s", server_name)
-            else:
-                logging.info("Destroying %s", server_name)
-                destroy(uuid=server_id)
-        except Exception:
+    now = datetime.datetime.utcnow()
+    expired = []
+    for server_details in os_rest.server_details():
+        server_name = server_details.get('name', server_details['id'])
+        expires_at = os_rest.expiration(server_details)
+        if not isinstance(expires_at, datetime.datetime):
             logging.info(">Server %s has indefinite lifetime", server_name)
+        elif expires_at > now:
+            logging.info(">Server %s has %s remaining", server_name, expires_at - now)
+        else:
+            expired.append((server_details['id'], server_name))
+    if dry_run:
+        for _, server_name in expired:
+            logging.info("Would have destroyed %s", server_name)
+        return dict(expired=len(expired), destroyed=[], failed={})
+    # Destroying servers while paging through them would break the sequence
+    return _reap_all(expired, dargs.get('parallel'))
+
+
+@contextmanager
+def creation_slot(max_parallel, lockdir=None):
+    """
+    Context manager limiting concurrent VM creations, sharing lockdir, to max_parallel
+
+    :param max_parallel: Maximum concurrent creations, no limit if zero or None
+    :param lockdir: Directory of semaphore lock files, current directory if None
+    """
+    if not max_parallel:
+        yield
+        return
+    if lockdir is None:
+        lockdir = os.getcwd()  # The workspace, when run as a script
+    semaphore = FlockSemaphore(os.path.join(lockdir, '%s.lock' % CREATE_LOCKFILE_PREFIX),
+                               max_parallel)
+    logging.info(">Waiting for one of %d VM creation slots", max_parallel)
+    with semaphore.acquire(TimeoutAction.timeout) as slot:
+        if slot is None:
+            raise RuntimeError("Timeout waiting for one of %d VM creation slots"
+                               % max_parallel)
+        yield
+
+
+def _load_pubkeys(pub_key_files):
+    # Return list of stripped public key file contents, refuse private keys
+    pubkeys = []
+    for pub_key_file in pub_key_files:
+        logging.info(">Loading public key file: %s", pub_key_file)
+        with open(pub_key_file, 'rb') as key_file:
+            pubkeys.append(key_file.read().strip())
+            if 'PRIVATE KEY' in pubkeys[-1]:
+                raise ValueError("File %s appears to be a private, not a public, key"
+                                 % pub_key_file)
+    return pubkeys
 
 
 # Arguments come from argparse, listing them all for clarity of intent
@@ -1028,41 +1930,194 @@ def create(name, pub_key_files, image, flavor,  # pylint: disable=R0913
     :param dargs: Additional parsed arguments, possibly not relevant.
     """
     preserve = dargs.get('preserve', None)
+    max_parallel = dargs.get('max_parallel', None)
+    lockdir = dargs.get('lockdir', None)
     del dargs  # not otherwise used
-    pubkeys = []
-    for pub_key_file in pub_key_files:
-        logging.info(">Loading public key file: %s", pub_key_file)
-        with open(pub_key_file, 'rb') as key_file:
-            pubkeys.append(key_file.read().strip())
-            if 'PRIVATE KEY' in pubkeys[-1]:
-                raise ValueError("File %s appears to be a private, not a public, key"
-                                 % pub_key_file)
+    pubkeys = _load_pubkeys(pub_key_files)
 
-    # Needed in case of exception
-    server_id = None
+    # Limits API load, otherwise creations happen concurrently
+    with creation_slot(max_parallel, lockdir):
+        # Needed in case of exception
+        server_ids = []
+        scheduler = TimeoutScheduler()
+
+        def created(server_id):
+            """Start volume attachment and floating IP assignment, waiting together"""
+            server_ids.append(server_id)
+            logging.info(">Creation successful, VM %s id %s", name, server_id)
+
+            if size:
+                logging.info("Creating and attaching %sGB volume", size)
+                # name is added to volume description
+                scheduler.add(TimeoutAttachVolume(name, server_id, int(size)))
+
+            if not private:
+                logging.info(">Attempting to assign floating ip on network %s", router_name)
+                scheduler.add(TimeoutAssignFloatingIP(server_id, router_name))
+
+        try:
+            # TODO: maybe just pass in a dictionary full of parameters?
+            # pylint: disable=E1121
+            scheduler.add(TimeoutCreate(name, pubkeys, image, flavor,
+                                        userdata_filepath, preserve), created)
+            scheduler.run()
+            scheduler.raise_first()
+            discover(name=name, uuid=server_ids[0], router_name=router_name, private=private)
+
+        # Must not leak servers or volumes, original exception will be re-raised
+        except Exception, xcept:
+            logging.error("Create threw %s, attempting to destroy VM.", xcept)
+            try:
+                destroy(name, server_ids[0] if server_ids else None)
+            finally:
+                raise
+
+
+def _batch_provision(created, private, router_name, size):
+    # Attach volumes and floating IPs to mapping of created names to IDs, all
+    # waiting at the same time, return mapping of failed names to tuple of ID and reason.
+    failed = {}
+    names = {}  # action to name
+    scheduler = TimeoutScheduler()
+    for name, server_id in sorted(created.items()):
+        try:
+            if size:
+                logging.info("Creating and attaching %sGB volume to %s", size, name)
+                names[scheduler.add(TimeoutAttachVolume(name, server_id, int(size)))] = name
+            if not private:
+                logging.info(">Attempting to assign floating ip to %s on network %s",
+                             name, router_name)
+                names[scheduler.add(TimeoutAssignFloatingIP(server_id, router_name))] = name
+        except Exception, xcept:
+            failed[name] = (server_id, str(xcept))
+    for action, result in scheduler.run().items():
+        if isinstance(result, Exception):
+            failed.setdefault(names[action], (created[names[action]], str(result)))
+    return failed
+
+
+def _batch_destroy(failed):
+    # Destroy VMs in mapping of failed names to tuple of ID (or None) and reason
+    for name, (server_id, reason) in sorted(failed.items()):
+        logging.error("VM %s failed: %s", name, reason)
+        if server_id is None:  # Never created, or not created here
+            continue
+        logging.info("Destroying failed VM %s", name)
+        try:
+            destroy(uuid=server_id)
+        except Exception, xcept:
+            logging.error("Failed to destroy VM %s: %s", name, xcept)
+
+
+# Arguments come from argparse, listing them all for clarity of intent
+def _batch_wave(names, pubkeys, image, flavor, userdata_filepath, preserve):
+    # Return mappings of active names to IDs, and failed names to (ID or None, reason)
     try:
-        # TODO: maybe just pass in a dictionary full of parameters?
         # pylint: disable=E1121
-        server_id = TimeoutCreate(name, pubkeys, image, flavor, userdata_filepath, preserve)()
-        logging.info(">Creation successful, VM %s id %s", name, server_id)
+        batch = TimeoutBatchCreate(names, pubkeys, image, flavor,
+                                   userdata_filepath, preserve)
+    except Exception, xcept:  # Earlier waves must still be provisioned or destroyed
+        logging.error("Submitting creations threw %s", xcept)
+        return {}, dict((name, (None, str(xcept))) for name in names)
+    try:
+        return batch(), batch.failed
+    except Exception, xcept:  # Must not leak servers, fail all of them
+        logging.error("Polling creation threw %s", xcept)
+        for server_id, name in batch.pending.items():
+            batch.failed[name] = (server_id, str(xcept))
+        for name, server_id in batch.active.items():
+            batch.failed[name] = (server_id, str(xcept))
+        return {}, batch.failed
+
+
+def batch_create(names, pub_key_files, image, flavor,  # pylint: disable=R0913
+                 private=False, router_name=None, size=None,
+                 userdata_filepath=None, **dargs):
+    """
+    Create or discover many VMs, write ansible host_vars for each to stdout.
 
-        if size:
-            logging.info("Creating and attaching %sGB volume", size)
-            # name is added to volume description
-            TimeoutAttachVolume(name, server_id, int(size))()
+    Existing VMs are discovered, all others are submitted for creation in waves
+    of at most ``max_parallel`` (all at once if unset), each holding one creation
+    slot, and polled together with one listing of only its servers per interval.
+    Once all waves are done, the created VMs are provisioned.  One host_vars
+    YAML document is written per VM, in the order of names.  Any which failed
+    to be created are destroyed, leaving all others intact.
 
-        if not private:
-            logging.info(">Attempting to assign floating ip on network %s", router_name)
-            TimeoutAssignFloatingIP(server_id, router_name)()
-        discover(name=name, uuid=server_id, router_name=router_name, private=private)
+    :param names: List of VM names to create or discover
+    :param pub_key_files: List of ssh public key files to read
+    :param image: Name of the openstack image to use
+    :param flavor: Name of the openstack VM flavor to use
+    :param private: When False, assign a floating IP to every VM.
+    :param router_name: When private==False, router name to use, or None for first-found.
+    :param size: Optional size (gigabytes) volume to attach to every created VM
+    :param userdata_filepath: Optional full path to YAML file containing userdata and,
+                              optional ``{auth_key_lines}`` token (JSON).
+    :param dargs: Additional parsed arguments, possibly not relevant.
+    :raise RuntimeError: When any VM failed, after writing host_vars for the others
+    :returns: Dictionary mapping names to IDs, of VMs written to stdout
+    """
+    preserve = dargs.get('preserve', None)
+    max_parallel = dargs.get('max_parallel', None)
+    lockdir = dargs.get('lockdir', None)
+    del dargs  # not otherwise used
+    pubkeys = _load_pubkeys(pub_key_files)
+    os_rest = OpenstackREST()
 
-    # Must not leak servers or volumes, original exception will be re-raised
-    except Exception, xcept:
-        logging.error("Create threw %s, attempting to destroy VM.", xcept)
+    found = {}
+    for server in os_rest.servers(names=names):
+        found.setdefault(server['name'], []).append(server['id'])
+    clashes = sorted(name for name in set(names) if len(found.get(name, [])) > 1)
+    if clashes:
+        raise RuntimeError("More than one server found for each of %s" % ', '.join(clashes))
+    hosts = dict((name, found[name][0]) for name in names if name in found)
+    for name in sorted(hosts):
+        logging.info(">Found existing VM %s id %s", name, hosts[name])
+
+    failed = {}
+    missing = [name for name in names if name not in found]
+    if missing:
+        created = {}
+        # Limits API load, never more than max_parallel submitted at once
+        wave_size = max_parallel or len(missing)
+        for start in xrange(0, len(missing), wave_size):
+            wave = missing[start:start + wave_size]
+            try:
+                with creation_slot(max_parallel, lockdir):
+                    wave_created, wave_failed = _batch_wave(wave, pubkeys, image, flavor,
+                                                            userdata_filepath, preserve)
+            except RuntimeError, xcept:  # No slot, earlier waves must still be handled
+                wave_created = {}
+                wave_failed = dict((name, (None, str(xcept))) for name in wave)
+            created.update(wave_created)
+            failed.update(wave_failed)
+        logging.info(">Created %d of %d VMs", len(created), len(missing))
+        failed.update(_batch_provision(created, private, router_name, size))
+        hosts.update((name, server_id) for name, server_id in created.items()
+                     if name not in failed)
+
+    net_type = 'fixed' if private else 'floating'
+    host_vars = []
+    for name in names:
+        if name not in hosts:
+            continue
         try:
-            destroy(name, server_id)
-        finally:
-            raise
+            ip_addr = os_rest.server_ip(uuid=hosts[name], net_name=router_name,
+                                        net_type=net_type)
+        except (RuntimeError, ValueError, IndexError, KeyError), xcept:
+            server_id = hosts.pop(name)
+            # Only destroy those created here
+            failed[name] = (server_id if name in missing else None, str(xcept))
+            continue
+        host_vars.append(OUTPUT_FORMAT.format(name=name, uuid=hosts[name], ip_addr=ip_addr))
+
+    _batch_destroy(failed)
+    for document in host_vars:
+        sys.stdout.write(document)
+    if failed:
+        raise RuntimeError("Failed to create or discover %d of %d VMs: %s"
+                           % (len(failed), len(names), ', '.join(sorted(failed))))
+    return hosts
+
 
 def parse_args(argv, operation='help'):
     """
@@ -1119,6 +2174,25 @@ def parse_args(argv, operation='help'):
                                   ' should be created/used.  Required for parallel'
                                   ' executions.'))
 
+        parser.add_argument('--lookup-ttl', default=DEFAULT_LOOKUP_TTL, type=int,
+                            help=('Re-use flavor, image, and router IDs looked up'
+                                  ' within this many seconds, by any process sharing'
+                                  ' the same --lockdir (or workspace).  Zero (default)'
+                                  ' disables (Optional).'))
+
+        parser.add_argument('--ip-pool', default=0, type=int, metavar='SIZE',
+                            help=('Assign floating IPs reserved from a pool of up to'
+                                  ' SIZE addresses, shared with every process using'
+                                  ' the same --lockdir (or workspace), instead of'
+                                  ' under the global lock.  Zero (default) disables'
+                                  ' (Optional).'))
+
+        parser.add_argument('--max-parallel', '-m', default=0, type=int,
+                            help=('Limit concurrent VM creations, sharing the same'
+                                  ' --lockdir (or workspace), to this many.  Others'
+                                  ' wait in order for a free slot.  Zero (default)'
+                                  ' means no limit (Optional).'))
+
     # All operations get these
     parser.add_argument('--verbose', '-v', default=False,
                         action='store_true',
@@ -1132,7 +2206,58 @@ def parse_args(argv, operation='help'):
                         help=('Major operations timeout (default %s) in seconds'
                               ' (Optional).' % DEFAULT_TIMEOUT))
 
-    if operation != 'reap':
+    parser.add_argument('--lock-lease', default=DEFAULT_LOCK_LEASE, type=int,
+                        help=('Seconds a global lock holder may go without'
+                              ' renewing, before waiters break it.  Only safe'
+                              ' when holders cannot outlive their lease.'
+                              ' Default %s (disabled) (Optional).'
+                              % DEFAULT_LOCK_LEASE))
+
+    parser.add_argument('--history', default=DEFAULT_HISTORY_COUNT, type=int,
+                        dest='history_count',
+                        help=('Keep at most this many (default %s) recent API'
+                              ' responses in memory, for diagnosing errors'
+                              ' (Optional).' % DEFAULT_HISTORY_COUNT))
+
+    parser.add_argument('--history-bytes', default=DEFAULT_HISTORY_BYTES, type=int,
+                        help=('Keep at most this many (default %s) bytes of recent'
+                              ' API response content in memory (Optional).'
+                              % DEFAULT_HISTORY_BYTES))
+
+    parser.add_argument('--record', default=None, metavar='PATH',
+                        help=('Stream every API request and response to PATH'
+                              ' as JSON lines.  With --debug, defaults to a file'
+                              ' in the virtualenv directory (Optional).'))
+
+    parser.add_argument('--poll', default=POLL_STRATEGIES[0], choices=POLL_STRATEGIES,
+                        help=('How long to wait between checks of slow operations:'
+                              ' "fixed" intervals (default), "exponential"-ly'
+                              ' increasing intervals, or "predictive", waiting'
+                              ' until operations are typically done before checking'
+                              ' exponentially (Optional).'))
+
+    parser.add_argument('--lock-service', default=None, metavar='HOST:PORT',
+                        help=('Use global lock from the lock_service.py at HOST:PORT,'
+                              ' instead of a lock file.  Coordinates kommandirs'
+                              ' which do not share a --lockdir (Optional).'))
+
+    if operation == 'broker':
+        parser.add_argument('--idle', default=DEFAULT_BROKER_IDLE, type=int,
+                            help=('Exit after this many seconds (default %s) without'
+                                  ' any operations (Optional).' % DEFAULT_BROKER_IDLE))
+    elif operation == 'batch_create':
+        parser.add_argument('--name', '-N', default=[], action='append', dest='names',
+                            help=('Name of a VM to search for or create, may be'
+                                  ' given more than once.'))
+
+        parser.add_argument('--template', default=None,
+                            help=('Also search for or create --count VMs, named by'
+                                  ' replacing "{index}" in TEMPLATE with 0 through'
+                                  ' COUNT-1 (Optional).'))
+
+        parser.add_argument('--count', default=0, type=int,
+                            help='Number of VMs to name from --template (Optional).')
+    elif operation != 'reap':
         parser.add_argument('name',
                             help='The VM name to search for, create, or destroy (required)')
     else:
@@ -1141,6 +2266,10 @@ def parse_args(argv, operation='help'):
                             help=('Perform no actual cleanup or other actions, simply'
                                   ' display the actions that would have been taken.'))
 
+        parser.add_argument('--parallel', '-j', default=1, type=int,
+                            help=('Destroy up to this many expired VMs at the same'
+                                  ' time, instead of one at a time (Optional).'))
+
     # Consumer of remaining arguments must come last
     if 'create' in operation:
         # "pubkey" will be a list, using "pubkeys" causes --help to be wrong
@@ -1167,6 +2296,15 @@ def parse_args(argv, operation='help'):
         dargs['pub_key_files'] = dargs['pubkey']  # Can't use dest (above)
         del dargs['pubkey']
 
+    if operation == 'batch_create':
+        if dargs['template'] and dargs['count'] > 0:
+            dargs['names'] += [dargs['template'].format(index=index)
+                               for index in xrange(dargs['count'])]
+        if not dargs['names']:
+            parser.error('One or more --name, or --template and --count are required')
+        elif len(set(dargs['names'])) != len(dargs['names']):
+            parser.error('VM names must be unique')
+
     # Add operation for reference
     dargs['operation'] = operation
 
@@ -1185,7 +2323,11 @@ def main(argv, dargs, service_sessions):
     :returns: Exit code integer
     """
     random.seed()
-    if 'create' in dargs['operation']:
+    if dargs['operation'] == 'batch_create':
+        OpenstackREST(service_sessions)
+        logging.info("Discovering or creating %d VMs", len(dargs['names']))
+        batch_create(**dargs)
+    elif 'create' in dargs['operation']:
         logging.info('Attempting to find VM %s.', dargs['name'])
         # The general exception is re-raised on secondary exception
         try:
@@ -1222,29 +2364,378 @@ def main(argv, dargs, service_sessions):
 
 
 def api_debug_dump():
-    """Dump out all API request responses into a file in virtualenv dir"""
-    lines = []
+    """
+    Dump out API request responses into a file in virtualenv dir
+
+    All are converted from the recorder's file if there is one, otherwise
+    only those remaining in the bounded history are dumped.
+    """
     os_rest = OpenstackREST()
-    seq_num = 0
-    for response in os_rest.previous_responses + [os_rest.response_obj]:
-        try:
-            lines.append({response.request.method: response.request.url})
-            lines[-1]['response'] = response.json()
-            lines[-1]['status_code'] = response.status_code
-            # These are useful for creating unittest data + debugging unittests
-            lines[-1]['sequence_number'] = seq_num
-            seq_num += 10
-        except (ValueError, AttributeError):
-            pass
     _basename = os.path.basename(sys.argv[0])
     prefix = _basename.split('.', 1)[0]
     filepath = os.path.join(workspace, '.venv',
                             '%s_api_responses.json' % prefix)
-    # Don't fail main operations b/c missing module
-    import json as simplejson
+    if os_rest.recorder is not None:
+        # Line at a time, without loading every response into memory
+        with open(os_rest.recorder.path, 'rb') as recorded:
+            with open(filepath, 'wb') as debugf:
+                debugf.write('[')
+                for index, line in enumerate(recorded):
+                    debugf.write('%s\n%s' % (',' if index else '', line.strip()))
+                debugf.write('\n]\n')
+        logging.info(">Recorded all response JSONs into: %s", filepath)
+        return
+    lines = []
+    seq_num = 0
+    for response in list(os_rest.previous_responses) + [os_rest.response_obj]:
+        lines.append(ResponseRecorder.entry(response))
+        if 'status_code' in lines[-1]:
+            lines[-1]['sequence_number'] = seq_num
+            seq_num += 10
+        elif not lines[-1]:
+            lines.pop()
     with open(filepath, 'wb') as debugf:
-        simplejson.dump(lines, debugf, indent=2, sort_keys=True)
-    logging.info(">Recorded all response JSONs into: %s", filepath)
+        json.dump(lines, debugf, indent=2, sort_keys=True)
+    logging.info(">Recorded %d most recent response JSONs into: %s", len(lines), filepath)
+
+
+def operation_name(argv):
+    """
+    Return operation from the script name in argv, show usage info if unknown
+
+    :param argv: List of command-line arguments, e.g. sys.argv
+    """
+    basename = re.sub(r'\.py$', '', os.path.basename(argv[0]))
+    operation = re.sub('^openstack_', '', basename)
+    if operation == basename:
+        logging.error("Script must be invoked with 'openstack_' prefix")
+        parse_args(argv, 'help')  # exits
+    if operation not in OPERATIONS:
+        logging.error("Unknown operation '%s'; script must be invoked with"
+                      " one of the following names: %s", operation,
+                      ALLOWED_NAMES)
+        parse_args(argv, 'help')  # exits
+    return operation
+
+
+def setup_locks(dargs, workspace_path):
+    """
+    Initialize default values for all locks, and the global lock singleton
+
+    :param dargs: Dictionary of parsed command-line options
+    :param workspace_path: Directory containing job-local lock files
+    """
+    TimeoutAction.timeout = dargs['timeout']  # locks cheat and use this
+    Flock.def_path = workspace_path
+    Flock.def_prefix = WORKSPACE_LOCKFILE_PREFIX
+    lease = dargs['lock_lease'] or None
+    if bool(dargs.get('lock_service')):
+        # Same API, singleton returns it instead
+        OpenstackLock._singleton = RemoteFlock(dargs['lock_service'],
+                                               GLOBAL_LOCKFILE_PREFIX, lease)
+    elif bool(dargs.get('lockdir')):
+        OpenstackLock(os.path.join(dargs['lockdir'],
+                                   '%s.lock' % WORKSPACE_LOCKFILE_PREFIX), lease)
+    else:
+        OpenstackLock(os.path.join(workspace_path,
+                                   '%s.lock' % GLOBAL_LOCKFILE_PREFIX), lease)
+
+
+def setup_polling(dargs, workspace_path):
+    """
+    Initialize the polling strategy of all TimeoutActions
+
+    :param dargs: Dictionary of parsed command-line options
+    :param workspace_path: Directory for history, if there's no --lockdir
+    """
+    poll = dargs.get('poll')
+    if poll == 'exponential':
+        TimeoutAction.poll = PollExponential()
+    elif poll == 'predictive':
+        # History is most useful shared by every job, like the global lock
+        lockdir = dargs.get('lockdir') or workspace_path
+        TimeoutAction.poll = PollPredictive(
+            os.path.join(lockdir, '%s.lock' % POLL_HISTORY_LOCKFILE_PREFIX))
+    else:
+        TimeoutAction.poll = PollFixed()
+
+
+def cloud_namespace(environ):
+    """Return short, stable identifier of the cloud configured by environ"""
+    names = ('OS_CLOUD', 'OS_AUTH_URL', 'OS_PROJECT_NAME', 'OS_TENANT_NAME', 'OS_REGION_NAME')
+    return hashlib.sha1('\0'.join(environ.get(name, '') for name in names)).hexdigest()[:12]
+
+
+def setup_lookup_cache(dargs, workspace_path):
+    """
+    Initialize the optional cache of flavor, image, and router lookups
+
+    :param dargs: Dictionary of parsed command-line options
+    :param workspace_path: Directory for the cache, if there's no --lockdir
+    """
+    if dargs.get('lookup_ttl'):
+        # Most useful shared by every job, like the global lock
+        lockdir = dargs.get('lockdir') or workspace_path
+        OpenstackREST.lookup_cache = LookupCache(
+            os.path.join(lockdir, '%s.lock' % LOOKUP_CACHE_LOCKFILE_PREFIX),
+            dargs['lookup_ttl'], CLOUD_NAMESPACE or 'default')
+    else:
+        OpenstackREST.lookup_cache = None
+
+
+def setup_ip_pool(dargs, workspace_path):
+    """
+    Initialize the optional floating IP pool
+
+    :param dargs: Dictionary of parsed command-line options
+    :param workspace_path: Directory for the pool, if there's no --lockdir
+    """
+    if dargs.get('ip_pool'):
+        # Must be shared by every job, like the global lock
+        lockdir = dargs.get('lockdir') or workspace_path
+        TimeoutAssignFloatingIP.pool = FloatingIPPool(
+            os.path.join(lockdir, '%s.lock' % IP_POOL_LOCKFILE_PREFIX), dargs['ip_pool'])
+    else:
+        TimeoutAssignFloatingIP.pool = None
+
+
+def setup_history(dargs, workspace_path):
+    """
+    Initialize API response history limits, and the optional recorder
+
+    :param dargs: Dictionary of parsed command-line options
+    :param workspace_path: Directory containing the virtualenv directory
+    """
+    OpenstackREST.history_count = dargs['history_count']
+    OpenstackREST.history_bytes = dargs['history_bytes']
+    path = dargs.get('record')
+    if not path and dargs['debug']:
+        prefix = os.path.basename(sys.argv[0]).split('.', 1)[0]
+        path = os.path.join(workspace_path, '.venv', '%s_api_responses.jsonl' % prefix)
+    if path:
+        OpenstackREST.recorder = ResponseRecorder(path)
+        logging.info(">Recording API responses into: %s", path)
+    else:
+        OpenstackREST.recorder = None
+
+
+def setup_logging(dargs):
+    """
+    Set root logger level and filter from --debug and --verbose options
+    """
+    logger = logging.getLogger()
+    level = logging.INFO
+    if dargs['debug']:
+        level = logging.DEBUG
+    logger.setLevel(level)
+    logger.addFilter(VerboseFilter(level, dargs['verbose']))  # --verbose managed here
+
+
+def broker_write(sock_file, **message):
+    """
+    Send one message to the other end of a broker connection
+
+    :param sock_file: File-like object, from socket ``makefile()``
+    :param message: Items of JSON object, written on a single line
+    """
+    sock_file.write(json.dumps(message) + '\n')
+    sock_file.flush()
+
+
+class BrokerStream(object):
+    """
+    File-like standin for stdout/stderr, forwarding writes to a broker client
+
+    :param sock_file: File-like object, from socket ``makefile()``
+    :param name: Either 'stdout' or 'stderr', stream written by client
+    """
+
+    def __init__(self, sock_file, name):
+        self.sock_file = sock_file
+        self.name = name
+
+    def write(self, data):
+        """Forward data to the client's stream"""
+        broker_write(self.sock_file, stream=self.name, data=data)
+
+    def flush(self):
+        """Nothing to do, every write is sent immediately"""
+        pass
+
+
+def _broker_connect(socket_path):
+    # Return connected socket, or None if no broker is listening
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except socket.error, xcept:
+        client.close()
+        if xcept.errno in (ENOENT, ECONNREFUSED):
+            return None  # Not running, or killed
+        raise
+    return client
+
+
+def broker_client(socket_path, argv):
+    """
+    Run an operation in the broker at socket_path, return exit code or None
+
+    :param socket_path: Path to broker's Unix socket
+    :param argv: List of command-line arguments, e.g. sys.argv
+    :returns: Exit code integer, or None if no broker is listening
+    """
+    client = _broker_connect(socket_path)
+    if client is None:
+        return None
+    streams = dict(stdout=sys.stdout, stderr=sys.stderr)
+    try:
+        broker_write(client.makefile('wb', 0), argv=argv)
+        for line in client.makefile('rb'):
+            message = json.loads(line)
+            if 'exit' in message:
+                return message['exit']
+            streams[message['stream']].write(message['data'])
+            streams[message['stream']].flush()
+    finally:
+        client.close()
+    logging.error("Lost connection to broker on %s, operation status unknown",
+                  socket_path)
+    return 1
+
+
+def broker_handle(conn, service_sessions, workspace_path):
+    """
+    Run one client's operation, forwarding its output and exit code
+
+    :param conn: Connected socket, client's request is read from it
+    :param service_sessions: Mapping of service names
+                             to request-like session instances
+    :param workspace_path: Directory containing job-local lock files
+    :returns: Exit code integer
+    """
+    writer = conn.makefile('wb', 0)
+    request = conn.makefile('rb').readline()
+    if not request:
+        return 0  # Only checking if broker is listening
+    argv = json.loads(request)['argv']
+    logger = logging.getLogger()
+    saved = (sys.stdout, sys.stderr, logger.handlers, logger.filters, logger.level)
+    sys.stdout = BrokerStream(writer, 'stdout')
+    sys.stderr = BrokerStream(writer, 'stderr')
+    logger.handlers = [logging.StreamHandler(sys.stderr)]
+    logger.filters = []
+    dargs = {}
+    code = 0
+    try:
+        operation = operation_name(argv)
+        if operation == 'broker':
+            raise ValueError("Broker already running")
+        dargs = parse_args(argv, operation)
+        # Created by the broker with its own options
+        OpenstackLock.__clobber__()
+        OpenstackREST.__clobber__()
+        setup_locks(dargs, workspace_path)
+        setup_polling(dargs, workspace_path)
+        setup_lookup_cache(dargs, workspace_path)
+        setup_ip_pool(dargs, workspace_path)
+        setup_logging(dargs)
+        setup_history(dargs, workspace_path)
+        main(argv, dargs, service_sessions)
+    except SystemExit, xcept:
+        code = xcept.code
+        if code is None:
+            code = 0
+        elif not isinstance(code, int):
+            sys.stderr.write('%s\n' % code)
+            code = 1
+    except Exception:  # Report as if unhandled by the client
+        sys.stderr.write(traceback.format_exc())
+        code = 1
+    finally:
+        if dargs.get('debug') and OpenstackREST._singleton is not None:
+            api_debug_dump()
+        (sys.stdout, sys.stderr, logger.handlers,
+         logger.filters, logger.level) = saved
+    broker_write(writer, exit=code)
+    return code
+
+
+def _broker_refresh(service_sessions):
+    # Re-authenticates only when token is expired or about to be
+    for session in service_sessions.values():
+        try:
+            session.get_token()
+        except Exception, xcept:
+            logging.warning("Unable to refresh authentication: %s", xcept)
+
+
+def _broker_forked(service_sessions):
+    # Connection pools are inherited from the broker, never share with others
+    for session in service_sessions.values():
+        session.session.session.close()
+
+
+def _broker_reap(children):
+    # Collect exit status of finished children, so they don't linger
+    for pid in list(children):
+        if os.waitpid(pid, os.WNOHANG)[0]:
+            children.remove(pid)
+
+
+def broker(socket_path, service_sessions, workspace_path, idle=DEFAULT_BROKER_IDLE):
+    """
+    Keep authenticated sessions, running thin-client operations in forked children
+
+    :param socket_path: Path to Unix socket to listen on
+    :param service_sessions: Mapping of service names
+                             to request-like session instances
+    :param workspace_path: Directory containing job-local lock files
+    :param idle: Return after this many seconds pass without any operation
+    :returns: Exit code integer
+    """
+    probe = _broker_connect(socket_path)
+    if probe is not None:
+        probe.close()
+        logging.error("Another broker is already listening on %s", socket_path)
+        return 1
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # Left behind by killed broker
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    children = set()
+    try:
+        server.listen(16)
+        server.settimeout(min(idle, BROKER_REFRESH))
+        _broker_refresh(service_sessions)
+        logging.info("Broker listening on %s", socket_path)
+        last = time.time()
+        while time.time() - last < idle:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                _broker_refresh(service_sessions)
+                continue
+            finally:
+                _broker_reap(children)
+            last = time.time()
+            pid = os.fork()
+            if pid:
+                conn.close()
+                children.add(pid)
+                logging.info(">Broker started operation in pid %d", pid)
+                continue
+            code = 1
+            try:
+                server.close()
+                _broker_forked(service_sessions)
+                code = broker_handle(conn, service_sessions, workspace_path)
+            finally:
+                os._exit(code)  # Never return into the broker's loop
+        logging.info("Broker idle for %ds, exiting", idle)
+    finally:
+        server.close()
+        os.unlink(socket_path)
+    return 0
 
 
 def _pip_upgrade_install(venvdir, requirements, onlybin, nobin):
@@ -1336,46 +2827,46 @@ def activate_and_setup(namespace, venvdir, requirements, onlybin, nobin):
         if vlock is None:
             raise RuntimeError(fmt, "write")
         _install(venvdir)
-    with lockfile.timeout_acquire_read(TimeoutAction.timeout) as vlock:
-        if vlock is None:
-            raise RuntimeError(fmt, "read")
+        lockfile.downgrade()  # Other processes may activate concurrently
         _activate(namespace, venvdir)
-    with lockfile.timeout_acquire_read(TimeoutAction.timeout) as vlock:
-        if vlock is None:
-            raise RuntimeError(fmt, "read")
         try:
             _, pathname, _ = find_module('os_client_config')
         except ImportError:
             pathname = ''
         if pathname.startswith(venvdir):
             return import_module('os_client_config')
-        else:
-            with lockfile.timeout_acquire_write(TimeoutAction.timeout) as vlock:
-                if vlock is None:
-                    raise RuntimeError(fmt, "read")
-                return _setup(venvdir, requirements, onlybin, nobin)
+        try:
+            upgraded = lockfile.upgrade(TimeoutAction.timeout)
+        except IOError, xcept:
+            if xcept.errno != EDEADLK:
+                raise
+            upgraded = False  # Another process is setting up, wait for it below
+        if upgraded is None:
+            raise RuntimeError(fmt, "write")
+        elif upgraded:  # No other writer since checking
+            return _pip_upgrade_install(venvdir, requirements, onlybin, nobin)
+    with lockfile.timeout_acquire_write(TimeoutAction.timeout) as vlock:
+        if vlock is None:
+            raise RuntimeError(fmt, "write")
+        return _setup(venvdir, requirements, onlybin, nobin)
 
 
 # N/B: Any/All names used here are in the global scope
 if __name__ == '__main__':  # pylint: disable=C0103
     # Parse arguments
-    basename = re.sub(r'\.py$', '', os.path.basename(sys.argv[0]))
-    op_requested = re.sub('^openstack_', '', basename)
-    if op_requested == basename:
-        logging.error("Script must be invoked with 'openstack_' prefix")
-        parse_args(sys.argv, 'help')  # exits
-    if op_requested not in OPERATIONS:
-        logging.error("Unknown operation '%s'; script must be invoked with"
-                      " one of the following names: %s", op_requested,
-                      ALLOWED_NAMES)
-        parse_args(sys.argv, 'help')  # exits
-    _dargs = parse_args(sys.argv, op_requested)
-    del basename  # keep global namespace clean
+    _dargs = parse_args(sys.argv, operation_name(sys.argv))
 
     workspace = os.environ.get('WORKSPACE')
     if workspace is None:
         logging.error(EPILOG)
         sys.exit(2)
+
+    # Thin client, when a broker already holds an authenticated session
+    if _dargs['operation'] != 'broker':
+        _exit_code = broker_client(os.path.join(workspace, BROKER_SOCKET), sys.argv)
+        if _exit_code is not None:
+            sys.exit(_exit_code)
+
     os.chdir(workspace)
     # Control location of caching
     os.environ['HOME'] = workspace
@@ -1384,27 +2875,15 @@ if __name__ == '__main__':  # pylint: disable=C0103
         if _name.startswith('XDG'):
             del os.environ[_name]
 
-    # initialize default values for all locks
-    TimeoutAction.timeout = _dargs['timeout']  # locks cheat and use this
-    Flock.def_path = workspace
-    Flock.def_prefix = WORKSPACE_LOCKFILE_PREFIX
-
-    # initialize global lock singleton
-    if bool(_dargs.get('lockldir')):
-        OpenstackLock(os.path.join(_dargs['lockdir'],
-                                   '%s.lock' % WORKSPACE_LOCKFILE_PREFIX))
-    else:
-        OpenstackLock(os.path.join(workspace,
-                                   '%s.lock' % GLOBAL_LOCKFILE_PREFIX))
+    setup_locks(_dargs, workspace)
+    setup_polling(_dargs, workspace)
+    # Before OpenStackConfig() clears the environment
+    CLOUD_NAMESPACE = cloud_namespace(os.environ)
+    setup_lookup_cache(_dargs, workspace)
+    setup_ip_pool(_dargs, workspace)
 
     # Allow early debugging/verbose mode
-    logger = logging.getLogger()
-    level = logging.INFO
-    if _dargs['debug']:
-        level = logging.DEBUG
-    logger.setLevel(level)
-    logger.addFilter(VerboseFilter(level, _dargs['verbose']))  # --verbose managed here
-    del logger  # keep global namespace clean
+    setup_logging(_dargs)
 
     os_client_config = activate_and_setup(globals(),
                                           os.path.join(workspace, '.venv'),
@@ -1438,6 +2917,10 @@ if __name__ == '__main__':  # pylint: disable=C0103
     sessions = dict([(svc, cloud.get_session_client(svc))
                      for svc in service_names])
     del cloud  # keep global namespace clean
+    if _dargs['operation'] == 'broker':
+        sys.exit(broker(os.path.join(workspace, BROKER_SOCKET), sessions,
+                        workspace, _dargs['idle']))
+    setup_history(_dargs, workspace)
     try:
         main(sys.argv, _dargs, sessions)
     finally:
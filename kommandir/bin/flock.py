@@ -7,25 +7,143 @@ Module of locking-related classes and functions not available in the standard li
 import sys
 import os
 import os.path
+import json
+import argparse
 import logging
 import random
+import signal
+import select
+import threading
+import mmap
+import struct
+import zlib
+import shutil
+import tempfile
 from time import time, sleep
+from socket import gethostname
+from collections import namedtuple
 from fcntl import flock, LOCK_UN, LOCK_SH, LOCK_EX, LOCK_NB
-from errno import EACCES, EAGAIN
+from errno import EACCES, EAGAIN, ESRCH, EINTR, ENOENT, EDEADLK
 from contextlib import contextmanager
 
 
 random.seed(os.urandom(64))
 
+#: Position in a FairFlock queue, ticket numbers only ever increase.  Entries
+#: with a non-zero lease expire unless renewed within that many seconds.
+QueueEntry = namedtuple('QueueEntry', ('ticket', 'pid', 'host', 'op', 'renewed', 'lease'))
+
+
+def pid_alive(pid):
+    """
+    Return False if process pid definitely does not exist on this host.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError, xcept:
+        return xcept.errno != ESRCH  # EPERM means it exists
+    return True
+
+
+@contextmanager
+def _json_sidecar(path):
+    # Yields dictionary from JSON file at path under exclusive lock, saved if changed
+    fileno = os.open(path, os.O_RDWR | os.O_CREAT, 0666)
+    with os.fdopen(fileno, 'r+b', 0) as sidecar:
+        flock(sidecar, LOCK_EX)  # Only ever held very briefly
+        try:
+            try:
+                content = json.loads(sidecar.read() or '{}')
+            except ValueError:
+                content = {}  # Corrupted, start over
+            before = json.dumps(content, sort_keys=True)
+            yield content
+            after = json.dumps(content, sort_keys=True)
+            if after != before:
+                sidecar.seek(0)
+                sidecar.truncate()
+                sidecar.write(after)
+        finally:
+            flock(sidecar, LOCK_UN)
+
+
+def histogram_add(histogram, seconds):
+    """
+    Count seconds in a JSON-compatible, power-of-two (millisecond) bucket histogram
+
+    :param histogram: Dictionary to update, keys are bucket upper-bound milliseconds
+    :param seconds: Duration to count
+    """
+    bucket = 1
+    while bucket < seconds * 1000:
+        bucket *= 2
+    histogram[str(bucket)] = histogram.get(str(bucket), 0) + 1
+
+
+def histogram_summary(histogram):
+    """
+    Return dictionary of count, and approximate p50, p99, max seconds from histogram
+    """
+    buckets = sorted((int(bucket), count) for bucket, count in histogram.iteritems())
+    total = sum(count for _, count in buckets)
+    result = {'count': total}
+    for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0)):
+        seen = 0
+        result[name] = None
+        for bucket, count in buckets:
+            seen += count
+            if seen >= total * fraction:
+                result[name] = bucket / 1000.0
+                break
+    return result
+
+
+def _interrupt(signum, frame):
+    # Only purpose is to make a blocking flock() fail with EINTR
+    del signum
+    del frame
+
+
+class LeaseRenewer(threading.Thread):
+    """
+    Daemon thread calling renew() every interval seconds, until it returns False or stopped.
+
+    :param renew: Callable with no arguments, returns False when lease was lost
+    :param interval: Integer or float seconds between calls
+    """
+
+    def __init__(self, renew, interval):
+        super(LeaseRenewer, self).__init__(name='LeaseRenewer')
+        self.daemon = True
+        self.renew = renew
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.renew():
+                break
+
+    def stop(self):
+        """Stop renewing, and wait for thread to exit"""
+        self.stopped.set()
+        self.join()
+
 
 class Flock(object):
     """
     A reader/writer lock object, with locking tightly bound to instance scope.
 
     :Note: This implementation gives reader-lock requests priority over writers.
+    :Note: With a lease, a background thread renews the holder record while the
+           lock is held.  Processes waiting in lock_timeout() break the lock once
+           every holder is stale: dead on this host, or with an expired lease.
+    :Note: Writers first take an exclusive upgrade gate lock, so a held read
+           lock may upgrade() and downgrade() without another writer intervening.
     :Ref: https://en.wikipedia.org/wiki/Readers%E2%80%93writer_lock#Priority_policies
 
     :param name: Optional path/filename of lock file.  Safely generated if None.
+    :param lease: Optional seconds a holder may go without renewing, None to disable.
     """
 
     # Internal, do not use
@@ -49,9 +167,58 @@ class Flock(object):
     #: When no lock file name is specified, use this suffix
     def_suffix = '.lock'
 
-    def __init__(self, lockfilepath=None):
+    #: Initial seconds between non-blocking attempts, when polling is needed
+    poll_min = 0.001
+
+    #: Maximum seconds between non-blocking attempts, when polling is needed
+    poll_max = 0.05
+
+    #: Kernel table of held and requested locks (Linux only)
+    proc_locks = '/proc/locks'
+
+    #: Appended to lock file path, to form the holder and statistics file path
+    holders_suffix = '.holders'
+
+    #: When True, maintain the holders file (i.e. for inspection), costs extra I/O
+    #: on every lock and unlock.  Always True with a lease.
+    record_holders = False
+
+    #: Hostname recorded with holders, identifies pids which may be checked
+    hostname = gethostname()
+
+    #: Seconds a holder may go without renewing before it's stale, None for no lease.
+    lease = None
+
+    #: Minimum seconds between checks for stale holders, while waiting for a lock
+    stale_interval = 1.0
+
+    #: Appended to lock file path, to form the upgrade gate file path
+    upgrade_suffix = '.upgrade'
+
+    # Internal, time when current attempt to lock began
+    _wait_start = None
+
+    # Internal, time when current lock was acquired
+    _acquired = None
+
+    # Internal, time of last check for stale holders
+    _stale_checked = 0
+
+    # Internal, renews lease while lock is held
+    _renewer = None
+
+    # Internal, open upgrade gate file while held
+    _gate = None
+
+    # Internal, threading.Event set to abandon waiting in lock_timeout()
+    _cancelled = None
+
+    def __init__(self, lockfilepath=None, lease=None):
         if lockfilepath is None:
             lockfilepath = os.path.join(self.def_path, self.def_prefix + self.def_suffix)
+        if lease is not None:
+            self.lease = float(lease)
+            self.record_holders = True  # Leases are renewed in the holder records
         self._lockfile = open(lockfilepath, 'a+b', 0)  # No truncate existing
         logging.debug("Prepared lock file %s", self._lockfile.name)
         self._lockfile.close()  # when open, is_locked() == True
@@ -74,18 +241,272 @@ class Flock(object):
         :param op: Bitwise OR of LOCK_SH, LOCK_EX, LOCK_NB
         :returns: File-like object representing data under lock
         """
-        # Allow double-locking by _this_ process only
-        if self._lockfile.closed:
-            # File must remain open for process to continue holding lock
-            self._lockfile = open(self._lockfile.name, 'wb', 0)
-        self.lock_f(self._lockfile, op)
-        self.is_read = bool(op & LOCK_SH)
+        start = self._wait_start or time()
+        if op & LOCK_EX and self.is_read is None:
+            self._gate_lock(LOCK_EX | (op & LOCK_NB))
+        try:
+            while True:
+                # Allow double-locking by _this_ process only
+                if self._lockfile.closed:
+                    # File must remain open for process to continue holding lock
+                    self._lockfile = open(self._lockfile.name, 'wb', 0)
+                self.lock_f(self._lockfile, op)
+                self.is_read = bool(op & LOCK_SH)
+                if self._acquired is not None:  # Converted while held
+                    self._record(op)
+                    break
+                self._acquired = time()
+                if self._record(op, self._acquired - start):
+                    break
+                # Stale lock was broken while waiting, the lock file is no longer in use
+                logging.debug("Lock file %s was replaced, locking again", self._lockfile.name)
+                self._acquired = None
+                self.is_read = None
+                self.unlock_f(self._lockfile, LOCK_UN)
+                self._lockfile.close()
+        finally:
+            if self.is_read is None:  # Failed
+                self._gate_unlock()
+        self._wait_start = None
+        if self.lease and self._renewer is None:
+            self._renewer = LeaseRenewer(self._renew, self.lease / 3.0)
+            self._renewer.start()
+        return self._lockfile
+
+    def _gate_lock(self, op):
+        # Lock upgrade gate, held by writers and upgrading readers
+        if self._gate is not None:
+            return
+        gate = open(self._lockfile.name + self.upgrade_suffix, 'a+b', 0)
+        try:
+            self.lock_f(gate, op)
+        except IOError:
+            gate.close()
+            raise
+        self._gate = gate
+
+    def _gate_unlock(self):
+        if self._gate is not None:
+            self.unlock_f(self._gate, LOCK_UN)
+            self._gate.close()
+            self._gate = None
+
+    def upgrade(self, timeout=None):
+        """
+        Convert held read lock into a write lock, without another writer intervening.
+
+        Other readers may still come and go, until conversion completes.  Waiting
+        on the upgrade gate could deadlock (another upgrading reader, or a writer,
+        waits on this read lock) so that fails immediately instead.
+
+        :param timeout: Optional integer or float seconds to wait for other readers.
+        :raises ValueError: When no lock is held
+        :raises IOError: EDEADLK when another process holds the upgrade gate,
+                         the read lock is retained.
+        :returns: File-like object if converted, None on timeout (read lock retained).
+        """
+        if self.is_read is None:
+            raise ValueError("No lock held to upgrade on %s" % self._lockfile.name)
+        if not self.is_read:
+            return self._lockfile  # Already a write lock
+        try:
+            self._gate_lock(LOCK_EX | LOCK_NB)
+        except IOError, xcept:
+            if xcept.errno not in [EACCES, EAGAIN]:
+                raise
+            raise IOError(EDEADLK, "Another process is upgrading or waiting to write",
+                          self._lockfile.name)
+        if timeout is None:
+            return self.lock(LOCK_EX)
+        lockfile = self.lock_timeout(timeout, LOCK_EX)
+        if lockfile is None:
+            # Conversion isn't atomic, read lock may have been dropped.  Writers
+            # wait on the gate, so it's immediately available.
+            self.lock_f(self._lockfile, LOCK_SH)
+            self._gate_unlock()
+        return lockfile
+
+    def downgrade(self):
+        """
+        Convert held write lock into a read lock, without another writer intervening.
+
+        :raises ValueError: When no lock is held
+        :returns: File-like object representing data under lock
+        """
+        if self.is_read is None:
+            raise ValueError("No lock held to downgrade on %s" % self._lockfile.name)
+        if not self.is_read:
+            self.lock(LOCK_SH)  # Writers still wait on the gate
+        self._gate_unlock()
         return self._lockfile
 
+    @property
+    def _holder_key(self):
+        return '%s:%d:%d' % (self.hostname, os.getpid(), id(self))
+
+    def _is_current(self):
+        # Return False if open lock file was removed or replaced (i.e. broken)
+        try:
+            return os.path.samestat(os.fstat(self._lockfile.fileno()),
+                                    os.stat(self._lockfile.name))
+        except OSError:
+            return False
+
+    def _record(self, op=None, waited=None):
+        # Add (or remove when op is None) holder record, update statistics.
+        # Returns False if lock file was replaced, instead of adding record.
+        if not self.record_holders:
+            return op is None or self._is_current()
+        try:
+            with _json_sidecar(self._lockfile.name + self.holders_suffix) as sidecar:
+                # Checked under sidecar lock, so break_stale() can't interleave
+                if op is not None and not self._is_current():
+                    return False
+                holders = sidecar.setdefault('holders', {})
+                for key, holder in holders.items():
+                    if holder['host'] == self.hostname and not pid_alive(holder['pid']):
+                        del holders[key]  # Crashed without unlocking
+                if op is None:
+                    holder = holders.pop(self._holder_key, None)
+                    if holder is not None:
+                        histogram_add(sidecar.setdefault('hold', {}),
+                                      time() - holder['acquired'])
+                    return
+                holders[self._holder_key] = {'pid': os.getpid(), 'host': self.hostname,
+                                             'op': 'read' if op & LOCK_SH else 'write',
+                                             'acquired': self._acquired,
+                                             'renewed': time(), 'lease': self.lease}
+                if waited is not None:
+                    histogram_add(sidecar.setdefault('wait', {}), waited)
+        except (IOError, OSError), xcept:
+            logging.debug("Not recording lock holder: %s", xcept)
+            return op is None or self._is_current()
+        return True
+
+    def _renew(self):
+        # Lease heartbeat, returns False if the lease was lost
+        try:
+            with _json_sidecar(self._lockfile.name + self.holders_suffix) as sidecar:
+                holder = sidecar.get('holders', {}).get(self._holder_key)
+                if holder is None:
+                    logging.error("Lease on %s lost, the lock was broken by another process",
+                                  self._lockfile.name)
+                    return False
+                holder['renewed'] = time()
+        except (IOError, OSError), xcept:
+            logging.debug("Not renewing lease: %s", xcept)
+        return True
+
+    def _stale(self, holder, now):
+        # Return reason holder record is stale, or None
+        if holder['host'] == self.hostname and not pid_alive(holder['pid']):
+            return 'dead'
+        lease = holder.get('lease')
+        if lease and now - holder.get('renewed', holder['acquired']) > lease:
+            return 'lease expired'
+        return None
+
+    def break_stale(self):
+        """
+        Break the lock if every recorded holder is stale, return True if broken.
+
+        Holders are stale when their pid is dead on this host, or they have not
+        renewed their lease in time.  The latter may still be running (or hung)
+        and holding the lock, so the lock and upgrade gate files are removed.
+        Later lock attempts use new files, and the old holder's lease renewal fails.
+        """
+        now = time()
+        path = self._lockfile.name
+        try:
+            with _json_sidecar(path + self.holders_suffix) as sidecar:
+                holders = sidecar.get('holders', {})
+                reasons = dict((key, self._stale(holder, now))
+                               for key, holder in holders.iteritems())
+                if not reasons or not all(reasons.values()):
+                    return False
+                for key, reason in reasons.iteritems():
+                    holder = holders.pop(key)
+                    logging.warning("Breaking %s lock on %s, pid %d on %s held it for"
+                                    " %0.1fs, %s", holder['op'], path, holder['pid'],
+                                    holder['host'], now - holder['acquired'], reason)
+                if 'lease expired' in reasons.values():
+                    os.unlink(path)
+                    if os.path.exists(path + self.upgrade_suffix):
+                        os.unlink(path + self.upgrade_suffix)
+                return True
+        except (IOError, OSError), xcept:
+            logging.debug("Not breaking lock: %s", xcept)
+        return False
+
+    def _check_stale(self):
+        # While waiting, periodically break stale lock.  When broken, the
+        # (unheld) lock file is closed so the next attempt opens the new one.
+        if time() - self._stale_checked < self.stale_interval:
+            return
+        self._stale_checked = time()
+        if self.break_stale() and self.is_read is None and not self._lockfile.closed:
+            self._lockfile.close()
+
+    def _waiting(self, timedout):
+        # Return True while time remains, and waiting was not cancelled
+        return time() < timedout and not (self._cancelled is not None
+                                          and self._cancelled.is_set())
+
+    def _try_lock(self, op):
+        # Return lock() result or None if it would block
+        try:
+            return self.lock(op | LOCK_NB)
+        except IOError, xcept:
+            if xcept.errno not in [EACCES, EAGAIN]:
+                raise
+        return None
+
+    def _alarm_lock(self, timedout, op):
+        # Blocking lock(), interrupted by SIGALRM at timedout.  Raises
+        # ValueError if not called from the main thread.
+        previous = signal.signal(signal.SIGALRM, _interrupt)
+        try:
+            signal.siginterrupt(signal.SIGALRM, True)
+            while self._waiting(timedout):
+                # Wake up to check for stale holders, or timeout.  Repeats, in
+                # case alarm arrives before flock() blocks.
+                signal.setitimer(signal.ITIMER_REAL,
+                                 max(min(timedout - time(), self.stale_interval),
+                                     self.poll_min), self.poll_max)
+                try:
+                    return self.lock(op & ~LOCK_NB)
+                except IOError, xcept:
+                    if xcept.errno != EINTR:
+                        raise
+                self._check_stale()
+            return None
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            if previous is None:  # Not installed from python
+                previous = signal.SIG_DFL
+            signal.signal(signal.SIGALRM, previous)
+
+    def _poll_lock(self, timedout, op):
+        # Non-blocking lock() attempts, with jittered exponential backoff
+        delay = self.poll_min
+        while self._waiting(timedout):
+            sleep(max(min(delay, timedout - time()), 0))
+            lockfile = self._try_lock(op)
+            if lockfile is not None:
+                return lockfile
+            self._check_stale()
+            delay = min(delay * 2, self.poll_max) * random.uniform(0.5, 1.0)
+        return None
+
     def lock_timeout(self, timeout, op):
         """
         Execute locking operation, return True when successful.
 
+        From the main thread, (when no interval timer is in use) waits in a
+        blocking lock, interrupted by SIGALRM on timeout.  Lock hand-off is
+        then immediate.  Otherwise, polls with a short, increasing interval.
+        Either way, stale holders are checked for every ``stale_interval``.
+
         :param timeout: Integer or float, timeout in seconds to wait for operation.
         :param op: Bitwise OR of fcntl.LOCK_UN, LOCK_SH, LOCK_EX, LOCK_NB.
         :returns: File-like object if lock was acquired, None if not.
@@ -93,19 +514,21 @@ class Flock(object):
         timeout = float(timeout)
         logging.debug("(Timeing after %0.4f seconds)", timeout)
         timedout = time() + timeout
-        while time() < timedout:
+        if self._wait_start is None:
+            self._wait_start = time()
+        lockfile = self._try_lock(op)
+        if lockfile is None and timeout > 0:
             try:
-                lockfile = self.lock(op | LOCK_NB)
-                timedout = 0
-                break
-            except IOError, xcept:
-                if xcept.errno not in [EACCES, EAGAIN]:
-                    raise
-            # Don't busy wait for fixed times (avoids clashes)
-            sleep(0.01 + (random.randrange(0, 100) / 100))
-        if bool(timedout):
+                if signal.getitimer(signal.ITIMER_REAL)[0]:
+                    raise ValueError("Interval timer already in use")
+                lockfile = self._alarm_lock(timedout, op)
+            except ValueError:  # Signals only work in main thread
+                lockfile = self._poll_lock(timedout, op)
+        if lockfile is None:
             logging.debug("(Timed out)")
-            return None
+            self._wait_start = None
+            if self.is_read is None and not self._lockfile.closed:
+                self._lockfile.close()  # Not holding any lock
         return lockfile
 
     def unlock(self):
@@ -114,34 +537,72 @@ class Flock(object):
 
         :returns: True if lock was held (and released) from current scope
         """
+        if self._renewer is not None:
+            self._renewer.stop()
+            self._renewer = None
         if self._lockfile.closed:
             return  False  # Lock was not held by this process
         self.unlock_f(self._lockfile, LOCK_UN)
         self._lockfile.close()
         self.is_read = None
+        self._gate_unlock()
+        if self._acquired is not None:
+            self._record()
+            self._acquired = None
         return True  # Lock was held by this process, and released
 
+    def kernel_locks(self):
+        """
+        Return list of (pid, mode, waiting) for the lock file, from /proc/locks
+
+        :N/B: Only locks taken on this host are listed, even on NFS.
+        :raises IOError: When the kernel table is unavailable (i.e. not Linux)
+        :returns: List of tuples, mode is 'read' or 'write', waiting is a bool
+        """
+        stat = os.stat(self._lockfile.name)
+        device_inode = (os.major(stat.st_dev), os.minor(stat.st_dev), stat.st_ino)
+        result = []
+        with open(self.proc_locks, 'rb') as proc_locks:
+            for line in proc_locks:
+                # e.g. "1: -> FLOCK  ADVISORY  WRITE 1234 fe:00:5678 0 EOF"
+                fields = line.split()
+                waiting = len(fields) > 1 and fields[1] == '->'
+                if waiting:
+                    del fields[1]
+                if len(fields) < 6 or fields[1] != 'FLOCK':
+                    continue
+                try:
+                    major, minor, inode = fields[5].split(':')
+                    if (int(major, 16), int(minor, 16), int(inode)) != device_inode:
+                        continue
+                    result.append((int(fields[4]), fields[3].lower(), waiting))
+                except ValueError:
+                    continue
+        return result
+
     @property
     def is_locked(self):
         """
         Return True/False if any lock is currently held by this or another process.
         """
-        if self.is_read is None:  # maintained by lock()/unlock()
+        if self.is_read is not None:  # maintained by lock()/unlock()
             return True  # Lock is held by this process
+        try:  # Cheap, but blind to holders on other (NFS) hosts
+            if any(not waiting for _, _, waiting in self.kernel_locks()):
+                return True
+        except (IOError, OSError):
+            pass
         # If non-blocking lock can be acquired, lock is not held by any process
-        locked = False
-        try:
-            logging.debug("Test-acquiring to check locked state...")
-            self.lock(LOCK_EX | LOCK_NB)
-            locked = False
-        except IOError, xcept:
-            if xcept.errno not in [EACCES, EAGAIN]:
-                raise
-            locked = True
-        finally:  # Always, immediatly unlock
-            self.unlock()
-            logging.debug("...test-acquire complete.")
-        return locked
+        logging.debug("Test-acquiring to check locked state...")
+        with open(self._lockfile.name, 'rb') as probe:
+            try:
+                self.lock_f(probe, LOCK_EX | LOCK_NB)
+            except IOError, xcept:
+                if xcept.errno not in [EACCES, EAGAIN]:
+                    raise
+                return True
+            self.unlock_f(probe, LOCK_UN)
+        return False
 
     @contextmanager
     def _acquire(self, op, name):
@@ -211,36 +672,820 @@ class Flock(object):
         """
         return self._timeout_acquire(timeout, LOCK_EX, "write")
 
+    def acquire_read_async(self, timeout=None):
+        """
+        Begin acquiring a read-lock in the background, within an optional timeout period.
+
+        :returns: PendingLock context manager, its result() is a read-only
+                  file-like object if successful, None if not.
+        """
+        return PendingLock(self, timeout, LOCK_SH, "read")
+
+    def acquire_write_async(self, timeout=None):
+        """
+        Begin acquiring a write-lock in the background, within an optional timeout period.
+
+        :returns: PendingLock context manager, its result() is a read-only
+                  file-like object if successful, None if not.
+        """
+        return PendingLock(self, timeout, LOCK_EX, "write")
+
+
+class PendingLock(object):
+    """
+    Lock acquisition waiting in a helper thread, for use from event loops.
+
+    The file descriptor from fileno() becomes readable once done(), so many
+    acquisitions may be multiplexed with select(), poll() or wait_pending().
+    On exit (or release()), waiting is cancelled, and any acquired lock released.
+
+    :param lock: Flock (or subclass) instance to acquire, not shared with other waits
+    :param timeout: Integer or float seconds to wait, None for no limit
+    :param op: Bitwise OR of fcntl.LOCK_SH, LOCK_EX
+    :param name: Description of operation for logging
+    """
+
+    def __init__(self, lock, timeout, op, name):
+        self.lock = lock
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+        self._cancelled = threading.Event()
+        self._read_fd, self._write_fd = os.pipe()
+        self.lock._cancelled = self._cancelled
+        self._thread = threading.Thread(target=self._acquire, name='PendingLock',
+                                        args=(timeout, op, name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return 'PendingLock(%r)' % self.lock
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **dargs):
+        del args
+        del dargs
+        self.release()
+        return False
+
+    def _acquire(self, timeout, op, name):
+        start = time()
+        if timeout is None:
+            timeout = float('inf')
+        try:
+            lockfile = self.lock.lock_timeout(timeout, op)
+            if lockfile:
+                logging.debug("    %d acquired %s lock in background, waited %0.4fs",
+                              os.getpid(), name, time() - start)
+                self._result = open(lockfile.name, 'rb')
+            elif not self._cancelled.is_set():
+                logging.error("    %d timedout acquiring %s lock after %0.4fs",
+                              os.getpid(), name, time() - start)
+        except Exception:  # pylint: disable=W0703
+            self._error = sys.exc_info()  # Re-raised by result()
+        finally:
+            self._done.set()
+            os.write(self._write_fd, '.')
+
+    def fileno(self):
+        """
+        Return file descriptor which becomes readable when done.
+        """
+        return self._read_fd
+
+    def done(self):
+        """
+        Return True if waiting finished, successfully or not.
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait until done, return file-like object if successful, None if not.
+
+        :param timeout: Optional seconds to wait for completion, None for no limit
+        :raises: Any exception raised while acquiring
+        """
+        if not self._done.wait(timeout):
+            return None
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+    def release(self):
+        """
+        Cancel waiting, release lock if acquired, may call more than once.
+        """
+        self._cancelled.set()
+        if self._read_fd is None:
+            return
+        self._thread.join()
+        if self._result is not None:
+            self.lock.unlock()
+            self._result.close()
+            self._result = None
+        self.lock._cancelled = None
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+        self._read_fd = self._write_fd = None
+
+
+def wait_pending(pending, timeout=None):
+    """
+    Return list of PendingLock which are done, waiting for at least one.
+
+    :param pending: Iterable of PendingLock instances
+    :param timeout: Optional seconds to wait, None for no limit
+    :returns: Empty list on timeout
+    """
+    pending = list(pending)
+    ready = [item for item in pending if item.done()]
+    if ready or not pending:
+        return ready
+    readable = select.select(pending, [], [], timeout)[0]
+    return [item for item in pending if item in readable and item.done()]
+
+
+class FairFlock(Flock):
+    """
+    A reader/writer lock object, granting locks in first-come, first-served order.
+
+    Every request takes a ticket in a sidecar queue file, and may only proceed
+    once it reaches the front.  Consecutive queued readers share the front,
+    so reads are still batched, but a queued writer holds back readers
+    arriving after it.  Entries of dead processes on this host, and those
+    with an expired lease, are pruned.
+
+    :Ref: https://en.wikipedia.org/wiki/Ticket_lock
+
+    :param name: Optional path/filename of lock file.  Safely generated if None.
+    :param lease: Optional seconds a holder may go without renewing, None to disable.
+    """
+
+    #: Appended to lock file path, to form the queue file path
+    queue_suffix = '.queue'
+
+    # Internal, do not use
+    _ticket = None
+
+    def __init__(self, lockfilepath=None, lease=None):
+        super(FairFlock, self).__init__(lockfilepath, lease)
+        self.queue_path = self._lockfile.name + self.queue_suffix
+        open(self.queue_path, 'a+b', 0).close()  # No truncate existing
+
+    def __repr__(self):
+        return 'FairFlock(%s)' % self._lockfile.name
+
+    @contextmanager
+    def _queue(self):
+        # Yields mutable [next_ticket, entries] under exclusive queue-file lock
+        with open(self.queue_path, 'r+b', 0) as queue_file:
+            flock(queue_file, LOCK_EX)  # Only ever held very briefly
+            try:
+                lines = queue_file.read().splitlines()
+                state = [0, []]
+                if lines:
+                    state[0] = int(lines.pop(0))
+                for line in lines:
+                    fields = line.split() + ['0', '0']  # Written without lease
+                    state[1].append(QueueEntry(int(fields[0]), int(fields[1]),
+                                               fields[2], fields[3],
+                                               float(fields[4]), float(fields[5])))
+                before = (state[0], list(state[1]))
+                yield state
+                if (state[0], state[1]) != before:
+                    queue_file.seek(0)
+                    queue_file.truncate()
+                    queue_file.write(''.join(['%d\n' % state[0]] +
+                                             ['%d %d %s %s %0.3f %g\n' % entry
+                                              for entry in state[1]]))
+            finally:
+                flock(queue_file, LOCK_UN)
+
+    def _enqueue(self, op):
+        with self._queue() as state:
+            entry = QueueEntry(state[0], os.getpid(), self.hostname,
+                               'read' if op & LOCK_SH else 'write',
+                               time(), self.lease or 0)
+            state[0] += 1
+            state[1].append(entry)
+        return entry.ticket
 
-def _umpa_lumpa(n):
-    # Don't all try to do locking all at once
-    sleep(1 + float(random.randrange(0, 100) / 100))
-    _flock = Flock('/tmp/doopitydoo.lock')
-    method = random.choice([_flock.acquire_read, _flock.acquire_write])
-    with method():
-        logging.debug("    %d(%d) is doing some important work", n, os.getpid())
-        sleep(1 + float(random.randrange(0, 100) / 100))
+    def _dequeue(self, ticket):
+        with self._queue() as state:
+            state[1] = [entry for entry in state[1] if entry.ticket != ticket]
+
+    def _pruned(self, entries, ticket, now):
+        # Return entries without stale entries (other than ticket), renewing ticket
+        result = []
+        for entry in entries:
+            if entry.ticket == ticket:
+                if entry.lease and now - entry.renewed > entry.lease / 3.0:
+                    entry = entry._replace(renewed=now)
+            elif entry.host == self.hostname and not pid_alive(entry.pid):
+                continue
+            elif entry.lease and now - entry.renewed > entry.lease:
+                logging.warning("Removing ticket %d of pid %d on %s from %s, lease expired",
+                                entry.ticket, entry.pid, entry.host, self.queue_path)
+                continue
+            result.append(entry)
+        return result
+
+    def _ahead(self, ticket):
+        """
+        Return queue entries up to and including ticket, pruning stale entries.
+
+        :returns: List of QueueEntry, or None if ticket is not in the queue
+        """
+        with self._queue() as state:
+            state[1] = self._pruned(state[1], ticket, time())
+            tickets = [entry.ticket for entry in state[1]]
+            if ticket not in tickets:
+                logging.warning("Ticket %d missing from %s", ticket, self.queue_path)
+                return None
+            return state[1][:tickets.index(ticket) + 1]
+
+    def _my_turn(self, ticket):
+        """
+        Return True if ticket may proceed to lock.
+        """
+        entries = self._ahead(ticket)
+        if entries is None:
+            return True  # Removed by another process, underlying lock still excludes
+        if entries[-1].op == 'read':
+            return all(entry.op == 'read' for entry in entries)
+        return len(entries) == 1
+
+    def _fair_lock(self, op, deadline):
+        # Allow double-locking by _this_ process only, already at front of queue
+        if self._ticket is not None:
+            if deadline is None:
+                return super(FairFlock, self).lock(op)
+            return super(FairFlock, self).lock_timeout(
+                max(deadline - time(), self.poll_min), op)
+        self._wait_start = time()  # Includes time spent in queue
+        self._ticket = self._enqueue(op)
+        lockfile = None
+        try:
+            delay = self.poll_min
+            while not self._my_turn(self._ticket):
+                if op & LOCK_NB:
+                    raise IOError(EAGAIN, "Lock queued by another process")
+                if deadline is not None and not self._waiting(deadline):
+                    return None
+                sleep(delay)
+                delay = min(delay * 2, self.poll_max)
+            # Only processes not using the queue could still be holding it
+            if deadline is None:
+                lockfile = super(FairFlock, self).lock(op)
+            else:
+                lockfile = super(FairFlock, self).lock_timeout(
+                    max(deadline - time(), self.poll_min), op)
+            return lockfile
+        finally:
+            if lockfile is None:  # Failed, don't hold up other processes
+                self._wait_start = None
+                self._dequeue(self._ticket)
+                self._ticket = None
+
+    def _renew(self):
+        # Lease heartbeat, also for queue entry
+        if self._ticket is not None:
+            with self._queue() as state:
+                state[1] = [entry._replace(renewed=time()) if entry.ticket == self._ticket
+                            else entry for entry in state[1]]
+        return super(FairFlock, self)._renew()
+
+    def lock(self, op):
+        """
+        Execute locking operation, after all earlier requests have been served.
+
+        :param op: Bitwise OR of LOCK_SH, LOCK_EX, LOCK_NB
+        :returns: File-like object representing data under lock
+        """
+        return self._fair_lock(op, None)
 
+    def lock_timeout(self, timeout, op):
+        """
+        Execute locking operation, in turn, return True when successful.
+
+        :param timeout: Integer or float, timeout in seconds to wait for operation.
+        :param op: Bitwise OR of fcntl.LOCK_UN, LOCK_SH, LOCK_EX, LOCK_NB.
+        :returns: File-like object if lock was acquired, None if not.
+        """
+        return self._fair_lock(op, time() + float(timeout))
+
+    def unlock(self):
+        """
+        Execure unlocking operation and leave queue, may call more than once.
+
+        :returns: True if lock was held (and released) from current scope
+        """
+        result = super(FairFlock, self).unlock()
+        if self._ticket is not None:
+            self._dequeue(self._ticket)
+            self._ticket = None
+        return result
+
+
+class FlockSemaphore(object):
+    """
+    A counting semaphore, limiting concurrent holders across processes to slots.
+
+    Each slot is a separate lock file, ``<path>.<n>``, probed without blocking.
+    Waiters are served in first-come, first-served order, through the queue
+    of a FairFlock on path.
+
+    :param path: Path/filename of queue lock file, and prefix of slot lock files.
+    :param slots: Maximum number of concurrent holders, at least one.
+    """
+
+    def __init__(self, path, slots):
+        self.slots = int(slots)
+        if self.slots < 1:
+            raise ValueError("Semaphore requires at least one slot, not %s" % slots)
+        self.fairflock = FairFlock(path)
+        self.slot_paths = ['%s.%d' % (path, number) for number in xrange(self.slots)]
+
+    def __repr__(self):
+        return 'FlockSemaphore(%s, %d)' % (self.fairflock._lockfile.name, self.slots)
+
+    def _my_turn(self, ticket):
+        entries = self.fairflock._ahead(ticket)
+        return entries is None or len(entries) <= self.slots
+
+    def _try_slot(self):
+        # Return open slot file, exclusively locked, or None if every slot is held.
+        # Plain flock() probe, slots need no holder records or upgrade gates.
+        for slot_path in self.slot_paths:
+            slot_file = open(slot_path, 'a+b', 0)  # No truncate existing
+            try:
+                flock(slot_file, LOCK_EX | LOCK_NB)
+                return slot_file
+            except IOError, xcept:
+                slot_file.close()
+                if xcept.errno not in [EACCES, EAGAIN]:
+                    raise
+        return None
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """
+        Context manager wrapping one of the slots, within an optional timeout period.
+
+        :param timeout: Integer or float seconds to wait for a slot, None for no limit.
+        :returns: Read-only file-like object of slot lock file if successful, None if not.
+        """
+        # __enter__
+        start = time()
+        ticket = self.fairflock._enqueue(LOCK_EX)
+        slot_file = None
+        try:
+            delay = self.fairflock.poll_min
+            while True:
+                if self._my_turn(ticket):
+                    slot_file = self._try_slot()
+                    if slot_file is not None:
+                        break
+                if timeout is not None and time() - start >= float(timeout):
+                    break
+                sleep(delay)
+                delay = min(delay * 2, self.fairflock.poll_max)
+            if slot_file is None:
+                logging.error("    %d timedout acquiring one of %d slots after %0.4fs",
+                              os.getpid(), self.slots, time() - start)
+                yield None
+            else:
+                logging.debug("    %d acquired slot %s, waited %0.4fs",
+                              os.getpid(), slot_file.name, time() - start)
+                yield open(slot_file.name, 'rb')
+        finally:
+            # __exit__
+            if slot_file is not None:
+                flock(slot_file, LOCK_UN)
+                slot_file.close()
+                logging.debug("    %d slot %s released, held for %0.4fs",
+                              os.getpid(), slot_file.name, time() - start)
+            self.fairflock._dequeue(ticket)
 
-def _make_candy():
+
+class FlockStore(object):
+    """
+    Fixed-size, memory-mapped key/value record store, shared under a Flock.
+
+    The store is a sidecar file with a versioned header, followed by fixed-size
+    slots.  Each slot holds a key, a JSON-encoded value, and a checksum, so a
+    slot torn by a crashed writer reads as missing.  Reading requires the
+    flock to be held (read or write), writing requires a write lock.  The file
+    is mapped once per lock acquisition, and flushed after every change.
+
+    :param lock: Flock instance guarding the store
+    :param slots: Number of key/value slots, when creating the store
+    :param slot_size: Maximum bytes of key and encoded value, when creating the store
+    """
+
+    #: Appended to lock file path, to form the store file path
+    suffix = '.store'
+
+    #: Identifies the file format, changing version discards existing records
+    magic = 'ADEPTSTO'
+    version = 1
+
+    # magic, version, generation, slots, slot_size
+    header = struct.Struct('<8sIQII')
+
+    # key length, value length, crc32 of key and value
+    slot_header = struct.Struct('<HII')
+
+    def __init__(self, lock, slots=64, slot_size=4096):
+        self.lock = lock
+        self.path = lock._lockfile.name + self.suffix
+        self.slots = int(slots)
+        self.slot_size = int(slot_size)
+        if self.slots < 1 or self.slot_size <= self.slot_header.size:
+            raise ValueError("Store requires at least one slot larger than %d bytes"
+                             % self.slot_header.size)
+        self._map = None
+        self._writable = False
+        self._mapped_at = None
+
+    def __repr__(self):
+        return 'FlockStore(%s)' % self.path
+
+    def close(self):
+        """
+        Unmap the store file, may call more than once.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _require(self, write):
+        if self.lock.is_read is None or (write and self.lock.is_read):
+            raise ValueError("%s lock must be held on %s to %s store"
+                             % ('Write' if write else 'A', self.lock._lockfile.name,
+                                'write' if write else 'read'))
+
+    def _mapped(self, write):
+        # Return mmap of store, initialized when writing, or None if there is none
+        if (self._map is not None and self._mapped_at == self.lock._acquired
+                and self._writable >= write):
+            return self._map
+        self.close()
+        try:
+            fileno = os.open(self.path, os.O_RDWR | os.O_CREAT if write else os.O_RDONLY,
+                             0666)
+        except OSError, xcept:
+            if xcept.errno != ENOENT:
+                raise
+            return None  # Nothing written yet
+        try:
+            if self._geometry(fileno) is None:
+                if not write:
+                    return None  # Not (yet) valid, nothing to read
+                self._initialize(fileno)
+            try:
+                self._map = mmap.mmap(fileno, 0, access=mmap.ACCESS_WRITE if write
+                                      else mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                return None
+        finally:
+            os.close(fileno)  # Mapping remains valid
+        self._writable = write
+        self._mapped_at = self.lock._acquired
+        return self._map
+
+    def _geometry(self, fileno):
+        # Return (generation, slots, slot_size) from valid header, None otherwise
+        size = os.fstat(fileno).st_size
+        if size < self.header.size:
+            return None
+        os.lseek(fileno, 0, os.SEEK_SET)
+        magic, version, generation, slots, slot_size = self.header.unpack(
+            os.read(fileno, self.header.size))
+        if (magic, version) != (self.magic, self.version):
+            return None
+        if size < self.header.size + slots * slot_size:
+            return None  # Truncated
+        return generation, slots, slot_size
+
+    def _initialize(self, fileno):
+        # Write fresh header and empty slots, file never shrinks so mappings stay valid
+        size = self.header.size + self.slots * self.slot_size
+        os.ftruncate(fileno, max(size, os.fstat(fileno).st_size))
+        os.lseek(fileno, 0, os.SEEK_SET)
+        os.write(fileno, self.header.pack(self.magic, self.version, 1, self.slots,
+                                          self.slot_size) + '\0' * (size - self.header.size))
+        logging.debug("Initialized %d slot store %s", self.slots, self.path)
+
+    def _records(self, mapped):
+        # Yield (offset, key, encoded value) of every intact, used slot
+        _, _, _, slots, slot_size = self.header.unpack_from(mapped)
+        for offset in xrange(self.header.size, self.header.size + slots * slot_size,
+                             slot_size):
+            key_len, value_len, crc = self.slot_header.unpack_from(mapped, offset)
+            if not key_len:
+                continue
+            start = offset + self.slot_header.size
+            data = mapped[start:start + min(key_len + value_len,
+                                            slot_size - self.slot_header.size)]
+            if zlib.crc32(data) & 0xffffffff != crc:
+                logging.debug("Ignoring corrupt slot at %d in %s", offset, self.path)
+                continue
+            yield offset, data[:key_len], data[key_len:]
+
+    def _changed(self, mapped):
+        # Increment generation and flush changes to file
+        magic, version, generation, slots, slot_size = self.header.unpack_from(mapped)
+        self.header.pack_into(mapped, 0, magic, version, generation + 1, slots, slot_size)
+        mapped.flush()
+
+    @property
+    def generation(self):
+        """
+        Number incremented by every change, zero if the store doesn't exist.
+        """
+        self._require(False)
+        mapped = self._mapped(False)
+        if mapped is None:
+            return 0
+        return self.header.unpack_from(mapped)[2]
+
+    def items(self):
+        """
+        Return dictionary of all keys and decoded values.
+        """
+        self._require(False)
+        mapped = self._mapped(False)
+        if mapped is None:
+            return {}
+        return dict((key, json.loads(value)) for _, key, value in self._records(mapped))
+
+    def get(self, key, default=None):
+        """
+        Return decoded value of key, or default if missing.
+        """
+        self._require(False)
+        mapped = self._mapped(False)
+        if mapped is not None:
+            for _, slot_key, value in self._records(mapped):
+                if slot_key == key:
+                    return json.loads(value)
+        return default
+
+    def set(self, key, value):
+        """
+        Store JSON-encodable value under non-empty key, replacing any existing.
+
+        :raises ValueError: When key and encoded value don't fit, or store is full.
+        """
+        self._require(True)
+        key = str(key)
+        data = key + json.dumps(value, sort_keys=True)
+        mapped = self._mapped(True)
+        _, _, _, slots, slot_size = self.header.unpack_from(mapped)
+        if not key or len(data) > slot_size - self.slot_header.size:
+            raise ValueError("Key %r and value don't fit in %d byte slot of %s"
+                             % (key, slot_size, self.path))
+        used = dict((slot_key, offset) for offset, slot_key, _ in self._records(mapped))
+        offset = used.get(key)
+        if offset is None:
+            free = (set(xrange(self.header.size, self.header.size + slots * slot_size,
+                               slot_size)) - set(used.values()))
+            if not free:
+                raise ValueError("All %d slots of %s are in use" % (slots, self.path))
+            offset = min(free)
+        start = offset + self.slot_header.size
+        # A crash before the header is written leaves a checksum mismatch
+        mapped[start:start + len(data)] = data
+        self.slot_header.pack_into(mapped, offset, len(key), len(data) - len(key),
+                                   zlib.crc32(data) & 0xffffffff)
+        self._changed(mapped)
+
+    def delete(self, key):
+        """
+        Remove key from store, return True if it existed.
+        """
+        self._require(True)
+        mapped = self._mapped(True)
+        for offset, slot_key, _ in self._records(mapped):
+            if slot_key == key:
+                self.slot_header.pack_into(mapped, offset, 0, 0, 0)
+                self._changed(mapped)
+                return True
+        return False
+
+
+def inspect(path):
+    """
+    Return dictionary describing holders, waiters and contention of lock file path
+
+    Holders and statistics are only available from Flocks with record_holders.
+
+    :param path: Path/filename of an existing lock file
+    :raises IOError: When path does not exist
+    """
+    if not os.path.isfile(path):
+        raise IOError(ENOENT, "No such lock file", path)
+    now = time()
+    result = {'path': path}
+    with _json_sidecar(path + Flock.holders_suffix) as sidecar:
+        holders = sidecar.get('holders', {}).values()
+        for name in ('wait', 'hold'):
+            result[name] = histogram_summary(sidecar.get(name, {}))
+    for holder in holders:
+        holder['held_for'] = round(now - holder['acquired'], 4)
+        holder['expired'] = bool(holder.get('lease') and
+                                 now - holder.get('renewed', now) > holder['lease'])
+        if holder['host'] == Flock.hostname:
+            holder['alive'] = pid_alive(holder['pid'])
+    result['holders'] = sorted(holders, key=lambda holder: holder['acquired'])
+    try:
+        result['kernel'] = [{'pid': pid, 'op': mode, 'waiting': waiting}
+                            for pid, mode, waiting in Flock(path).kernel_locks()]
+    except (IOError, OSError):
+        result['kernel'] = None  # Not available
+    result['queue'] = []
+    if os.path.isfile(path + FairFlock.queue_suffix):
+        with FairFlock(path)._queue() as state:
+            result['queue'] = [entry._asdict() for entry in state[1]]
+    return result
+
+
+def format_inspection(info):
+    """
+    Return human-readable multi-line string from inspect() dictionary
+    """
+    lines = ["Lock file: %s" % info['path'], "Holders:"]
+    for holder in info['holders']:
+        lines.append("    pid %(pid)d on %(host)s holds %(op)s lock for %(held_for)0.4fs"
+                     % holder + ('' if holder.get('alive', True) else ' (dead)') +
+                     (' (lease expired)' if holder['expired'] else ''))
+    if info['kernel'] is None:
+        lines.append("Waiters: (unknown, no kernel lock table)")
+    else:
+        lines.append("Waiters (this host):")
+        lines.extend("    pid %(pid)d waiting for %(op)s lock" % waiter
+                     for waiter in info['kernel'] if waiter['waiting'])
+    if info['queue']:
+        lines.append("Queue:")
+        lines.extend("    ticket %(ticket)d pid %(pid)d on %(host)s for %(op)s lock" % entry
+                     for entry in info['queue'])
+    for name in ('wait', 'hold'):
+        summary = info[name]
+        lines.append("%s times: count %d, p50 %ss, p99 %ss, max %ss"
+                     % (name.capitalize(), summary['count'], summary['p50'],
+                        summary['p99'], summary['max']))
+    return '\n'.join(lines)
+
+
+def percentiles(values):
+    """
+    Return dictionary of count, exact p50, p99 and max of values (or None if empty)
+    """
+    values = sorted(values)
+    result = {'count': len(values)}
+    for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0)):
+        if values:
+            result[name] = round(values[int(fraction * (len(values) - 1))], 6)
+        else:
+            result[name] = None
+    return result
+
+
+def _bench_worker(args):
+    # Returns list of (op, wait, acquired) tuples, one per iteration
+    index, config = args
+    rng = random.Random(config['seed'] + index)
+    lock_class = FairFlock if config['fair'] else Flock
+    locks = [lock_class(os.path.join(config['directory'], 'bench%d.lock' % number))
+             for number in xrange(config['locks'])]
+    sleep(max(0, config['start'] - time()))  # Begin all together
+    samples = []
+    for _ in xrange(config['iterations']):
+        sleep(rng.uniform(0, config['think'] * 2))
+        lock = rng.choice(locks)
+        write = rng.random() < config['write_ratio']
+        began = time()
+        acquired = lock.lock_timeout(config['timeout'], LOCK_EX if write else LOCK_SH)
+        samples.append(('write' if write else 'read', time() - began, bool(acquired)))
+        if acquired:
+            sleep(rng.uniform(0, config['write_hold' if write else 'read_hold'] * 2))
+            lock.unlock()
+    return samples
+
+
+def benchmark(directory, processes=8, iterations=50, write_ratio=0.2,
+              read_hold=0.01, write_hold=0.01, think=0.01, locks=1,
+              fair=False, timeout=60, starve=1.0, seed=None):
+    """
+    Return JSON-compatible dictionary of lock throughput, latency and fairness
+
+    Each of processes acquires and releases a randomly chosen lock, iterations
+    times.  Hold and think (between acquisitions) times are uniformly random,
+    averaging the given seconds.  Contention goes up with processes, write_ratio
+    and hold times, and down with think time and the number of locks.
+
+    :param directory: Existing directory to create lock files in
+    :param fair: Use FairFlock instead of Flock when True
+    :param timeout: Seconds before an acquisition is abandoned (also starved)
+    :param starve: Acquisitions waiting this many seconds or more are counted starved
+    :param seed: Integer making operations and timings repeatable, random if None
+    """
     import multiprocessing
-    procs = [multiprocessing.Process(target=_umpa_lumpa, args=(n,))
-             for n in xrange(20)]
-    random.shuffle(procs)
-    for proc in procs:
-        proc.start()
-    random.shuffle(procs)
-    for proc in procs:
-        proc.join()
-    logging.debug("MOARRRSUGARRRRR!")
+    config = dict(directory=directory, iterations=iterations, write_ratio=write_ratio,
+                  read_hold=read_hold, write_hold=write_hold, think=think,
+                  locks=locks, fair=fair, timeout=timeout,
+                  seed=random.randrange(2**31) if seed is None else seed)
+    pool = multiprocessing.Pool(processes)
+    try:
+        config['start'] = time() + 0.1 * processes  # Allow workers to spawn
+        results = pool.map(_bench_worker, [(index, config) for index in xrange(processes)])
+        elapsed = time() - config['start']
+    finally:
+        pool.terminate()
+        pool.join()
+    del config['start']
+    del config['directory']
+    config['processes'] = processes
+    config['starve'] = starve
+    samples = [sample for worker in results for sample in worker]
+    acquired = [sample for sample in samples if sample[2]]
+    worker_counts = [sum(1 for sample in worker if sample[2]) for worker in results]
+    return {
+        'config': config,
+        'elapsed': round(elapsed, 4),
+        'acquisitions': len(acquired),
+        'throughput': round(len(acquired) / elapsed, 2),
+        'latency': dict((name, percentiles(wait for op, wait, _ in acquired
+                                           if name in ('all', op)))
+                        for name in ('all', 'read', 'write')),
+        'fairness': {'max_wait': round(max(wait for _, wait, _ in samples), 6),
+                     'min_worker_acquisitions': min(worker_counts),
+                     'max_worker_acquisitions': max(worker_counts)},
+        'starved': sum(1 for _, wait, got in samples if not got or wait >= starve),
+        'timeouts': len(samples) - len(acquired)}
+
+
+def parse_args(argv):
+    """
+    Return parsed command-line arguments
+    """
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description=__doc__.strip())
+    parser.add_argument('--inspect', '-i', default=None, metavar='PATH',
+                        help='Show holders, waiters, and wait/hold time statistics'
+                             ' of lock file PATH.  Holders and statistics are only'
+                             ' recorded by leased, or record_holders, locks.')
+    parser.add_argument('--json', '-j', default=False, action='store_true',
+                        help='With --inspect, output JSON instead of text.')
+    bench = parser.add_argument_group('benchmark',
+                                      'Without --inspect, print JSON results of'
+                                      ' a lock contention benchmark.')
+    bench.add_argument('--processes', '-p', default=8, type=int,
+                       help='Number of processes contending for locks (default: 8).')
+    bench.add_argument('--iterations', '-n', default=50, type=int,
+                       help='Acquisitions made by each process (default: 50).')
+    bench.add_argument('--write-ratio', '-w', default=0.2, type=float,
+                       help='Fraction of acquisitions which are writes (default: 0.2).')
+    bench.add_argument('--read-hold', default=0.01, type=float, metavar='SECONDS',
+                       help='Average time read locks are held (default: 0.01).')
+    bench.add_argument('--write-hold', default=0.01, type=float, metavar='SECONDS',
+                       help='Average time write locks are held (default: 0.01).')
+    bench.add_argument('--think', default=0.01, type=float, metavar='SECONDS',
+                       help='Average time between acquisitions (default: 0.01).')
+    bench.add_argument('--locks', default=1, type=int,
+                       help='Number of lock files to spread acquisitions over,'
+                            ' fewer means more contention (default: 1).')
+    bench.add_argument('--fair', default=False, action='store_true',
+                       help='Benchmark FairFlock instead of Flock.')
+    bench.add_argument('--timeout', default=60, type=float, metavar='SECONDS',
+                       help='Abandon acquisitions after this long (default: 60).')
+    bench.add_argument('--starve', default=1.0, type=float, metavar='SECONDS',
+                       help='Count acquisitions waiting this long as starved'
+                            ' (default: 1.0).')
+    bench.add_argument('--seed', default=None, type=int,
+                       help='Make operations and timings repeatable.')
+    return parser.parse_args(argv[1:])
 
 
 if __name__ == '__main__':
+    ARGS = parse_args(sys.argv)
+    if ARGS.inspect:
+        INFO = inspect(ARGS.inspect)
+        if ARGS.json:
+            print json.dumps(INFO, indent=2, sort_keys=True)
+        else:
+            print format_inspection(INFO)
+        sys.exit(0)
+    TEMPDIR = tempfile.mkdtemp(prefix='flock_bench_')
     try:
-        LOGGER = logging.getLogger()
-        # Lower to DEBUG for massively detailed output
-        LOGGER.setLevel(logging.DEBUG)
-        logging.debug("Charlie?")
-        _make_candy()
+        print json.dumps(benchmark(TEMPDIR, ARGS.processes, ARGS.iterations,
+                                   ARGS.write_ratio, ARGS.read_hold, ARGS.write_hold,
+                                   ARGS.think, ARGS.locks, ARGS.fair, ARGS.timeout,
+                                   ARGS.starve, ARGS.seed),
+                         indent=2, sort_keys=True)
     finally:
-        os.unlink('/tmp/doopitydoo.lock')
+        shutil.rmtree(TEMPDIR)
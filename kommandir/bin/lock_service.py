@@ -0,0 +1,605 @@
+#!/usr/bin/env python
+
+"""
+Minimal TCP reader/writer lock service, and a Flock-compatible client for it.
+
+Locks are named, and granted in first-come, first-served order (consecutive
+readers share).  A lock is released when its client's connection closes, so
+crashed clients don't hold locks.  Holders with a lease must renew it, or
+the lock is released for them.  Messages are single lines of JSON.
+
+Depends on: python-2.7
+"""
+
+import sys
+import os
+import json
+import socket
+import select
+import logging
+import argparse
+import threading
+import SocketServer
+from itertools import count
+from time import time
+from errno import EAGAIN, EDEADLK, ENOLCK, EIO, ECONNRESET
+from contextlib import contextmanager
+from fcntl import LOCK_SH, LOCK_EX, LOCK_NB
+
+from flock import LeaseRenewer
+
+#: Maps error names from service responses to errno values
+ERRORS = {'deadlock': EDEADLK, 'lost': ENOLCK}
+
+
+class LockLost(KeyError):
+    """
+    Token does not hold a lock, it was released or it's lease expired.
+    """
+
+
+class LockTable(object):
+    """
+    Thread-safe table of named reader/writer locks, and their waiters.
+
+    Waiters are granted locks in arrival order, except that an upgrading
+    holder has priority.  Holders with a lease lose it when not renewed.
+    """
+
+    #: Maximum seconds between checks for expired leases, or cancellation
+    check_interval = 1.0
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        # Maps lock name to dictionary of holders, queue, and upgrading token
+        self.resources = {}
+        # Maps token to lock name
+        self.tokens = {}
+        self._ids = count(1)
+
+    def _resource(self, name):
+        return self.resources.setdefault(name, {'holders': {}, 'queue': [],
+                                                'upgrading': None})
+
+    def _purge(self, name, now):
+        # Release holders with expired leases
+        resource = self._resource(name)
+        for token, holder in resource['holders'].items():
+            if holder['expires'] is not None and holder['expires'] < now:
+                logging.warning("Lease of %s lock on %s by %s expired, releasing",
+                                holder['mode'], name, holder['owner'])
+                del resource['holders'][token]
+                del self.tokens[token]
+                self.cond.notify_all()
+
+    def _wait(self, name, deadline, cancelled):
+        # Wait for any change, return False if timed out or cancelled
+        now = time()
+        if deadline is not None and now >= deadline:
+            return False
+        if cancelled is not None and cancelled():
+            return False
+        expiries = [holder['expires']
+                    for holder in self._resource(name)['holders'].itervalues()
+                    if holder['expires'] is not None]
+        wait = min([self.check_interval] + [expires - now for expires in expiries] +
+                   ([deadline - now] if deadline is not None else []))
+        self.cond.wait(max(wait, 0.001))
+        self._purge(name, time())
+        return True
+
+    @staticmethod
+    def _grantable(resource, waiter):
+        if resource['upgrading'] is not None:
+            return False
+        modes = [holder['mode'] for holder in resource['holders'].itervalues()]
+        ahead = resource['queue'][:resource['queue'].index(waiter)]
+        if waiter['mode'] == 'write':
+            return not modes and not ahead
+        return 'write' not in modes and all(other['mode'] == 'read' for other in ahead)
+
+    def acquire(self, name, mode, timeout=None, lease=None, owner=None, cancelled=None):
+        """
+        Wait for lock, return token string if granted, None if not.
+
+        :param name: Name of lock
+        :param mode: 'read' or 'write'
+        :param timeout: Integer or float seconds to wait, None for no limit
+        :param lease: Integer or float seconds holder may go without renewing, or None
+        :param owner: Identifies holder for release_owner()
+        :param cancelled: Optional callable, returns True to abandon waiting
+        """
+        deadline = None if timeout is None else time() + timeout
+        with self.cond:
+            self._purge(name, time())
+            resource = self._resource(name)
+            waiter = {'id': next(self._ids), 'mode': mode}
+            resource['queue'].append(waiter)
+            try:
+                while not self._grantable(resource, waiter):
+                    if not self._wait(name, deadline, cancelled):
+                        return None
+                token = '%d' % waiter['id']
+                resource['holders'][token] = {'mode': mode, 'owner': owner, 'lease': lease,
+                                              'expires': time() + lease if lease else None}
+                self.tokens[token] = name
+                return token
+            finally:
+                resource['queue'].remove(waiter)
+                self._discard(name)
+                self.cond.notify_all()
+
+    def _discard(self, name):
+        # Forget lock name when unused
+        if not self.resources[name]['holders'] and not self.resources[name]['queue']:
+            del self.resources[name]
+
+    def _holder(self, token):
+        # Return (name, holder) for token, or raise LockLost if not held
+        name = self.tokens.get(token)
+        if name is None:
+            raise LockLost("Lock for token %s is not held" % token)
+        return name, self.resources[name]['holders'][token]
+
+    def upgrade(self, token, timeout=None, cancelled=None):
+        """
+        Convert read lock of token to write lock, return True if converted.
+
+        :raises IOError: EDEADLK when another holder is upgrading
+        :raises LockLost: When token doesn't hold a lock
+        """
+        deadline = None if timeout is None else time() + timeout
+        with self.cond:
+            name, holder = self._holder(token)
+            resource = self.resources[name]
+            if holder['mode'] == 'write':
+                return True
+            if resource['upgrading'] is not None:
+                raise IOError(EDEADLK, "Another holder is upgrading lock %s" % name)
+            resource['upgrading'] = token
+            try:
+                while resource['holders'].keys() != [token]:
+                    if holder['lease']:  # Demonstrably alive
+                        holder['expires'] = time() + holder['lease']
+                    if not self._wait(name, deadline, cancelled):
+                        return False
+                    self._holder(token)  # Lease could have expired
+                holder['mode'] = 'write'
+                return True
+            finally:
+                resource['upgrading'] = None
+                self.cond.notify_all()
+
+    def downgrade(self, token):
+        """
+        Convert write lock of token to read lock.
+
+        :raises LockLost: When token doesn't hold a lock
+        """
+        with self.cond:
+            self._holder(token)[1]['mode'] = 'read'
+            self.cond.notify_all()
+
+    def renew(self, token):
+        """
+        Extend lease of token's lock.
+
+        :raises LockLost: When token doesn't hold a lock
+        """
+        with self.cond:
+            holder = self._holder(token)[1]
+            if holder['lease']:
+                holder['expires'] = time() + holder['lease']
+
+    def release(self, token):
+        """
+        Release lock held by token, return True if it was held.
+        """
+        with self.cond:
+            name = self.tokens.pop(token, None)
+            if name is None:
+                return False
+            del self.resources[name]['holders'][token]
+            self._discard(name)
+            self.cond.notify_all()
+            return True
+
+    def release_owner(self, owner):
+        """
+        Release all locks held by owner, return number released.
+        """
+        with self.cond:
+            tokens = [token for token, name in self.tokens.iteritems()
+                      if self.resources[name]['holders'][token]['owner'] == owner]
+            for token in tokens:
+                self.release(token)
+            return len(tokens)
+
+    def status(self, name):
+        """
+        Return dictionary of holders list, and number of waiters for lock name.
+        """
+        with self.cond:
+            self._purge(name, time())
+            resource = self.resources.get(name, {'holders': {}, 'queue': []})
+            return {'holders': [{'mode': holder['mode'], 'owner': holder['owner'],
+                                 'lease': holder['lease']}
+                                for holder in resource['holders'].itervalues()],
+                    'waiting': len(resource['queue'])}
+
+
+class LockHandler(SocketServer.StreamRequestHandler):
+    """
+    Serves requests from one client connection, releasing its locks on close.
+    """
+
+    def _disconnected(self):
+        # Return True if client closed connection, while waiting for a lock
+        if not select.select([self.connection], [], [], 0)[0]:
+            return False
+        try:
+            return not self.connection.recv(1, socket.MSG_PEEK)
+        except socket.error:
+            return True
+
+    def dispatch(self, request):
+        """
+        Return response dictionary for request dictionary.
+        """
+        table = self.server.table
+        operation = request['op']
+        if operation == 'lock':
+            token = table.acquire(request['name'], request['mode'], request.get('timeout'),
+                                  request.get('lease'), self.client_address,
+                                  self._disconnected)
+            if token is None:
+                return {'ok': False, 'error': 'timeout'}
+            return {'ok': True, 'token': token}
+        elif operation == 'upgrade':
+            if not table.upgrade(request['token'], request.get('timeout'),
+                                 self._disconnected):
+                return {'ok': False, 'error': 'timeout'}
+        elif operation == 'downgrade':
+            table.downgrade(request['token'])
+        elif operation == 'renew':
+            table.renew(request['token'])
+        elif operation == 'unlock':
+            table.release(request['token'])
+        elif operation == 'status':
+            return dict(table.status(request['name']), ok=True)
+        else:
+            raise ValueError("Unknown operation %r" % operation)
+        return {'ok': True}
+
+    def handle(self):
+        try:
+            for line in iter(self.rfile.readline, ''):
+                logging.debug("Request from %s:%d: %s", self.client_address[0],
+                              self.client_address[1], line.strip())
+                try:
+                    response = self.dispatch(json.loads(line))
+                except LockLost:
+                    response = {'ok': False, 'error': 'lost'}
+                except IOError, xcept:
+                    if xcept.errno != EDEADLK:
+                        raise
+                    response = {'ok': False, 'error': 'deadlock'}
+                except (ValueError, TypeError, KeyError), xcept:
+                    response = {'ok': False, 'error': 'bad request: %s' % xcept}
+                self.wfile.write(json.dumps(response) + '\n')
+        except socket.error, xcept:
+            logging.debug("Connection from %s:%d failed: %s",
+                          self.client_address[0], self.client_address[1], xcept)
+        finally:
+            released = self.server.table.release_owner(self.client_address)
+            if released:
+                logging.info("Released %d lock(s) of closed connection from %s:%d",
+                             released, self.client_address[0], self.client_address[1])
+
+
+class LockServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    Threaded TCP lock service, one thread per client connection.
+
+    :param address: (host, port) tuple to listen on, port 0 picks a free one.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        SocketServer.TCPServer.__init__(self, address, LockHandler)
+        self.table = LockTable()
+
+
+def parse_address(address):
+    """
+    Return (host, port) tuple from 'host:port' string (or tuple).
+    """
+    if isinstance(address, basestring):
+        host, port = address.rsplit(':', 1)
+        return (host, int(port))
+    return tuple(address)
+
+
+class RemoteFlock(object):
+    """
+    A reader/writer lock object, held through a lock service instead of a file.
+
+    Presents the same locking API as Flock, lock() and lock_timeout() return a
+    token string instead of a file-like object.  The connection is kept open
+    between locks, and closed by close().
+
+    :param address: 'host:port' string or tuple of lock service
+    :param name: Name of lock, shared by all clients
+    :param lease: Optional seconds holder may go without renewing, None to disable.
+    """
+
+    #: Seconds allowed for service to respond, beyond any lock timeout
+    response_timeout = 30.0
+
+    #: This is set True whenever this object holds a read lock, None otherwise
+    is_read = None
+
+    def __init__(self, address, name, lease=None):
+        self.address = parse_address(address)
+        self.name = name
+        self.lease = lease
+        self._token = None
+        self._sock = None
+        self._rfile = None
+        self._renewer = None
+        self._io = threading.Lock()  # One request at a time, renewer runs in background
+
+    def __del__(self):
+        self.close()  # N/B: Exceptions are ignored!
+
+    def __str__(self):
+        if self.is_locked:
+            return "Locked (%s:%d/%s)" % (self.address + (self.name,))
+        return "Unlocked (%s:%d/%s)" % (self.address + (self.name,))
+
+    def __repr__(self):
+        return 'RemoteFlock(%s:%d, %s)' % (self.address + (self.name,))
+
+    def close(self):
+        """
+        Stop renewing, and close connection, releasing any lock held.
+        """
+        if self._renewer is not None:
+            self._renewer.stop()
+            self._renewer = None
+        self._token = None
+        self.is_read = None
+        if self._sock is not None:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = self._rfile = None
+
+    def _request(self, request, wait=None):
+        # Return response to request dictionary, waiting up to wait seconds
+        # beyond response_timeout.  Raises IOError on errors (except timeout).
+        with self._io:
+            if self._sock is None:
+                self._sock = socket.create_connection(self.address, self.response_timeout)
+                self._rfile = self._sock.makefile('rb')
+            self._sock.settimeout(None if wait is None else wait + self.response_timeout)
+            try:
+                self._sock.sendall(json.dumps(request) + '\n')
+                line = self._rfile.readline()
+            except socket.error:
+                self._sock.close()
+                self._sock = None
+                raise
+            if not line:
+                self._sock.close()
+                self._sock = None
+                raise IOError(ECONNRESET, "Lock service closed connection")
+        response = json.loads(line)
+        error = response.get('error')
+        if error is not None and error != 'timeout':
+            raise IOError(ERRORS.get(error, EIO), "Lock service error: %s" % error)
+        return response
+
+    def _renew(self):
+        # Lease heartbeat, returns False if the lease was lost
+        try:
+            self._request({'op': 'renew', 'token': self._token})
+        except IOError, xcept:
+            logging.error("Lease on %r lost: %s", self, xcept)
+            return False
+        return True
+
+    def _lock(self, timeout, op):
+        mode = 'read' if op & LOCK_SH else 'write'
+        if self._token is not None:  # Converting
+            if self.is_read and mode == 'write':
+                return self.upgrade(timeout)
+            elif not self.is_read and mode == 'read':
+                return self.downgrade()
+            return self._token
+        response = self._request({'op': 'lock', 'name': self.name, 'mode': mode,
+                                  'timeout': timeout, 'lease': self.lease}, timeout)
+        if not response['ok']:
+            return None
+        self._token = response['token']
+        self.is_read = mode == 'read'
+        if self.lease:
+            self._renewer = LeaseRenewer(self._renew, self.lease / 3.0)
+            self._renewer.start()
+        return self._token
+
+    def lock(self, op):
+        """
+        Execute locking operation.
+
+        :param op: Bitwise OR of LOCK_SH, LOCK_EX, LOCK_NB
+        :raises IOError: EAGAIN if LOCK_NB and lock is held by another client
+        :returns: Token string representing lock
+        """
+        if not op & LOCK_NB:
+            return self._lock(None, op)
+        token = self._lock(0, op)
+        if token is None:
+            raise IOError(EAGAIN, "Lock %s held by another client" % self.name)
+        return token
+
+    def lock_timeout(self, timeout, op):
+        """
+        Execute locking operation, return token when successful.
+
+        :param timeout: Integer or float, timeout in seconds to wait for operation.
+        :param op: Bitwise OR of fcntl.LOCK_SH, LOCK_EX, LOCK_NB.
+        :returns: Token string if lock was acquired, None if not.
+        """
+        return self._lock(float(timeout), op)
+
+    def upgrade(self, timeout=None):
+        """
+        Convert held read lock into a write lock, without another writer intervening.
+
+        :param timeout: Optional integer or float seconds to wait for other readers.
+        :raises ValueError: When no lock is held
+        :raises IOError: EDEADLK when another client is upgrading, read lock is retained.
+        :returns: Token string if converted, None on timeout (read lock retained).
+        """
+        if self._token is None:
+            raise ValueError("No lock held to upgrade on %r" % self)
+        if self.is_read:
+            if not self._request({'op': 'upgrade', 'token': self._token,
+                                  'timeout': timeout}, timeout)['ok']:
+                return None
+            self.is_read = False
+        return self._token
+
+    def downgrade(self):
+        """
+        Convert held write lock into a read lock, without another writer intervening.
+
+        :raises ValueError: When no lock is held
+        :returns: Token string representing lock
+        """
+        if self._token is None:
+            raise ValueError("No lock held to downgrade on %r" % self)
+        if not self.is_read:
+            self._request({'op': 'downgrade', 'token': self._token})
+            self.is_read = True
+        return self._token
+
+    def unlock(self):
+        """
+        Execute unlocking operation, may call more than once.
+
+        :returns: True if lock was held (and released) from current scope
+        """
+        if self._renewer is not None:
+            self._renewer.stop()
+            self._renewer = None
+        if self._token is None:
+            return False
+        token = self._token
+        self._token = None
+        self.is_read = None
+        try:
+            self._request({'op': 'unlock', 'token': token})
+        except (IOError, ValueError), xcept:
+            logging.debug("Closing connection, unlock failed: %s", xcept)
+            self.close()  # Service releases locks of closed connections
+        return True
+
+    @property
+    def is_locked(self):
+        """
+        Return True/False if any lock is currently held by this or another client.
+        """
+        if self.is_read is not None:
+            return True
+        return bool(self._request({'op': 'status', 'name': self.name})['holders'])
+
+    @contextmanager
+    def _acquire(self, timeout, op, name):
+        start = time()
+        token = self._lock(timeout, op)
+        if token is None:
+            logging.error("    %d timedout acquiring remote %s lock after %0.4fs",
+                          os.getpid(), name, time() - start)
+        else:
+            logging.debug("    %d acquired remote %s lock in %0.4fs",
+                          os.getpid(), name, time() - start)
+        try:
+            yield token
+        finally:
+            if token is not None:
+                self.unlock()
+                logging.debug("    %d remote %s lock released, held for %0.4fs",
+                              os.getpid(), name, time() - start)
+
+    def acquire_read(self):
+        """
+        Context manager wrapping a read-lock.
+
+        :returns: Token string
+        """
+        return self._acquire(None, LOCK_SH, "read")
+
+    def acquire_write(self):
+        """
+        Context manager wrapping a write-lock.
+
+        :returns: Token string
+        """
+        return self._acquire(None, LOCK_EX, "write")
+
+    def timeout_acquire_read(self, timeout):
+        """
+        Context manager wrapping a read-lock, within a timeout period.
+
+        :returns: Token string if successful, None if not.
+        """
+        return self._acquire(float(timeout), LOCK_SH, "read")
+
+    def timeout_acquire_write(self, timeout):
+        """
+        Context manager wrapping a write-lock, within a timeout period.
+
+        :returns: Token string if successful, None if not.
+        """
+        return self._acquire(float(timeout), LOCK_EX, "write")
+
+
+def parse_args(argv):
+    """
+    Return parsed command-line arguments
+    """
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listen', '-l', default='127.0.0.1:0', metavar='HOST:PORT',
+                        help='Address to listen on, port 0 picks a free port'
+                             ' (default 127.0.0.1:0).')
+    parser.add_argument('--debug', '-d', default=False, action='store_true',
+                        help='Log every request.')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    """
+    Serve locks until interrupted
+    """
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.DEBUG if args.debug else logging.INFO)
+    server = LockServer(parse_address(args.listen))
+    # Printed, so a wrapper can find a picked port
+    sys.stdout.write('%s:%d\n' % server.server_address)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1 @@
+adept_openstack.py
\ No newline at end of file
@@ -13,6 +13,9 @@ Dependencies:
 import sys
 import os
 import os.path
+import json
+import shutil
+from tempfile import mkdtemp
 from collections import namedtuple
 from itertools import cycle, product
 from binascii import crc32
@@ -500,6 +503,29 @@ class TestNonClasses(TestCaseBase):
             self.assertEqual(self.uut.ActionBase.sub_env(test_env, test_str),
                              expected)
 
+    def test_record_timing(self):
+        "Verify timing records are appended to workspace file"
+        tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        params = Mock(workspace=tmpdir, context='setup')
+        setattr(params, self.uut.XTN, os.path.join(tmpdir, 'foo.xn'))
+        item = Mock(spec=self.uut.Variable, index=3)
+        item.__class__ = self.uut.Variable
+        for exit_code in (0, 1):
+            self.assertTrue(self.uut.record_timing(params, item, 10, 12.5,
+                                                   exit_code))
+        with open(os.path.join(tmpdir,
+                               self.uut.TIMING_FILENAME), 'rb') as timing:
+            records = [json.loads(line) for line in timing]
+        self.assertEqual([record['exit'] for record in records], [0, 1])
+        self.assertEqual(records[0][self.uut.XTN], '$WORKSPACE/foo.xn')
+        self.assertEqual(records[0]['node'], 'variable')
+        self.assertEqual(records[0]['index'], 3)
+        self.assertEqual(records[0]['elapsed'], 2.5)
+        self.assertEqual(records[0]['run'], self.uut.RUN_ID)
+        params.workspace = os.path.join(tmpdir, 'missing')
+        self.assertFalse(self.uut.record_timing(params, item, 10, 12.5, 0))
+
 
 class TestParameters(TestCaseBase):
     "Tests that verify Parameters class instance API"
@@ -706,6 +732,8 @@ class TestActionBaseBase(TestCaseBase):
         patchers = (patch('%s.subprocess.Popen' % self.UUT, autospec=Popen,
                           return_value=self.mocks['sub_proc']),
                     patch('%s.Parameters' % self.UUT),
+                    # Progress file writing is tested elsewhere
+                    patch('%s.Progress' % self.UUT),
                     patch(where % 'parameters_source', mock_source),
                     patch('%s.ActionBase.init' % self.UUT, autospec=True),
                     patch('%s.ActionBase.action' % self.UUT, autospec=True),
@@ -831,6 +859,11 @@ class TestCommand(TestActionBaseBase):
             self.assertTrue(test_cmd.stdoutfile is None)
             self.assertTrue(test_cmd.stderrfile is not None)
             self.assertEqual(test_cmd.exitfile, None)
+            # Inherited, unless capture requested
+            self.assertNotIn('stdout', test_cmd.popen_dargs)
+            test_cmd = self.uut.Command(42, filepath='/dev/null', capture=True)
+            from subprocess import PIPE
+            self.assertEqual(test_cmd.popen_dargs['stdout'], PIPE)
 
     def test_init_stdfiles(self):
         "Verify method behaves as documented"
@@ -982,6 +1015,64 @@ class TestCommand(TestActionBaseBase):
             exitfile.assert_called_once_with('/some/exit/file', 'wb')
             exitfile().write.assert_called_once_with('42')
 
+    def test_swirly_hangup(self):
+        "Verify output is relayed until closed, while child keeps running"
+        from subprocess import Popen, PIPE
+        child = Popen(['/bin/sh', '-c', 'echo foo; exec >&-; sleep 0.5'],
+                      stdout=PIPE)
+        progress = Mock()
+        with patch('%s.sys.stdout' % self.UUT) as stdout:
+            self.assertEqual(self.uut.Command.swirly.im_func(Mock(), child,
+                                                             progress), 0)
+        stdout.write.assert_called_once_with('foo\n')
+        progress.output.assert_called_once_with('foo\n')
+        self.assertTrue(progress.beat.called)
+
+    def test_is_up_to_date(self):
+        "Verify freshness determination from creates and sources"
+        tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        older, newer, missing = [os.path.join(tmpdir, name)
+                                 for name in ('older', 'newer', 'missing')]
+        for path, mtime in ((older, 1000), (newer, 2000)):
+            open(path, 'wb').close()
+            os.utime(path, (mtime, mtime))
+        is_up_to_date = self.uut.Command.is_up_to_date
+        self.assertFalse(is_up_to_date([], [older]))
+        self.assertTrue(is_up_to_date([newer], []))
+        self.assertTrue(is_up_to_date([newer], [older, newer]))
+        self.assertFalse(is_up_to_date([older, newer], [newer]))
+        self.assertFalse(is_up_to_date([missing], []))
+        self.assertFalse(is_up_to_date([newer], [missing]))
+
+    def test_action_up_to_date(self):
+        "Verify up-to-date item is skipped without executing or truncating"
+        tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        open(os.path.join(tmpdir, 'source'), 'wb').close()
+        os.utime(os.path.join(tmpdir, 'source'), (1000, 1000))
+        open(os.path.join(tmpdir, 'output'), 'wb').close()
+        self.patchers.append(patch('%s.open' % self.UUT,
+                                   mock_open(), create=True))
+        self.patchers.append(patch('%s.ActionBase.global_vars' % self.UUT,
+                                   {'OUTPUT': 'output'}))
+        self.start_patchers()
+        mock_parameters = self.mocks['Parameters']()
+        mock_parameters.workspace = tmpdir
+        mock_parameters.verifyfile.side_effect = lambda mock_self, x: str(x)
+        test_cmd = self.uut.Command(42, filepath='/path/to/file',
+                                    stdoutfile='/some/output/file',
+                                    exitfile='/some/exit/file',
+                                    creates='$OUTPUT', sources=['source'])
+        self.assertTrue(test_cmd.up_to_date)
+        self.assertEqual(test_cmd.creates, [os.path.join(tmpdir, 'output')])
+        # Only the exit file was opened
+        self.mocks['open'].assert_called_once_with('/some/exit/file', 'wb')
+        with patch('%s.sys.stderr' % self.UUT):
+            self.assertEqual(test_cmd(), 0)
+        self.assertFalse(self.mocks['Popen'].called)
+        self.mocks['open']().write.assert_called_once_with('0')
+
 
 class TestPlaybook(TestActionBaseBase):
 
@@ -1206,5 +1297,87 @@ class TestVariable(TestCaseBase):
             self.assertEqual(test_var.global_vars.get('bar'), 'baz')
 
 
+class TestProgress(TestCaseBase):
+
+    """Exercize Progress class"""
+
+    def setUp(self):
+        super(TestProgress, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, self.uut.PROGRESS_FILENAME)
+        self.progress = self.uut.Progress(self.filepath, 42, 'foo.xn',
+                                          'setup', 1234)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestProgress, self).tearDown()
+
+    def load(self):
+        """Return decoded contents of progress file"""
+        with open(self.filepath, 'rb') as progress_file:
+            return json.load(progress_file)
+
+    def test_beat(self):
+        """Verify progress file contents and rate-limiting"""
+        self.assertTrue(self.progress.beat())
+        self.assertFalse(self.progress.beat())  # interval not passed
+        content = self.load()
+        self.assertEqual(content['index'], 42)
+        self.assertEqual(content['pid'], 1234)
+        self.assertEqual(content['context'], 'setup')
+        self.assertEqual(content[self.uut.XTN], 'foo.xn')
+        self.assertEqual(content['output_bytes'], 0)
+        self.assertIsNone(content['exit'])
+        # Only the final file remains, no temporary files
+        self.assertEqual(os.listdir(self.tmpdir), [self.uut.PROGRESS_FILENAME])
+
+    def test_output_finish(self):
+        """Verify output accounting and forced final update"""
+        self.assertTrue(self.progress.beat())
+        self.progress.output('foo')
+        self.progress.output('bar\n')
+        self.assertTrue(self.progress.finish(42))
+        content = self.load()
+        self.assertEqual(content['output_bytes'], 7)
+        self.assertEqual(content['exit'], 42)
+        self.assertGreaterEqual(content['elapsed'], content['idle'])
+
+    def test_watch(self):
+        """Verify idle is only reported for observable output, including files"""
+        self.assertTrue(self.progress.beat())
+        self.assertIsNone(self.load()['idle'])
+        with open(os.path.join(self.tmpdir, 'output'), 'wb') as output_file:
+            self.progress.watch(output_file)
+            output_file.write('foobar')
+            output_file.flush()
+            self.assertTrue(self.progress.finish(0))
+        content = self.load()
+        self.assertEqual(content['output_bytes'], 6)
+        self.assertIsNotNone(content['idle'])
+
+    def test_unwritable(self):
+        """Verify failure to write progress file is not fatal"""
+        self.progress.filepath = os.path.join(self.tmpdir, 'missing', 'dir')
+        self.assertFalse(self.progress.beat(force=True))
+
+
+
+class TestBenchmark(TestCaseBase):
+
+    """Exercize adept benchmark script"""
+
+    def test_cli(self):
+        """Verify only results JSON is written to stdout"""
+        from subprocess import check_output
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'benchmarks', 'bench_adept.py')
+        with open(os.devnull, 'wb') as devnull:
+            output = check_output([sys.executable, script, '--scale', '0.0001',
+                                   '--repeat', '1'], stderr=devnull)
+        result = json.loads(output)
+        self.assertEqual(result['results']['main_output']['repeat'], 1)
+        self.assertIn('swirly', result['results'])
+
+
 if __name__ == '__main__':
     unittest.main(failfast=True, catchbreak=True, verbosity=2)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""
+Unittests for adept_analyze module
+
+Dependencies:
+    - python-2.7
+    - python-unittest2
+    - python-mock
+    - pylint
+    - test_adept
+"""
+
+import os
+import os.path
+import json
+import shutil
+from tempfile import mkdtemp
+from StringIO import StringIO
+import unittest2 as unittest
+import test_adept
+
+
+class TestCaseBase(test_adept.TestCaseBase):
+    """Reuses essental/basic unittest plumbing from adepts unittests"""
+
+    UUT = 'adept_analyze'
+
+    def setUp(self):
+        super(TestCaseBase, self).setUp()
+        self.uut = __import__(self.UUT)
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestCaseBase, self).tearDown()
+
+    def write_records(self, workspace, *records):
+        """Append records to timing file in workspace under self.tmpdir"""
+        dirpath = os.path.join(self.tmpdir, workspace)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        with open(os.path.join(dirpath, self.uut.TIMING_FILENAME),
+                  'ab') as timing_file:
+            for record in records:
+                timing_file.write(json.dumps(record) + '\n')
+
+    @staticmethod
+    def record(index, start, elapsed, **dargs):
+        """Return a timing record dictionary"""
+        result = {'xn': 'foo.xn', 'index': index, 'node': 'command',
+                  'context': 'run', 'run': 'one', 'item': 'h:1:%d' % index,
+                  'parent': None, 'start': start, 'end': start + elapsed,
+                  'elapsed': elapsed, 'exit': 0}
+        result.update(dargs)
+        return result
+
+
+class TestPylint(test_adept.TestPylint):
+    """Reuses essental pylint-plumbing from adepts unittests, for this module"""
+
+    UUT = TestCaseBase.UUT
+
+    def test_unittest_pylint(self):
+        "Run pylint on the unittest module itself"
+        self._pylintrun(__file__)
+
+    def test_uut_pylint(self):
+        "Run pylint on the unit under test"
+        self._pylintrun(self.uut.__file__)
+
+
+class TestHistogram(TestCaseBase):
+
+    """Exercize Histogram class"""
+
+    def test_percentile(self):
+        """Verify percentiles are within one bucket of actual values"""
+        hist = self.uut.Histogram()
+        self.assertIsNone(hist.percentile(50))
+        for value in xrange(1, 101):
+            hist.add(value / 10.0)
+        self.assertEqual(hist.count, 100)
+        self.assertAlmostEqual(hist.total, 505.0)
+        for pct in (1, 50, 90, 99):
+            actual = pct / 10.0
+            self.assertGreaterEqual(hist.percentile(pct), actual)
+            self.assertLessEqual(hist.percentile(pct), actual * hist.ratio)
+        self.assertEqual(hist.percentile(100), 10.0)
+
+    def test_tiny(self):
+        """Verify values below floor are counted"""
+        hist = self.uut.Histogram()
+        hist.add(0)
+        self.assertEqual(hist.percentile(50), 0)
+
+
+class TestCriticalPath(TestCaseBase):
+
+    """Exercize critical_path function"""
+
+    def test_concurrent(self):
+        """Verify longest chain of sequential items is found"""
+        first = self.record(1, 0, 10)
+        short = self.record(2, 10, 1)
+        long_ = self.record(3, 10, 5)  # concurrent with short
+        last = self.record(4, 15, 2)
+        instant = self.record(5, 17, 0)
+        path = self.uut.critical_path([last, short, first, long_, instant])
+        self.assertEqual([record['index'] for record in path], [1, 3, 4, 5])
+        self.assertEqual(self.uut.critical_path([]), [])
+
+    def test_nested(self):
+        """Verify items with nested items are replaced by them"""
+        parent = self.record(1, 0, 10)
+        children = [self.record(2, 1, 4, item='h:2:1', parent='h:1:1'),
+                    self.record(3, 6, 3, item='h:2:2', parent='h:1:1')]
+        path = self.uut.critical_path([parent] + children)
+        self.assertEqual(path, children)
+
+
+class TestMain(TestCaseBase):
+
+    """Exercize reporting from main function"""
+
+    def main(self, *args):
+        """Return exit code and output of main() with args"""
+        stdout = StringIO()
+        stderr = StringIO()
+        exit_code = self.uut.main(['adept_analyze.py', '--now', '%d' % (100 * 86400),
+                                   '--min-samples', '2'] + list(args) +
+                                  [self.tmpdir], stdout, stderr)
+        return exit_code, stdout.getvalue(), stderr.getvalue()
+
+    def test_regression(self):
+        """Verify regressions flagged across many workspaces"""
+        day = 86400
+        for number in xrange(5):
+            # Baseline window
+            self.write_records('old%d' % number,
+                               self.record(1, 80 * day + number, 1.0, run='old'),
+                               self.record(2, 80 * day + number, 1.0, run='old'))
+            # Recent window, only item 2 is slower
+            self.write_records('new%d' % number,
+                               self.record(1, 97 * day + number, 1.0),
+                               self.record(2, 97 * day + number, 2.0))
+        exit_code, stdout, stderr = self.main()
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(stderr, '')
+        self.assertIn('REGRESSION foo.xn #2 (command)', stdout)
+        self.assertNotIn('REGRESSION foo.xn #1 (command)', stdout)
+        self.assertIn('Critical path of run one', stdout)
+
+    def test_malformed(self):
+        """Verify malformed records are skipped and no regression found"""
+        self.write_records('ws', self.record(1, 0, 1.0))
+        with open(os.path.join(self.tmpdir, 'ws', self.uut.TIMING_FILENAME),
+                  'ab') as timing_file:
+            timing_file.write('{"truncated": \n')
+        exit_code, stdout, stderr = self.main('--no-critical-path')
+        self.assertEqual(exit_code, 0)
+        self.assertIn('Skipped malformed record', stderr)
+        self.assertIn('foo.xn #1 (command): n=1', stdout)
+        self.assertNotIn('Critical path', stdout)
+
+    def test_skipped(self):
+        """Verify unreadable files are skipped, and skipped records are bounded"""
+        self.write_records('ws', self.record(1, 0, 1.0))
+        with open(os.path.join(self.tmpdir, 'ws', self.uut.TIMING_FILENAME),
+                  'ab') as timing_file:
+            timing_file.write('garbage\n' * 25)
+        exit_code, stdout, stderr = self.main(os.path.join(self.tmpdir, 'missing'))
+        self.assertEqual(exit_code, 0)
+        self.assertIn('Skipped unreadable file %s' % os.path.join(self.tmpdir, 'missing'),
+                      stderr)
+        self.assertEqual(stderr.count('Skipped malformed record'), 10)
+        self.assertIn('Skipped 15 more malformed records', stderr)
+        self.assertIn('foo.xn #1 (command): n=1', stdout)
+        self.assertIn('Critical path', stdout)
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True, catchbreak=True, verbosity=2)
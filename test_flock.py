@@ -13,6 +13,16 @@ Dependencies:
 """
 
 import sys
+import os
+import os.path
+import json
+import shutil
+import subprocess
+import signal
+import threading
+from time import sleep, time
+from tempfile import mkdtemp
+from fcntl import LOCK_SH, LOCK_EX, LOCK_NB
 import unittest2 as unittest
 # ref: http://www.voidspace.org.uk/python/mock/index.html
 #from mock import Mock
@@ -57,7 +67,569 @@ class TestPylint(test_adept.TestPylint):
         "Run pylint on the unit under test"
         self._pylintrun(self.uut.__file__)
 
-# TODO: Actually write some tests
+
+class TestLockfileBase(TestCaseBase):
+    """Temporary lock file path, and threads holding it"""
+
+    def setUp(self):
+        super(TestLockfileBase, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.lockpath = os.path.join(self.tmpdir, 'test.lock')
+        self.threads = []
+
+    def tearDown(self):
+        # Module is unloaded by super-class
+        for thread in self.threads:
+            thread.join()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestLockfileBase, self).tearDown()
+
+    def hold(self, seconds, op=LOCK_EX):
+        """Return started thread holding lock for seconds, and release times"""
+        holder = self.uut.Flock(self.lockpath)
+        holder.lock(op)
+        released = []
+
+        def _release():
+            sleep(seconds)
+            released.append(time())
+            holder.unlock()
+        thread = threading.Thread(target=_release)
+        thread.start()
+        self.threads.append(thread)
+        return released
+
+
+class TestFlock(TestLockfileBase):
+    """Exercize Flock waiting and state"""
+
+    def check_handoff(self):
+        """Assert waiting for a released lock happens promptly"""
+        released = self.hold(0.2)
+        flock = self.uut.Flock(self.lockpath)
+        self.assertTrue(flock.lock_timeout(5, LOCK_EX))
+        self.assertLess(time() - released[0], 0.1)
+        flock.unlock()
+        # Timing out
+        self.hold(0.5)
+        start = time()
+        self.assertIsNone(flock.lock_timeout(0.1, LOCK_SH))
+        self.assertGreaterEqual(time() - start, 0.1)
+        self.assertLess(time() - start, 0.4)
+        self.assertTrue(flock.is_locked)  # By the other holder
+
+    def test_handoff_alarm(self):
+        """Verify blocking lock, interrupted by alarm, in main thread"""
+        self.check_handoff()
+        self.assertEqual(signal.getsignal(signal.SIGALRM), signal.SIG_DFL)
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+    def test_handoff_thread(self):
+        """Verify polling lock outside of main thread"""
+        failures = []
+
+        def _check():
+            try:
+                self.check_handoff()
+            except AssertionError, xcept:
+                failures.append(xcept)
+        thread = threading.Thread(target=_check)
+        thread.start()
+        thread.join(10)
+        self.assertEqual(failures, [])
+
+    def test_is_locked(self):
+        """Verify locked state from this and another lock file object"""
+        for proc_locks in (self.uut.Flock.proc_locks,
+                           os.path.join(self.tmpdir, 'missing')):
+            first = self.uut.Flock(self.lockpath)
+            first.proc_locks = proc_locks
+            second = self.uut.Flock(self.lockpath)
+            self.assertFalse(first.is_locked)
+            second.lock(LOCK_SH)
+            self.assertTrue(second.is_locked)
+            self.assertTrue(first.is_locked)
+            if proc_locks == self.uut.Flock.proc_locks:
+                self.assertEqual(first.kernel_locks(),
+                                 [(os.getpid(), 'read', False)])
+            second.unlock()
+            self.assertFalse(first.is_locked)
+
+    def test_is_locked_remote(self):
+        """Verify holders missing from the kernel table (e.g. NFS) are found"""
+        first = self.uut.Flock(self.lockpath)
+        second = self.uut.Flock(self.lockpath)
+        second.lock(LOCK_EX)
+        first.kernel_locks = lambda: []  # Holder is on another host
+        self.assertTrue(first.is_locked)
+        second.unlock()
+
+
+class TestInspect(TestCaseBase):
+    """Exercize holder records, statistics and inspection"""
+
+    def setUp(self):
+        super(TestInspect, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.lockpath = os.path.join(self.tmpdir, 'test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestInspect, self).tearDown()
+
+    def test_histogram(self):
+        """Verify power-of-two millisecond buckets and summary"""
+        histogram = {}
+        for seconds in (0, 0.001, 0.003, 0.1, 5):
+            self.uut.histogram_add(histogram, seconds)
+        self.assertEqual(histogram, {'1': 2, '4': 1, '128': 1, '8192': 1})
+        summary = self.uut.histogram_summary(histogram)
+        self.assertEqual(summary, {'count': 5, 'p50': 0.004,
+                                   'p99': 8.192, 'max': 8.192})
+        self.assertIsNone(self.uut.histogram_summary({})['p50'])
+
+    def test_holders(self):
+        """Verify holders are recorded and removed, with statistics"""
+        self.assertRaises(IOError, self.uut.inspect, self.lockpath)
+        flock = self.uut.Flock(self.lockpath)
+        with flock.acquire_write():
+            # Not recorded by default
+            self.assertEqual(self.uut.inspect(self.lockpath)['holders'], [])
+        flock.record_holders = True
+        with flock.acquire_write():
+            info = self.uut.inspect(self.lockpath)
+            self.assertEqual(len(info['holders']), 1)
+            holder = info['holders'][0]
+            self.assertEqual((holder['pid'], holder['op'], holder['alive']),
+                             (os.getpid(), 'write', True))
+            self.assertEqual(info['kernel'], [{'pid': os.getpid(), 'op': 'write',
+                                               'waiting': False}])
+            self.assertIn('holds write lock', self.uut.format_inspection(info))
+        info = self.uut.inspect(self.lockpath)
+        self.assertEqual(info['holders'], [])
+        self.assertEqual(info['wait']['count'], 1)
+        self.assertEqual(info['hold']['count'], 1)
+        self.assertIn('Hold times: count 1', self.uut.format_inspection(info))
+
+    def test_cli(self):
+        """Verify --inspect option outputs JSON"""
+        fairflock = self.uut.FairFlock(self.lockpath)
+        fairflock.record_holders = True
+        fairflock.lock(LOCK_SH)
+        output = subprocess.check_output([sys.executable, self.uut.__file__.replace('.pyc', '.py'),
+                                          '--inspect', self.lockpath, '--json'])
+        fairflock.unlock()
+        info = json.loads(output)
+        self.assertEqual(info['holders'][0]['op'], 'read')
+        self.assertEqual(info['queue'][0]['op'], 'read')
+
+
+class TestBenchmark(TestCaseBase):
+    """Exercize lock benchmark and its statistics"""
+
+    def test_percentiles(self):
+        """Verify exact percentiles"""
+        self.assertEqual(self.uut.percentiles(xrange(100, 0, -1)),
+                         {'count': 100, 'p50': 50, 'p99': 99, 'max': 100})
+        self.assertIsNone(self.uut.percentiles([])['max'])
+
+    def test_cli(self):
+        """Verify benchmark runs and reports JSON"""
+        output = subprocess.check_output([sys.executable, self.uut.__file__.replace('.pyc', '.py'),
+                                          '--processes', '3', '--iterations', '4',
+                                          '--write-ratio', '1', '--think', '0', '--seed', '1'])
+        result = json.loads(output)
+        self.assertEqual(result['acquisitions'], 12)
+        self.assertEqual(result['latency']['write']['count'], 12)
+        self.assertEqual(result['latency']['read']['count'], 0)
+        self.assertEqual(result['fairness']['min_worker_acquisitions'], 4)
+        self.assertEqual((result['starved'], result['timeouts']), (0, 0))
+        self.assertGreater(result['throughput'], 0)
+
+
+class TestPendingLock(TestLockfileBase):
+    """Exercize background acquisition for event loops"""
+
+    def test_handoff(self):
+        """Verify waiting without blocking, and release on exit"""
+        self.hold(0.2)
+        with self.uut.Flock(self.lockpath).acquire_write_async(5) as pending:
+            self.assertFalse(pending.done())
+            self.assertEqual(self.uut.wait_pending([pending], 0.01), [])
+            self.assertEqual(self.uut.wait_pending([pending], 5), [pending])
+            self.assertEqual(pending.result().name, self.lockpath)
+            self.assertTrue(pending.lock.is_locked)
+        self.assertIsNone(pending.lock.is_read)
+        self.assertTrue(self.uut.Flock(self.lockpath).lock_timeout(0, LOCK_EX))
+
+    def test_timeout(self):
+        """Verify result is None after timeout"""
+        self.hold(0.5)
+        with self.assertLogs(level='ERROR'):
+            with self.uut.Flock(self.lockpath).acquire_read_async(0.1) as pending:
+                self.assertIsNone(pending.result(5))
+                self.assertTrue(pending.done())
+
+    def test_cancel(self):
+        """Verify exiting abandons waiting promptly, with many waits at once"""
+        self.hold(1)
+        other = os.path.join(self.tmpdir, 'other.lock')
+        pending = [self.uut.Flock(self.lockpath).acquire_read_async(),
+                   self.uut.FairFlock(self.lockpath).acquire_write_async(),
+                   self.uut.Flock(other).acquire_write_async()]
+        self.assertEqual(self.uut.wait_pending(pending, 5), pending[-1:])
+        start = time()
+        for item in pending:
+            item.release()
+            item.release()
+        self.assertLess(time() - start, 0.5)
+        self.assertFalse(any(item.lock.is_read for item in pending))
+
+
+class TestLease(TestCaseBase):
+    """Exercize lease renewal and breaking stale locks"""
+
+    def setUp(self):
+        super(TestLease, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.lockpath = os.path.join(self.tmpdir, 'test.lock')
+        self.flocks = []
+
+    def tearDown(self):
+        # Module is unloaded by super-class, stop any renewer threads first
+        for flock in self.flocks:
+            flock.unlock()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestLease, self).tearDown()
+
+    def flock(self, lease=None):
+        """Return new Flock on lockpath, checking for stale holders frequently"""
+        flock = self.uut.Flock(self.lockpath, lease)
+        flock.stale_interval = 0.01
+        self.flocks.append(flock)
+        return flock
+
+    def holder(self):
+        """Return holder record from the sidecar file"""
+        return self.uut.inspect(self.lockpath)['holders'][0]
+
+    def test_renew(self):
+        """Verify a renewed lease is not broken"""
+        holder = self.flock(0.2)
+        holder.lock(LOCK_EX)
+        acquired = self.holder()['renewed']
+        self.assertIsNone(self.flock().lock_timeout(0.5, LOCK_EX))
+        self.assertGreater(self.holder()['renewed'], acquired)
+        self.assertFalse(self.holder()['expired'])
+        holder.unlock()
+        self.assertIsNone(holder._renewer)
+
+    def test_break_expired(self):
+        """Verify a hung holder's lock is broken once it's lease expires"""
+        holder = self.flock(0.1)
+        holder.lock(LOCK_EX)
+        holder._renewer.stop()  # Hung
+        waiter = self.flock()
+        waiter.record_holders = True
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertTrue(waiter.lock_timeout(5, LOCK_EX))
+        self.assertIn('lease expired', logs.output[0])
+        self.assertEqual(self.holder()['pid'], os.getpid())
+        self.assertFalse(holder._is_current())
+        self.assertTrue(waiter._is_current())
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(holder._renew())
+
+    def test_no_lease(self):
+        """Verify live holders without a lease are never broken"""
+        holder = self.flock()
+        holder.lock(LOCK_SH)
+        self.assertFalse(self.flock().break_stale())
+        self.assertTrue(holder._is_current())
+
+    def test_replaced(self):
+        """Verify locking a removed lock file, locks it's replacement"""
+        flock = self.flock()
+        flock._lockfile = open(self.lockpath, 'wb', 0)
+        os.unlink(self.lockpath)
+        flock.lock(LOCK_EX)
+        self.assertTrue(os.path.isfile(self.lockpath))
+        self.assertTrue(flock._is_current())
+
+
+class TestUpgrade(TestCaseBase):
+    """Exercize converting held locks with upgrade() and downgrade()"""
+
+    def setUp(self):
+        super(TestUpgrade, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.lockpath = os.path.join(self.tmpdir, 'test.lock')
+        self.threads = []
+
+    def tearDown(self):
+        # Module is unloaded by super-class
+        for thread in self.threads:
+            thread.join()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestUpgrade, self).tearDown()
+
+    def start(self, target):
+        """Return started thread calling target, and list of its return value"""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(target()))
+        thread.start()
+        self.threads.append(thread)
+        return result
+
+    def kernel_ops(self):
+        """Return sorted list of granted lock modes from kernel"""
+        return sorted(mode for _, mode, waiting
+                      in self.uut.Flock(self.lockpath).kernel_locks() if not waiting)
+
+    def test_convert(self):
+        """Verify upgrade waits for other readers, and downgrade admits them"""
+        self.assertRaises(ValueError, self.uut.Flock(self.lockpath).upgrade)
+        reader = self.uut.Flock(self.lockpath)
+        reader.lock(LOCK_SH)
+        other = self.uut.Flock(self.lockpath)
+        other.lock(LOCK_SH)
+        self.assertIsNone(reader.upgrade(0.1))
+        self.assertTrue(reader.is_read)
+        self.assertEqual(self.kernel_ops(), ['read', 'read'])
+        self.start(lambda: sleep(0.1) or other.unlock())
+        self.assertTrue(reader.upgrade(5))
+        self.assertFalse(reader.is_read)
+        self.assertEqual(self.kernel_ops(), ['write'])
+        reader.downgrade()
+        self.assertTrue(self.uut.Flock(self.lockpath).lock_timeout(0, LOCK_SH))
+        reader.unlock()
+
+    def test_deadlock(self):
+        """Verify upgrading fails while another reader upgrades, or writer waits"""
+        first = self.uut.Flock(self.lockpath)
+        first.lock(LOCK_SH)
+        second = self.uut.Flock(self.lockpath)
+        second.lock(LOCK_SH)
+        upgraded = self.start(lambda: first.upgrade(5))
+        sleep(0.1)
+        with self.assertRaises(IOError) as caught:
+            second.upgrade(5)
+        self.assertEqual(caught.exception.errno, self.uut.EDEADLK)
+        self.assertTrue(second.is_read)
+        second.unlock()
+        self.threads.pop().join()
+        self.assertTrue(upgraded[0])
+        # Writer waits on read lock, while holding the upgrade gate
+        first.downgrade()
+        writer = self.uut.Flock(self.lockpath)
+        written = self.start(lambda: writer.lock(LOCK_EX))
+        sleep(0.1)
+        self.assertRaises(IOError, first.upgrade, 5)
+        self.assertEqual(self.kernel_ops(), ['read'])
+        first.unlock()
+        self.threads.pop().join()
+        self.assertTrue(written[0])
+        writer.unlock()
+
+
+class TestFlockStore(TestCaseBase):
+    """Exercize memory-mapped record store"""
+
+    def setUp(self):
+        super(TestFlockStore, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.lockpath = os.path.join(self.tmpdir, 'test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestFlockStore, self).tearDown()
+
+    def items(self):
+        """Return items read through separate lock and store instances"""
+        flock = self.uut.Flock(self.lockpath)
+        store = self.uut.FlockStore(flock)
+        with flock.acquire_read():
+            result = store.items()
+        store.close()
+        return result
+
+    def test_store(self):
+        """Verify records are shared, and locks are required"""
+        flock = self.uut.Flock(self.lockpath)
+        store = self.uut.FlockStore(flock, slots=2, slot_size=32)
+        self.assertRaises(ValueError, store.get, 'foo')
+        with flock.acquire_read():
+            self.assertIsNone(store.get('foo'))
+            self.assertEqual(store.generation, 0)
+            self.assertRaises(ValueError, store.set, 'foo', 'bar')
+        with flock.acquire_write():
+            store.set('foo', {'bar': 1})
+            store.set('baz', [1, 2])
+            self.assertRaises(ValueError, store.set, 'full', None)
+            store.set('foo', 'replaced')
+            self.assertRaises(ValueError, store.set, 'foo', 'x' * 32)
+            self.assertEqual(store.generation, 4)
+        self.assertEqual(self.items(), {'foo': 'replaced', 'baz': [1, 2]})
+        with flock.acquire_write():
+            self.assertTrue(store.delete('baz'))
+            self.assertFalse(store.delete('baz'))
+            store.set('full', None)
+        store.close()
+        self.assertEqual(self.items(), {'foo': 'replaced', 'full': None})
+
+    def test_corrupt(self):
+        """Verify torn slots and unknown versions read as missing"""
+        flock = self.uut.Flock(self.lockpath)
+        store = self.uut.FlockStore(flock)
+        with flock.acquire_write():
+            store.set('foo', 'bar')
+            store.set('baz', 'bar')
+        store.close()
+        header_size = self.uut.FlockStore.header.size
+        with open(store.path, 'r+b') as store_file:
+            store_file.seek(header_size + self.uut.FlockStore.slot_header.size)
+            store_file.write('X')
+        self.assertEqual(self.items(), {'baz': 'bar'})
+        with open(store.path, 'r+b') as store_file:
+            store_file.write('X' * 8)
+        self.assertEqual(self.items(), {})
+        with flock.acquire_write():
+            store.set('foo', 'bar')
+            self.assertEqual(store.generation, 2)  # Initialized, then set
+        store.close()
+        self.assertEqual(self.items(), {'foo': 'bar'})
+
+
+class TestFairFlock(TestCaseBase):
+    """Exercize FIFO ordering of FairFlock"""
+
+    def setUp(self):
+        super(TestFairFlock, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.lockpath = os.path.join(self.tmpdir, 'test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestFairFlock, self).tearDown()
+
+    def queued(self):
+        """Return list of entries currently in the queue"""
+        with self.uut.FairFlock(self.lockpath)._queue() as state:
+            return list(state[1])
+
+    def test_read_batching(self):
+        """Verify readers share the lock, and queue is emptied on unlock"""
+        first = self.uut.FairFlock(self.lockpath)
+        second = self.uut.FairFlock(self.lockpath)
+        self.assertTrue(first.lock_timeout(1, LOCK_SH))
+        self.assertTrue(second.lock_timeout(1, LOCK_SH))
+        self.assertEqual(len(self.queued()), 2)
+        writer = self.uut.FairFlock(self.lockpath)
+        self.assertIsNone(writer.lock_timeout(0.01, LOCK_EX))
+        self.assertRaises(IOError, writer.lock, LOCK_EX | LOCK_NB)
+        self.assertTrue(first.unlock())
+        self.assertTrue(second.unlock())
+        self.assertEqual(self.queued(), [])
+
+    def test_queued_writer(self):
+        """Verify a queued writer holds back readers arriving after it"""
+        writer = self.uut.FairFlock(self.lockpath)
+        ticket = writer._enqueue(LOCK_EX)
+        reader = self.uut.FairFlock(self.lockpath)
+        # Plain Flock would grant this immediatly, lock file is not held
+        self.assertIsNone(reader.lock_timeout(0.01, LOCK_SH))
+        writer._dequeue(ticket)
+        self.assertTrue(reader.lock_timeout(1, LOCK_SH))
+        reader.unlock()
+
+    def test_prune_dead(self):
+        """Verify entries of dead processes on this host, or expired, are removed"""
+        pid = os.fork()
+        if not pid:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        with self.uut.FairFlock(self.lockpath)._queue() as state:
+            state[1].append(self.uut.QueueEntry(state[0], pid,
+                                                self.uut.FairFlock.hostname,
+                                                'write', time(), 0))
+            state[1].append(self.uut.QueueEntry(state[0] + 1, 1, 'elsewhere',
+                                                'write', time() - 10, 1))
+            state[0] += 2
+        fairflock = self.uut.FairFlock(self.lockpath)
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertTrue(fairflock.lock_timeout(1, LOCK_EX))
+        self.assertIn('lease expired', logs.output[0])
+        self.assertEqual([entry.pid for entry in self.queued()], [os.getpid()])
+        fairflock.unlock()
+
+    def test_fifo(self):
+        """Verify waiting threads acquire in arrival order"""
+        holder = self.uut.FairFlock(self.lockpath)
+        holder.lock(LOCK_EX)
+        order = []
+        threads = []
+        for name, op in (('first', LOCK_EX), ('second', LOCK_SH),
+                         ('third', LOCK_EX), ('fourth', LOCK_SH)):
+            def _waiter(name=name, op=op):
+                fairflock = self.uut.FairFlock(self.lockpath)
+                fairflock.lock(op)
+                order.append(name)
+                sleep(0.01)
+                fairflock.unlock()
+            threads.append(threading.Thread(target=_waiter))
+            threads[-1].start()
+            # Wait for thread to be queued, so arrival order is known
+            while len(self.queued()) < len(threads) + 1:
+                sleep(0.001)
+        holder.unlock()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(order, ['first', 'second', 'third', 'fourth'])
+
+
+class TestFlockSemaphore(TestCaseBase):
+    """Exercize slot limits and ordering of FlockSemaphore"""
+
+    def setUp(self):
+        super(TestFlockSemaphore, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(TestFlockSemaphore, self).tearDown()
+
+    def test_slots(self):
+        """Verify no more than slots holders at once"""
+        self.assertRaises(ValueError, self.uut.FlockSemaphore, self.path, 0)
+        semaphore = self.uut.FlockSemaphore(self.path, 2)
+        with semaphore.acquire(1) as first:
+            with semaphore.acquire(1) as second:
+                self.assertNotEqual(first.name, second.name)
+                with self.assertLogs(level='ERROR'):
+                    with semaphore.acquire(0.01) as third:
+                        self.assertIsNone(third)
+            with semaphore.acquire(1) as third:
+                self.assertEqual(third.name, second.name)
+        # Slots are plain lock files, without holder records or upgrade gates
+        self.assertEqual([name for name in os.listdir(self.tmpdir)
+                          if name.startswith(('test.lock.0.', 'test.lock.1.'))], [])
+        # Queue is left empty
+        with semaphore.fairflock._queue() as state:
+            self.assertEqual(state[1], [])
+
+    def test_fair(self):
+        """Verify earlier waiters are served first"""
+        semaphore = self.uut.FlockSemaphore(self.path, 1)
+        ticket = semaphore.fairflock._enqueue(LOCK_EX)
+        # Slot file is free, but an earlier waiter is queued
+        with self.assertLogs(level='ERROR'):
+            with semaphore.acquire(0.01) as slot:
+                self.assertIsNone(slot)
+        semaphore.fairflock._dequeue(ticket)
+        with semaphore.acquire(0.01) as slot:
+            self.assertIsNotNone(slot)
+
 
 if __name__ == '__main__':
     unittest.main(failfast=True, catchbreak=True, verbosity=2)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""
+Unittests for lock_service module
+
+Dependencies:
+    - python-2.7
+    - python-unittest2
+    - pylint
+    - test_adept
+"""
+
+import sys
+import threading
+from time import sleep, time
+from fcntl import LOCK_SH, LOCK_EX, LOCK_NB
+import unittest2 as unittest
+import test_adept
+
+
+# For test discovery all test modules must be importable from the top level
+# directory of the project.  No clean way to do this that doesn't depend on
+# knowledge of the repo directory structure somewhere/somehow.
+UUT_REL_PATH = 'kommandir/bin/'
+sys.path.insert(0, UUT_REL_PATH)
+
+# Argument names match the Flock API (e.g. "op")
+test_adept.TestPylint.DISABLE += ",C0103"
+
+
+class TestCaseBase(test_adept.TestCaseBase):
+    """Reuses essental/basic unittest plumbing from adepts unittests"""
+
+    UUT = 'lock_service'
+
+    def setUp(self):
+        super(TestCaseBase, self).setUp()
+        self.uut = __import__(self.UUT)
+
+
+class TestPylint(test_adept.TestPylint):
+    """Reuses essental pylint-plumbing from adepts unittests, for this module"""
+
+    UUT = TestCaseBase.UUT
+
+    def test_unittest_pylint(self):
+        "Run pylint on the unittest module itself"
+        self._pylintrun(__file__)
+
+    def test_uut_pylint(self):
+        "Run pylint on the unit under test"
+        self._pylintrun(self.uut.__file__)
+
+
+class TestLockTable(TestCaseBase):
+    """Exercize lock granting, without networking"""
+
+    def setUp(self):
+        super(TestLockTable, self).setUp()
+        self.table = self.uut.LockTable()
+        self.table.check_interval = 0.01
+
+    def test_sharing(self):
+        """Verify readers share, writers exclude, and release"""
+        first = self.table.acquire('foo', 'read', 0)
+        second = self.table.acquire('foo', 'read', 0)
+        self.assertNotEqual(first, second)
+        self.assertIsNone(self.table.acquire('foo', 'write', 0.01))
+        self.assertTrue(self.table.acquire('bar', 'write', 0))
+        self.assertTrue(self.table.release(first))
+        self.assertFalse(self.table.release(first))
+        self.assertEqual(self.table.release_owner(None), 2)
+        self.assertTrue(self.table.acquire('foo', 'write', 0))
+        self.assertEqual(self.table.status('foo')['holders'][0]['mode'], 'write')
+
+    def test_upgrade(self):
+        """Verify upgrading waits for readers, and concurrent upgrades fail"""
+        first = self.table.acquire('foo', 'read', 0)
+        second = self.table.acquire('foo', 'read', 0)
+        self.assertFalse(self.table.upgrade(first, 0.01))
+        upgraded = []
+        thread = threading.Thread(target=lambda: upgraded.append(
+            self.table.upgrade(first, 5)))
+        thread.start()
+        sleep(0.1)
+        self.assertRaises(IOError, self.table.upgrade, second, 5)
+        # Upgrade has priority over new readers
+        self.assertIsNone(self.table.acquire('foo', 'read', 0.01))
+        self.table.release(second)
+        thread.join(5)
+        self.assertEqual(upgraded, [True])
+        self.table.downgrade(first)
+        self.assertTrue(self.table.acquire('foo', 'read', 0))
+        self.assertRaises(KeyError, self.table.downgrade, second)
+
+    def test_lease(self):
+        """Verify holders which don't renew leases lose them"""
+        holder = self.table.acquire('foo', 'write', 0, lease=0.1)
+        with self.assertLogs(level='WARNING'):
+            self.assertTrue(self.table.acquire('foo', 'write', 5))
+        self.assertRaises(KeyError, self.table.renew, holder)
+
+
+class TestRemoteFlock(TestCaseBase):
+    """Exercize client against a locally running service"""
+
+    def setUp(self):
+        super(TestRemoteFlock, self).setUp()
+        self.server = self.uut.LockServer(('127.0.0.1', 0))
+        self.server.table.check_interval = 0.01
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.clients = []
+
+    def tearDown(self):
+        # Module is unloaded by super-class
+        for client in self.clients:
+            client.close()
+        start = time()
+        while self.server.table.tokens and time() - start < 5:
+            sleep(0.01)
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super(TestRemoteFlock, self).tearDown()
+
+    def client(self, lease=None):
+        """Return new RemoteFlock connected to the service"""
+        client = self.uut.RemoteFlock('%s:%d' % self.server.server_address, 'test', lease)
+        self.clients.append(client)
+        return client
+
+    def test_locking(self):
+        """Verify Flock-compatible locking methods"""
+        reader = self.client()
+        writer = self.client()
+        with reader.acquire_read() as token:
+            self.assertTrue(token)
+            self.assertTrue(writer.is_locked)
+            self.assertTrue(self.client().lock(LOCK_SH | LOCK_NB))
+            with self.assertLogs(level='ERROR'):
+                with writer.timeout_acquire_write(0.01) as token:
+                    self.assertIsNone(token)
+            with self.assertRaises(IOError):
+                writer.lock(LOCK_EX | LOCK_NB)
+            self.clients.pop().close()  # Releases with connection
+        self.assertTrue(writer.lock_timeout(1, LOCK_EX))
+        self.assertFalse(writer.is_read)
+        self.assertTrue(writer.downgrade())
+        self.assertTrue(reader.lock_timeout(0, LOCK_SH))
+        self.assertIsNone(writer.upgrade(0.01))
+        self.assertTrue(writer.unlock())
+        self.assertFalse(writer.unlock())
+
+    def test_lease(self):
+        """Verify leases are renewed, or lost"""
+        holder = self.client(0.2)
+        holder.lock(LOCK_EX)
+        self.assertIsNone(self.client().lock_timeout(0.5, LOCK_EX))
+        holder._renewer.stop()  # Hung
+        with self.assertLogs(level='WARNING'):
+            self.assertTrue(self.client().lock_timeout(5, LOCK_EX))
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(holder._renew())
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True, catchbreak=True, verbosity=2)
@@ -14,8 +14,16 @@ Dependencies:
 """
 
 import sys
+import os
+import re
+import shutil
+import socket
+import threading
+from tempfile import mkdtemp
+from StringIO import StringIO
 from urlparse import urlparse
 from urlparse import urlunparse
+from urlparse import parse_qs
 import json as simplejson
 import unittest2 as unittest
 # ref: http://www.voidspace.org.uk/python/mock/index.html
@@ -204,6 +212,17 @@ class TestParsedArgs(TestCaseBase):
                               parsed_args=parsed_args):
                 self.assertDictContainsSubset(op_expected[operation], parsed_args)
 
+    def test_batch_create(self):
+        """Verify batch names are listed, or generated from a template"""
+        parsed_args = self.uut.parse_args(['binary', '--name', 'foo', '--template',
+                                           'bar{index}', '--count', '2', 'baz'],
+                                          'batch_create')
+        self.assertEqual(parsed_args['names'], ['foo', 'bar0', 'bar1'])
+        self.assertEqual(parsed_args['pub_key_files'], ['baz'])
+        self.assertFalse(self.error.called)
+        self.uut.parse_args(['binary', '-N', 'foo', '-N', 'foo', 'baz'], 'batch_create')
+        self.assertTrue(self.error.called)
+
 
 class TestMain(TestCaseBase):
     """Test main function"""
@@ -280,6 +299,118 @@ class TestMain(TestCaseBase):
         self.assertFalse(self.discover.called)
         self.assertTrue(self.destroy.called)
 
+    def test_batch_create(self):
+        """Test main calls only the batch_create function"""
+        batch_create = Mock(spec=self.uut.batch_create)
+        self.create_patch('%s.batch_create' % self.UUT, batch_create)
+        self.uut.main(['openstack_batch_create.py', '-N', 'foobar', 'snafu'],
+                      dict(operation='batch_create', names=['foobar']),
+                      self.service_sessions)
+        self.assertFalse(self.create.called)
+        self.assertFalse(self.discover.called)
+        self.assertTrue(batch_create.called)
+
+
+class TestBroker(TestCaseBase):
+    """Test broker operation handling and thin client"""
+
+    def setUp(self):
+        super(TestBroker, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.socket_path = os.path.join(self.tmpdir, self.uut.BROKER_SOCKET)
+        self.destroy = Mock(spec=self.uut.destroy)
+        self.create_patch('%s.destroy' % self.UUT, self.destroy)
+
+    def handle(self, argv):
+        """Return exit code and list of messages from broker_handle() of argv"""
+        server, client = socket.socketpair()
+        self.uut.broker_write(client.makefile('wb', 0), argv=argv)
+        try:
+            code = self.uut.broker_handle(server, FakeServiceSessions(FakeSession()),
+                                          self.tmpdir)
+        finally:
+            server.close()
+        messages = [simplejson.loads(line) for line in client.makefile('rb')]
+        client.close()
+        return code, messages
+
+    def test_handle(self):
+        """Verify operation output is forwarded, then the exit code"""
+        stdout = sys.stdout
+        self.destroy.side_effect = lambda **dargs: sys.stdout.write(dargs['name'])
+        code, messages = self.handle(['openstack_destroy.py', 'foobar'])
+        self.assertEqual(code, 0)
+        self.assertIn({'stream': 'stdout', 'data': 'foobar'}, messages)
+        self.assertTrue(any('Destroying VM foobar' in message.get('data', '')
+                            for message in messages))
+        self.assertEqual(messages[-1], {'exit': 0})
+        self.assertIs(sys.stdout, stdout)
+
+    def test_handle_exception(self):
+        """Verify unhandled exceptions are reported, and exit non-zero"""
+        self.destroy.side_effect = RuntimeError("Unittest error message")
+        code, messages = self.handle(['openstack_destroy.py', 'foobar'])
+        self.assertEqual(code, 1)
+        self.assertIn('RuntimeError: Unittest error message', messages[-2]['data'])
+        self.assertEqual(messages[-1], {'exit': 1})
+
+    def test_client(self):
+        """Verify client forwards output and exit code, or returns None"""
+        self.assertIsNone(self.uut.broker_client(self.socket_path, ['foo']))
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(1)
+
+        def serve():  # pylint: disable=C0111
+            conn = server.accept()[0]
+            writer = conn.makefile('wb', 0)
+            self.uut.broker_write(writer, stream='stdout',
+                                  data=conn.makefile('rb').readline())
+            self.uut.broker_write(writer, exit=3)
+            conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        stdout = StringIO()
+        with patch('%s.sys.stdout' % self.UUT, stdout):
+            code = self.uut.broker_client(self.socket_path, ['openstack_destroy.py', 'foo'])
+        thread.join()
+        server.close()
+        self.assertEqual(code, 3)
+        self.assertEqual(simplejson.loads(stdout.getvalue()),
+                         {'argv': ['openstack_destroy.py', 'foo']})
+        # Left behind by killed broker
+        self.assertIsNone(self.uut.broker_client(self.socket_path, ['foo']))
+
+
+class TestCreationSlot(TestCaseBase):
+    """Test creation_slot context manager"""
+
+    def setUp(self):
+        super(TestCreationSlot, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        patcher = patch('%s.TimeoutAction.timeout' % self.UUT, 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited(self):
+        """Verify no locking happens by default"""
+        with self.uut.creation_slot(0, self.tmpdir):
+            with self.uut.creation_slot(None, self.tmpdir):
+                pass
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_limited(self):
+        """Verify timeout waiting for slot raises"""
+        with self.uut.creation_slot(1, self.tmpdir):
+            with self.assertRaisesRegex(RuntimeError, 'one of 1 VM creation'):
+                with self.uut.creation_slot(1, self.tmpdir):
+                    pass
+        with self.uut.creation_slot(1, self.tmpdir):
+            pass
+
 
 class TestVirtEnvPlaceholders(TestCaseBase):
     """Test expected virtualenv module placeholders"""
@@ -304,9 +435,167 @@ class TestOpenstackREST(TestCaseBase):
             self.assertEqual(inst.service_sessions, self.service_sessions)
             self.assertIsNone(inst.response_json)
             self.assertIsNone(inst.response_obj)
-            self.assertEqual(inst.previous_responses, [])
+            self.assertEqual(list(inst.previous_responses), [])
             self.assertIsNotNone(inst.service_sessions)
 
+    def test_response_cache(self):
+        """Test GETs are answered from cache only when fresh enough, until POST"""
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.json.return_value = dict(servers=[dict(name='foo')])
+        session.post.return_value.status_code = 202
+        os_rest = self.uut.OpenstackREST(dict(compute=session))
+        self.assertEqual(os_rest.server_list(max_age=60), ['foo'])
+        self.assertEqual(os_rest.server_list(max_age=60), ['foo'])
+        self.assertTrue(os_rest.response_cached)
+        self.assertEqual(session.get.call_count, 1)
+        os_rest.server_list(max_age=-1)  # Always too old
+        self.assertEqual(session.get.call_count, 2)
+        os_rest.compute_request('/servers', method='post', post_json={})
+        os_rest.server_list(max_age=60)
+        self.assertEqual(session.get.call_count, 3)
+        # Cached responses aren't repeated in history
+        self.assertEqual(len(os_rest.previous_responses), 3)
+        # Only requests made with max_age are kept, and only the newest of those
+        os_rest.compute_request('/other')
+        self.assertNotIn(('compute', '/other'), os_rest.response_cache)
+        os_rest.cache_entries = 2
+        for uri in ('/a', '/b', '/c'):
+            os_rest.compute_request(uri, max_age=60)
+        self.assertEqual(sorted(os_rest.response_cache),
+                         [('compute', '/b'), ('compute', '/c')])
+
+    def test_response_cache_threads(self):
+        """Test threads sharing the response cache never exceed its size"""
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.json.return_value = {}
+        os_rest = self.uut.OpenstackREST(dict(compute=session))
+        os_rest.cache_entries = 2
+        failures = []
+
+        def requests(thread_num):
+            """Make cached requests, recording any exception"""
+            try:
+                for num in xrange(100):
+                    os_rest.compute_request('/%d/%d' % (thread_num, num % 5),
+                                            max_age=60)
+            except Exception as xcept:  # pylint: disable=W0703
+                failures.append(xcept)
+
+        threads = [threading.Thread(target=requests, args=(num,))
+                   for num in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+        self.assertEqual(len(os_rest.response_cache), 2)
+
+    def test_history(self):
+        """Test history discards oldest responses beyond the count or bytes"""
+        history = self.uut.ResponseHistory(max_count=3, max_bytes=10)
+        for content in ('a', 'bb', 'ccc', 'dddd'):
+            history.append(Mock(content=content))
+        self.assertEqual([response.content for response in history], ['bb', 'ccc', 'dddd'])
+        self.assertEqual(history.nbytes, 9)
+        history.append(Mock(content='e' * 20))  # Newest is always kept
+        self.assertEqual([response.content for response in history], ['e' * 20])
+        history.append(Mock())  # Unknown size
+        self.assertEqual((len(history), history.nbytes), (1, 0))
+
+    def test_recorder(self):
+        """Test every received response is streamed to the recorder file"""
+        tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        session = Mock()
+        session.get.return_value = Mock(status_code=200,
+                                        json=Mock(return_value=dict(servers=[])))
+        session.get.return_value.request.method = 'GET'
+        session.get.return_value.request.url = 'http://x/servers'
+        os_rest = self.uut.OpenstackREST(dict(compute=session))
+        os_rest.recorder = self.uut.ResponseRecorder(os.path.join(tmpdir, 'record.jsonl'))
+        os_rest.server_list(max_age=60)
+        os_rest.server_list(max_age=60)  # Cached, not received again
+        os_rest.server_list()
+        os_rest.recorder.close()
+        with open(os_rest.recorder.path, 'rb') as recorded:
+            lines = [simplejson.loads(line) for line in recorded]
+        self.assertEqual(lines, [{'GET': 'http://x/servers', 'response': dict(servers=[]),
+                                  'status_code': 200, 'sequence_number': number}
+                                 for number in (0, 10)])
+
+    def test_server_details(self):
+        """Test detailed listing follows next links with last server as marker"""
+        pages = {
+            '/servers/detail?limit=2': dict(
+                servers=[dict(id='a'), dict(id='b')],
+                servers_links=[dict(rel='next', href='http://x/servers/detail?marker=b')]),
+            '/servers/detail?limit=2&marker=b': dict(servers=[dict(id='c')])}
+        session = Mock()
+        session.get.side_effect = lambda uri: Mock(status_code=200,
+                                                   json=Mock(return_value=pages[uri]))
+        os_rest = self.uut.OpenstackREST(dict(compute=session))
+        os_rest.page_size = 2
+        self.assertEqual([details['id'] for details in os_rest.server_details()],
+                         ['a', 'b', 'c'])
+        self.assertEqual(session.get.call_count, 2)
+
+    def test_filters(self):
+        """Test listings request filtered pages, and only return exact matches"""
+        pages = {
+            '/servers?limit=2&name=%5Ea%5C.b%24': dict(
+                servers=[dict(id='1', name='a.b'), dict(id='2', name='a.b.c')]),
+            '/v2.0/floatingips?limit=2&floating_network_id=net&status=DOWN': dict(
+                floatingips=[dict(id='1', floating_ip_address='1.1.1.1', status='DOWN',
+                                  floating_network_id='net')],
+                floatingips_links=[dict(rel='next', href='http://x/v2.0/floatingips')]),
+            '/v2.0/floatingips?limit=2&floating_network_id=net&status=DOWN&marker=1': dict(
+                floatingips=[dict(id='2', floating_ip_address='2.2.2.2', status='DOWN',
+                                  floating_network_id='net')]),
+            '/volumes?limit=2&name=foo': dict(volumes=[dict(id='v1', name='foo')])}
+        session = Mock()
+        session.get.side_effect = lambda uri: Mock(status_code=200,
+                                                   json=Mock(return_value=pages[uri]))
+        os_rest = self.uut.OpenstackREST(dict(compute=session, network=session,
+                                              volume=session))
+        os_rest.page_size = 2
+        self.assertEqual(os_rest.server_list(key='id', name='a.b'), ['1'])
+        self.assertEqual([floating['id'] for floating in os_rest.floating_ips('net', 'DOWN')],
+                         ['1', '2'])
+        os_rest.float_ip_selector = lambda found: found[-1]
+        self.assertEqual(os_rest.floating_ip('net'), '2.2.2.2')
+        self.assertEqual(os_rest.volume_list(name='foo'), ['v1'])
+
+    def test_thread_state(self):
+        """Test response state is separate for every thread"""
+        session = Mock()
+        session.get.side_effect = lambda uri: Mock(status_code=200,
+                                                   json=Mock(return_value=dict(uri=uri)))
+        os_rest = self.uut.OpenstackREST(dict(compute=session))
+        os_rest.compute_request('/main')
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(
+            (os_rest.response_json, os_rest.compute_request('/other'))))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [(None, dict(uri='/other'))])
+        self.assertEqual(os_rest.response_json, dict(uri='/main'))
+
+    def test_rate_limited(self):
+        """Test rate limited requests are retried, until retries run out"""
+        limited = Mock(status_code=429, headers={'Retry-After': '0'})
+        session = Mock()
+        session.get.side_effect = [limited, Mock(status_code=200)]
+        os_rest = self.uut.OpenstackREST(dict(compute=session))
+        with self.assertLogs(level='WARNING'):
+            os_rest.compute_request('/servers')
+        self.assertEqual(os_rest.response_code, 200)
+        os_rest.rate_limit_retries = 1
+        session.get.side_effect = [limited, limited]
+        with self.assertLogs(level='WARNING'):
+            self.assertRaisesRegex(ValueError, '429', os_rest.compute_request, '/servers')
+
     def test_child_search(self):
         """Test expected exceptions/output from child_search)"""
         whipping_boy = self.uut.OpenstackREST(self.service_sessions)
@@ -331,6 +620,312 @@ class TestOpenstackREST(TestCaseBase):
                              test_json[1])
 
 
+class TestLookupCache(TestCaseBase):
+    """Test sharing of lookups between processes through a lock file"""
+
+    def setUp(self):
+        super(TestLookupCache, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        # Cache store needs real locking
+        self.create_patch('%s.Flock' % self.UUT, __import__('flock').Flock)
+        self.lockfilepath = os.path.join(self.tmpdir, 'cache.lock')
+        self.lookup = Mock(return_value='id1')
+
+    def test_shared(self):
+        """Verify one lookup serves every cache of the same cloud, until forgotten"""
+        first = self.uut.LookupCache(self.lockfilepath, 60, 'cloud')
+        second = self.uut.LookupCache(self.lockfilepath, 60, 'cloud')
+        self.assertEqual(first.get('flavor:foo', self.lookup), 'id1')
+        self.assertEqual(second.get('flavor:foo', self.lookup), 'id1')
+        self.assertEqual(self.lookup.call_count, 1)
+        other = self.uut.LookupCache(self.lockfilepath, 60, 'other')
+        other.get('flavor:foo', self.lookup)
+        self.assertEqual(self.lookup.call_count, 2)
+        second.forget('flavor:foo')
+        first.get('flavor:foo', self.lookup)
+        self.assertEqual(self.lookup.call_count, 3)
+
+    def test_invalid(self):
+        """Verify expired and malformed records are looked up again"""
+        cache = self.uut.LookupCache(self.lockfilepath, -1, 'cloud')  # Always expired
+        cache.get('image:foo', self.lookup)
+        cache.get('image:foo', self.lookup)
+        self.assertEqual(self.lookup.call_count, 2)
+        cache.ttl = 60
+        with cache.store.lock.acquire_write():
+            cache.store.set('cloud:image:foo', 'garbage')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(cache.get('image:foo', self.lookup), 'id1')
+        self.assertEqual(self.lookup.call_count, 3)
+
+    def test_disabled(self):
+        """Verify OpenstackREST looks up every time without a cache"""
+        os_rest = self.uut.OpenstackREST(dict(compute=Mock()))
+        os_rest.cached_lookup('flavor:foo', self.lookup)
+        os_rest.cached_lookup('flavor:foo', self.lookup)
+        os_rest.forget_lookups('flavor:foo')
+        self.assertEqual(self.lookup.call_count, 2)
+
+
+class TestFloatingIPPool(TestCaseBase):
+    """Test handing out floating IPs reserved through a lock file"""
+
+    def setUp(self):
+        super(TestFloatingIPPool, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        # Pool store needs real locking
+        self.create_patch('%s.Flock' % self.UUT, __import__('flock').Flock)
+        self.lockfilepath = os.path.join(self.tmpdir, 'pool.lock')
+        self.floatingips = [dict(floating_ip_address='1.1.1.%d' % index,
+                                 floating_network_id='net1', status='DOWN')
+                            for index in xrange(3)]
+        self.floatingips.append(dict(floating_ip_address='2.2.2.2',
+                                     floating_network_id='net1', status='ACTIVE'))
+        self.floatingips.append(dict(floating_ip_address='3.3.3.3',
+                                     floating_network_id='net2', status='DOWN'))
+        self.session = Mock()
+        self.session.get.side_effect = lambda uri: Mock(
+            status_code=200, json=Mock(return_value=dict(floatingips=self.floatingips)))
+        self.session.post.return_value = Mock(
+            status_code=201, json=Mock(return_value=dict(floatingip=dict(
+                floating_ip_address='4.4.4.4'))))
+        self.compute = Mock()
+        self.compute.post.return_value = Mock(status_code=202)
+        self.uut.OpenstackREST(dict(network=self.session, compute=self.compute))
+
+    def test_shared(self):
+        """Verify pools hand out distinct DOWN addresses from one listing"""
+        first = self.uut.FloatingIPPool(self.lockfilepath, 2)
+        second = self.uut.FloatingIPPool(self.lockfilepath, 2)
+        addresses = set([first.reserve('net1', 5), second.reserve('net1', 5)])
+        self.assertEqual(len(addresses), 2)
+        self.assertTrue(addresses.issubset(set(['1.1.1.0', '1.1.1.1', '1.1.1.2'])))
+        self.assertEqual(self.session.get.call_count, 1)
+        # Pool is empty, so listed again
+        third = first.reserve('net1', 5)
+        self.assertNotIn(third, addresses)
+        self.assertEqual(self.session.get.call_count, 2)
+        self.assertFalse(self.session.post.called)
+
+    def test_create(self):
+        """Verify an address is created when none are free"""
+        pool = self.uut.FloatingIPPool(self.lockfilepath, 5)
+        self.assertEqual(pool.reserve('net2', 5), '3.3.3.3')
+        self.assertEqual(pool.reserve('net2', 5), '4.4.4.4')
+        self.assertEqual(self.session.post.call_count, 1)
+
+    def test_release(self):
+        """Verify released and expired reservations may be handed out again"""
+        pool = self.uut.FloatingIPPool(self.lockfilepath, 1)
+        self.floatingips = self.floatingips[:1]
+        self.assertEqual(pool.reserve('net1', 5), '1.1.1.0')
+        self.assertEqual(pool.reserve('net1', 5), '4.4.4.4')
+        pool.release('net1', '1.1.1.0')
+        self.assertEqual(pool.reserve('net1', 5), '1.1.1.0')
+        pool.lease = -1  # Always expired
+        self.assertEqual(pool.reserve('net1', 5), '1.1.1.0')
+        self.assertEqual(self.session.post.call_count, 1)
+
+    def test_assign(self):
+        """Verify reserved address is assigned once, and released when seen"""
+        pool = self.uut.FloatingIPPool(self.lockfilepath, 1)
+        assign = self.uut.TimeoutAssignFloatingIP.__new__(self.uut.TimeoutAssignFloatingIP)
+        assign.os_rest = self.uut.OpenstackREST()
+        assign.pool = pool
+        assign.time_out_at = float('inf')
+        server_ip = self.create_patch('%s.OpenstackREST.server_ip' % self.UUT, None)
+        server_ip.return_value = None
+        self.assertIsNone(assign.am_done('id1', 'net', 'net1'))
+        self.assertIsNone(assign.am_done('id1', 'net', 'net1'))
+        self.assertEqual(self.compute.post.call_count, 1)
+        server_ip.return_value = assign.reserved
+        self.assertEqual(assign.am_done('id1', 'net', 'net1'), server_ip.return_value)
+        self.assertIsNone(assign.reserved)
+        with pool.store.lock.acquire_read():
+            self.assertEqual(pool.store.get('net1')['reserved'], {})
+
+
+class TestParallelReap(TestCaseBase):
+    """Test reap function destroying servers concurrently"""
+
+    def setUp(self):
+        super(TestParallelReap, self).setUp()
+        servers = [{'id': 'id%d' % index, 'name': 'peon%d' % index,
+                    'metadata': {'preserve': '1'},
+                    'OS-SRV-USG:launched_at': '2001-01-01T01:01:01.01'}
+                   for index in xrange(6)]
+        session = Mock()
+        session.get.return_value = Mock(status_code=200,
+                                        json=Mock(return_value=dict(servers=servers)))
+        self.uut.OpenstackREST(dict(compute=session))
+        self.threads = set()
+        self.create_patch('%s.destroy' % self.UUT, self.fake_destroy)
+
+    def fake_destroy(self, uuid):
+        """Stand-in for actual destruction function, fails for id3"""
+        self.threads.add(threading.current_thread().ident)
+        if uuid == 'id3':
+            raise RuntimeError("Unittest error message")
+
+    def test_parallel(self):
+        """Verify every server is destroyed by workers, and failures isolated"""
+        with self.assertLogs(level='WARNING') as context:
+            summary = self.uut.reap(parallel=3)
+        self.assertIn('Unittest error message', ' '.join(context.output))
+        self.assertEqual(summary['expired'], 6)
+        self.assertEqual(sorted(summary['destroyed']),
+                         ['peon0', 'peon1', 'peon2', 'peon4', 'peon5'])
+        self.assertEqual(summary['failed'], {'peon3': 'Unittest error message'})
+        self.assertNotIn(threading.current_thread().ident, self.threads)
+
+    def test_dryrun(self):
+        """Verify dry-run mode destroys nothing"""
+        summary = self.uut.reap(dry_run=True, parallel=3)
+        self.assertEqual(summary, dict(expired=6, destroyed=[], failed={}))
+        self.assertEqual(self.threads, set())
+
+
+class FakeCloud(object):
+    """
+    Standin for a compute session, new servers become active on the second listing
+
+    Servers named with "broken" end up in an error state, creating servers
+    named with "reject" fails, and every request is recorded.
+    """
+
+    def __init__(self, existing=()):
+        self.servers = [dict(id='old-%s' % name, name=name, listings=2)
+                        for name in existing]
+        self.requests = []
+
+    @staticmethod
+    def response(status_code=200, **json_obj):
+        """Return Mock resembling a requests response of json_obj"""
+        return Mock(status_code=status_code, json=Mock(return_value=json_obj))
+
+    def details(self, server):
+        """Return details dictionary of server"""
+        if 'broken' in server['name']:
+            vm_state = 'error'
+        elif server['listings'] >= 2:
+            vm_state = 'active'
+        else:
+            vm_state = 'building'
+        addr = '10.0.0.%d' % self.servers.index(server)
+        return {'id': server['id'], 'name': server['name'],
+                'OS-EXT-STS:vm_state': vm_state,
+                'OS-EXT-STS:power_state': int(vm_state == 'active'),
+                'addresses': {'private': [{'OS-EXT-IPS:type': 'fixed', 'addr': addr}]}}
+
+    def get(self, uri):
+        """Respond to flavor, image, server listing, or server details request"""
+        self.requests.append(('GET', uri))
+        path = urlparse(uri).path
+        if path == '/flavors':
+            return self.response(flavors=[dict(name='m1.medium', id='flavor1')])
+        if path == '/v2/images':
+            return self.response(images=[dict(name='CentOS-Cloud-7', id='image1')])
+        pattern = parse_qs(urlparse(uri).query).get('name', ['.*'])[0]
+        if path == '/servers':
+            return self.response(servers=[dict(id=server['id'], name=server['name'])
+                                          for server in self.servers
+                                          if re.match(pattern, server['name'])])
+        if path == '/servers/detail':
+            listed = [server for server in self.servers if re.match(pattern, server['name'])]
+            for server in listed:
+                server['listings'] += 1
+            return self.response(servers=[self.details(server) for server in listed])
+        for server in self.servers:
+            if path == '/servers/%s' % server['id']:
+                return self.response(server=self.details(server))
+        return self.response(404)
+
+    def post(self, uri, json):
+        """Respond to server creation request"""
+        self.requests.append(('POST', uri))
+        name = json['server']['name']
+        if 'reject' in name:
+            return self.response(400)
+        self.servers.append(dict(id='id-%s' % name, name=name, listings=0))
+        return self.response(202, server=dict(id=self.servers[-1]['id']))
+
+
+class TestBatchCreate(TestCaseBase):
+    """Test batch_create function creating and discovering many servers"""
+
+    def setUp(self):
+        super(TestBatchCreate, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.pubkey = os.path.join(self.tmpdir, 'key.pub')
+        with open(self.pubkey, 'wb') as pubkey:
+            pubkey.write('ssh-rsa AAAA unittest\n')
+        self.cloud = FakeCloud(existing=['peon0'])
+        self.uut.OpenstackREST(FakeServiceSessions(self.cloud))
+        self.destroy = Mock(spec=self.uut.destroy)
+        self.create_patch('%s.destroy' % self.UUT, self.destroy)
+        self.create_patch('%s.time.sleep' % self.UUT, lambda seconds: None)
+
+    def batch_create(self, names):
+        """Return stdout and exception message from batch_create() of names"""
+        with patch('%s.sys.stdout' % self.UUT, new=StringIO()) as stdout:
+            with self.assertRaises(RuntimeError) as context:
+                self.uut.batch_create(names, [self.pubkey], 'CentOS-Cloud-7',
+                                      'm1.medium', private=True)
+        return stdout.getvalue(), str(context.exception)
+
+    def test_batch(self):
+        """Verify servers are polled together, and only failed ones destroyed"""
+        names = ['peon0', 'peon1', 'broken', 'peon2', 'reject', 'peon3']
+        with self.assertLogs(level='ERROR'):
+            stdout, error = self.batch_create(names)
+        self.assertIn('broken, reject', error)
+        self.assertEqual(stdout.count('---'), 4)
+        for index in xrange(4):
+            self.assertIn('host_name: peon%d\n' % index, stdout)
+        self.assertIn('host_uuid: old-peon0\n', stdout)
+        # Discovery only lists the requested servers
+        self.assertIn('name=%5E%28broken%7Cpeon0%7Cpeon1%7Cpeon2%7Cpeon3%7Creject%29%24',
+                      self.cloud.requests[0][1])
+        self.assertEqual(self.cloud.requests.count(('POST', '/servers')), 5)
+        details = [uri for _, uri in self.cloud.requests
+                   if uri.startswith('/servers/detail')]
+        self.assertEqual(len(details), 2)
+        # Only pending servers are listed
+        self.assertIn('name=%5E%28broken%7Cpeon1%7Cpeon2%7Cpeon3%29%24', details[0])
+        self.destroy.assert_called_once_with(uuid='id-broken')
+
+    def test_waves(self):
+        """Verify no more than max_parallel servers are submitted at once"""
+        self.create_patch('%s.Flock' % self.UUT, __import__('flock').Flock)
+        with patch('%s.sys.stdout' % self.UUT, new=StringIO()) as stdout:
+            hosts = self.uut.batch_create(['peon%d' % index for index in xrange(5)],
+                                          [self.pubkey], 'CentOS-Cloud-7', 'm1.medium',
+                                          private=True, max_parallel=2, lockdir=self.tmpdir)
+        self.assertEqual(len(hosts), 5)
+        self.assertEqual(stdout.getvalue().count('---'), 5)
+        submitted = 0
+        for method, uri in self.cloud.requests:
+            if method == 'POST':
+                submitted += 1
+                self.assertLessEqual(submitted, 2)
+            elif uri.startswith('/servers/detail'):
+                submitted = 0
+
+    def test_timeout(self):
+        """Verify every server not active by the timeout is destroyed"""
+        self.uut.TimeoutBatchCreate.timeout = 0
+        with self.assertLogs(level='ERROR'):
+            stdout, error = self.batch_create(['peon0', 'peon1', 'peon2'])
+        self.assertIn('2 of 3', error)
+        self.assertIn('host_name: peon0\n', stdout)
+        self.assertEqual(stdout.count('---'), 1)
+        self.assertEqual(sorted(self.destroy.call_args_list),
+                         [(dict(uuid='id-peon1'),), (dict(uuid='id-peon2'),)])
+
+
 class TestDiscoverCreateDestroyBase(TestCaseBase):
     """Base class for discover, create, and delete testing fixtures"""
 
@@ -469,6 +1064,118 @@ class TestTimeoutAction(TestDiscoverCreateDestroyBase):
         self.assertEqual(self.fake_time_value, expected)
 
 
+class TestPolling(TestDiscoverCreateDestroyBase):
+    """Test TimeoutAction polling strategies under mocked time.time"""
+
+    def setUp(self):
+        super(TestPolling, self).setUp()
+        self.tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.polls = 0
+        testcase = self
+
+        # pylint: disable=E1003,E1002,E0213,E1101,R0201,E1102,W0232
+        class SlowAction(self.uut.TimeoutAction):
+            """Done 100 seconds after starting at 123456"""
+            timeout = 1000
+            def am_done(inner_self):
+                """docstring"""
+                testcase.polls += 1
+                if testcase.fake_time_value >= 123456 + 100:
+                    return True
+
+        self.action = SlowAction
+
+    def run_action(self, poll):
+        """Return number of polls, and seconds late, for action done using poll"""
+        self.fake_time_value = 123456
+        self.polls = 0
+        self.action.poll = poll
+        self.assertTrue(self.action()())  # pylint: disable=E1102
+        return self.polls, self.fake_time_value - (123456 + 100)
+
+    def test_exponential(self):
+        """Verify exponential strategy sleeps grow up to the cap, with fewer polls"""
+        poll = self.uut.PollExponential(initial=0.5, factor=2, cap=4)
+        delays = poll.delays(self.action())
+        self.assertEqual([next(delays) for _ in xrange(5)], [0.5, 1, 2, 4, 4])
+        fixed_polls, _ = self.run_action(self.uut.PollFixed())
+        exponential_polls, late = self.run_action(poll)
+        self.assertLess(exponential_polls * 2, fixed_polls)
+        self.assertLessEqual(late, 8)
+
+    def test_predictive(self):
+        """Verify predictive strategy learns completion times, shared by lock file"""
+        lockfilepath = os.path.join(self.tmpdir, 'history.lock')
+        # History store needs real locking
+        self.create_patch('%s.Flock' % self.UUT, __import__('flock').Flock)
+        poll = self.uut.PollPredictive(lockfilepath, cap=60)
+        self.assertIsNone(poll.predicted(self.action()))
+        learning = [self.run_action(poll) for _ in xrange(self.uut.PollPredictive.minimum)]
+        other = self.uut.PollPredictive(lockfilepath, cap=60)
+        self.assertEqual(len(other.completions(self.action())),
+                         self.uut.PollPredictive.minimum)
+        polls, late = self.run_action(other)
+        # Detected sooner, with fewer polls, than while learning
+        self.assertLess(polls, min(learning)[0])
+        self.assertLess(late, min(learning)[1])
+
+
+class TestTimeoutScheduler(TestDiscoverCreateDestroyBase):
+    """Test TimeoutScheduler polling many actions under mocked time.time"""
+
+    def setUp(self):
+        super(TestTimeoutScheduler, self).setUp()
+        self.session = Mock()
+        self.session.get.return_value = Mock(status_code=200,
+                                             json=Mock(return_value=dict(server={})))
+        self.uut.OpenstackREST(dict(compute=self.session))
+        self.polls = []
+
+        # pylint: disable=E1003,E1002,E0213,E1101,R0201,E1102,W0232
+        class ServerAction(self.uut.TimeoutAction):
+            """Done on the given poll, fetching server details every poll"""
+            timeout = 30
+            def am_done(inner_self, name, done_on):
+                """docstring"""
+                self.polls.append(name)
+                self.uut.OpenstackREST().compute_request('/servers/foo', 'server')
+                if done_on is None:
+                    raise ValueError("Unittest error message")
+                if self.polls.count(name) >= done_on:
+                    return name
+
+        self.action = ServerAction
+        # Fake time advances on every call
+        self.scheduler = self.uut.TimeoutScheduler(coalesce=3)
+
+    def test_interleaved(self):
+        """Verify actions are polled together, sharing identical requests"""
+        first = self.scheduler.add(self.action('first', 3))
+        second = self.scheduler.add(self.action('second', 5))
+        results = self.scheduler.run()
+        self.assertEqual(results, {first: 'first', second: 'second'})
+        self.assertEqual(self.polls[:4], ['first', 'second', 'first', 'second'])
+        self.assertEqual(self.session.get.call_count, 5)
+        self.scheduler.raise_first()  # Nothing to raise
+
+    def test_failures(self):
+        """Verify failures and timeouts only end their own action"""
+        chained = []
+        broken = self.scheduler.add(self.action('broken', None))
+        slow = self.scheduler.add(self.action('slow', 1000))
+        fast = self.scheduler.add(self.action('fast', 2), lambda result: chained.append(
+            self.scheduler.add(self.action('chained', 1))))
+        results = self.scheduler.run()
+        self.assertIsInstance(results[broken], ValueError)
+        self.assertIsInstance(results[slow], RuntimeError)
+        self.assertEqual(results[fast], 'fast')
+        self.assertEqual(results[chained[0]], 'chained')
+        self.assertEqual(self.polls.count('broken'), 1)
+        self.assertRaisesRegex(ValueError, 'Unittest error message',
+                               self.scheduler.raise_first)
+
+
 class TestDiscoverCreate(TestDiscoverCreateDestroyBase):
     """Test discover function with mocked keystone_session"""
 